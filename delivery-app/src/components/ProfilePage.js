@@ -58,10 +58,10 @@ function ProfilePage() {
     const itemsPerPage = 5;
 
     useEffect(() => {
-        async function fetchUserData() {
+        async function fetchProfileSummary() {
             try {
                 const userCookie = getCookieByName('user');
-                const response = await fetch(`${BACKEND_URL}/profile`, {
+                const response = await fetch(`${BACKEND_URL}/profile/summary`, {
                     headers: {
                         'Content-Type': 'application/json',
                         'Authorization': 'Bearer ' + userCookie,
@@ -73,86 +73,28 @@ function ProfilePage() {
                 }
 
                 const data = await response.json();
-                setUserData({
-                    username: data.username,
-                    name: data.name,
-                    birthDate: data.birthDate || '',
-                    address: data.address || '',
-                    phone: data.phone || '',
-                    description: data.description || '',
-                });
-                setNewDescription(data.description || '');
-            } catch (error) {
-                console.error('Ошибка получения профиля:', error);
-            }
-        }
-
-        async function fetchFavorites() {
-            try {
-                const userCookie = getCookieByName('user');
-                const response = await fetch(`${BACKEND_URL}/profile/favorites`, {
-                    headers: {
-                        'Content-Type': 'application/json',
-                        'Authorization': 'Bearer ' + userCookie,
-                    },
-                });
-
-                if (!response.ok) {
-                    throw new Error('Ошибка получения избранного');
+                const profile = data.profile;
+                // profile равен null, если строки профиля нет; списки показываем все равно
+                if (profile) {
+                    setUserData({
+                        username: profile.username,
+                        name: profile.name,
+                        birthDate: profile.birthDate || '',
+                        address: profile.address || '',
+                        phone: profile.phone || '',
+                        description: profile.description || '',
+                    });
+                    setNewDescription(profile.description || '');
                 }
-
-                const data = await response.json();
                 setFavorites(data.favorites || []);
+                setOrders(data.orders || []);
+                setReviews(data.reviews || []);
             } catch (error) {
-                console.error('Ошибка получения избранных товаров:', error);
-            }
-        }
-
-        async function fetchOrders() {
-            try {
-                const userCookie = getCookieByName('user');
-                const response = await fetch(`${BACKEND_URL}/orders`, {
-                    headers: {
-                        'Authorization': 'Bearer ' + userCookie,
-                    },
-                });
-
-                if (!response.ok) {
-                    throw new Error('Ошибка загрузки заказов');
-                }
-
-                const data = await response.json();
-                setOrders(data);
-            } catch (error) {
-                console.error('Ошибка загрузки заказов:', error);
-            }
-        }
-
-        async function fetchReviews() {
-            try {
-                const userCookie = getCookieByName('user');
-                const response = await fetch(`${BACKEND_URL}/profile/reviews`, {
-                    headers: {
-                        'Content-Type': 'application/json',
-                        'Authorization': 'Bearer ' + userCookie,
-                    },
-                });
-
-                if (!response.ok) {
-                    throw new Error('Ошибка загрузки отзывов');
-                }
-
-                const data = await response.json();
-                setReviews(data || []);
-            } catch (error) {
-                console.error('Ошибка загрузки отзывов:', error);
+                console.error('Ошибка получения профиля:', error);
             }
         }
 
-        fetchUserData();
-        fetchFavorites();
-        fetchOrders();
-        fetchReviews();
+        fetchProfileSummary();
     }, []);
 
     const handleSnackbarClose = () => setSnackbarOpen(false);
@@ -0,0 +1,287 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import db
+import groupcommit
+import versions
+
+# Асинхронный слой БД для async_app.py: asyncpg для Postgres, aiosqlite для SQLite.
+# Конфигурация берется из db.DATABASE_TYPE и db.DATABASE_CONFIG.
+
+_pool = None
+_replica_pools = []
+# Поколение базы (db.reset_epoch), к которому открыты соединения пула Postgres
+_pool_epoch = None
+
+
+class SQLitePool:
+    # aiosqlite держит отдельный поток на соединение, поэтому соединений немного
+    def __init__(self, path, size=4):
+        self.path = path
+        self.size = size
+        self._free = asyncio.Queue()
+        self._all = []
+
+    async def open(self):
+        import sqlite3
+        import aiosqlite
+        config = db.DATABASE_CONFIG['sqlite']
+        for _ in range(self.size):
+            conn = await aiosqlite.connect(self.path, timeout=config['busy_timeout'])
+            conn.row_factory = sqlite3.Row
+            if config['profile'] == 'tuned':
+                for pragma in db.sqlite_pragmas():
+                    await conn.execute(pragma)
+            self._all.append(conn)
+            self._free.put_nowait(conn)
+
+    async def acquire(self):
+        return await self._free.get()
+
+    async def release(self, conn):
+        if conn.in_transaction:
+            await conn.rollback()
+        self._free.put_nowait(conn)
+
+    async def close(self):
+        for conn in self._all:
+            await conn.close()
+        self._all = []
+
+
+async def init_pool():
+    global _pool, _pool_epoch
+    if _pool is not None:
+        return _pool
+    if db.DATABASE_TYPE == 'sqlite':
+        pool = SQLitePool(db.DATABASE_CONFIG['sqlite']['database'])
+        await pool.open()
+    else:
+        _pool_epoch = db.reset_epoch()
+        pool = await _postgres_pool()
+        # Пулы реплик в порядке db.Replicas.pools, создаются при первом чтении из реплики
+        _replica_pools[:] = [None] * len(db.DATABASE_CONFIG['replicas']['hosts'])
+    _pool = pool
+    return pool
+
+
+async def _postgres_pool(replica=None):
+    import asyncpg
+    config = dict(db.DATABASE_CONFIG['postgres'], **(replica or {}))
+    pool_config = db.DATABASE_CONFIG['pool']
+    return await asyncpg.create_pool(
+        database=config['dbname'],
+        user=config['user'],
+        password=config['password'],
+        host=config['host'],
+        port=config['port'],
+        min_size=pool_config['minconn'],
+        max_size=pool_config['maxconn'],
+        max_inactive_connection_lifetime=pool_config['idle_timeout']
+    )
+
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+    for pool in _replica_pools:
+        if pool is not None:
+            await pool.close()
+    _replica_pools.clear()
+
+
+async def _replica_acquire(replicas, replica):
+    # Пул и соединение реплики, выбранной db.read_replica(); (None, None) -- читать из primary
+    index = replicas.pools.index(replica)
+    try:
+        if _replica_pools[index] is None:
+            _replica_pools[index] = await _postgres_pool(replicas.hosts[index])
+        pool = _replica_pools[index]
+        return pool, await pool.acquire(timeout=db.DATABASE_CONFIG['pool']['timeout'])
+    except Exception as e:
+        db.logger.warning(f"Replica read failed, using primary: {e}")
+        replicas.mark_down(replica)
+        return None, None
+
+
+async def _expire_after_reset(pool):
+    # База пересоздана (snapshot.py): asyncpg заменит соединения к старой базе
+    global _pool_epoch
+    if db.DATABASE_TYPE == 'sqlite':
+        return
+    epoch = db.reset_epoch()
+    if _pool_epoch != epoch:
+        _pool_epoch = epoch
+        await pool.expire_connections()
+
+
+@asynccontextmanager
+async def connection(write=False):
+    # Как db.connection: чтения идут в реплику, если они настроены
+    pool = _pool or await init_pool()
+    conn = None
+    if not write and db.DATABASE_TYPE != 'sqlite':
+        replicas, replica = db.read_replica()
+        if replica is not None:
+            replica_pool, conn = await _replica_acquire(replicas, replica)
+            if conn is not None:
+                pool = replica_pool
+    if conn is None:
+        await _expire_after_reset(pool)
+        conn = await pool.acquire()
+    try:
+        yield conn
+    finally:
+        await pool.release(conn)
+
+
+def _row(record):
+    # Те же типы строк, что и у синхронного db.query_db
+    if db.DATABASE_TYPE == 'sqlite':
+        return dict(record)
+    from psycopg2.extras import RealDictRow
+    return RealDictRow(record.items())
+
+
+def _converter(record, shape):
+    # sqlite3.Row и asyncpg.Record индексируются по номеру колонки
+    if shape is None:
+        return _row
+    return shape.converter(list(record.keys()))
+
+
+def _rows(rv, shape):
+    if not rv:
+        return []
+    return list(map(_converter(rv[0], shape), rv))
+
+
+async def query_db(query, args=(), one=False, shape=None):
+    async with connection() as conn:
+        if db.DATABASE_TYPE == 'sqlite':
+            async with conn.execute(query, args) as cursor:
+                rv = await cursor.fetchall()
+        else:
+            rv = await conn.fetch(query, *args)
+
+    data = _rows(rv, shape)
+    return (data[0] if data else None) if one else data
+
+
+async def iter_query(query, args=(), shape=None):
+    # Потоковая выборка пачками; соединение занято до конца итерации
+    batch_size = db.DATABASE_CONFIG['stream_batch_size']
+    convert = None
+    async with connection() as conn:
+        if db.DATABASE_TYPE == 'sqlite':
+            async with conn.execute(query, args) as cursor:
+                while True:
+                    rows = await cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    convert = convert or _converter(rows[0], shape)
+                    for row in rows:
+                        yield convert(row)
+        else:
+            async with conn.transaction():
+                async for record in conn.cursor(query, *args, prefetch=batch_size):
+                    convert = convert or _converter(record, shape)
+                    yield convert(record)
+
+
+def _statement_sql(name):
+    # asyncpg сам подготавливает запросы и кэширует их на соединении,
+    # aiosqlite использует кэш запросов sqlite3
+    sql = db.STATEMENTS[name]
+    if db.DATABASE_TYPE == 'sqlite':
+        return db._param_re.sub(r"?\1", sql)
+    return sql
+
+
+async def query_statement(name, args=(), one=False, shape=None):
+    return await query_db(_statement_sql(name), args, one, shape)
+
+
+def iter_statement(name, args=(), shape=None):
+    return iter_query(_statement_sql(name), args, shape)
+
+
+async def execute_db(query, args=()):
+    async with connection(write=True) as conn:
+        if db.DATABASE_TYPE == 'sqlite':
+            await conn.execute(query, args)
+            await conn.commit()
+        else:
+            await conn.execute(query, *args)
+    db.note_write()
+    versions.bump_for([query])
+
+
+async def write_db(query):
+    # Как groupcommit.write_db: запись ждет commit своей пачки, не блокируя event loop
+    if groupcommit.WRITER is None:
+        return await execute_db(query)
+    await asyncio.wrap_future(groupcommit.WRITER.submit(query))
+    db.note_write()
+
+
+class Transaction:
+    def __init__(self, conn):
+        self.conn = conn
+        self.queries = []
+
+    async def execute(self, query, args=()):
+        # Возвращает число затронутых строк
+        self.queries.append(query)
+        if db.DATABASE_TYPE == 'sqlite':
+            cursor = await self.conn.execute(query, args)
+            rowcount = cursor.rowcount
+            await cursor.close()
+            return rowcount
+        status = await self.conn.execute(query, *args)
+        count = status.rsplit(' ', 1)[-1]
+        return int(count) if count.isdigit() else 0
+
+    async def query(self, query, args=(), one=False, shape=None):
+        if db.DATABASE_TYPE == 'sqlite':
+            async with self.conn.execute(query, args) as cursor:
+                rv = await cursor.fetchall()
+        else:
+            rv = await self.conn.fetch(query, *args)
+        data = _rows(rv, shape)
+        return (data[0] if data else None) if one else data
+
+
+@asynccontextmanager
+async def transaction():
+    async with connection(write=True) as conn:
+        cursor = Transaction(conn)
+        if db.DATABASE_TYPE == 'sqlite':
+            try:
+                yield cursor
+                await conn.commit()
+            except BaseException:
+                await conn.rollback()
+                raise
+        else:
+            async with conn.transaction():
+                yield cursor
+    db.note_write()
+    versions.bump_for(cursor.queries)
+
+
+@asynccontextmanager
+async def read_transaction():
+    # Несколько чтений на одном соединении в одной транзакции (согласованный снимок)
+    async with connection() as conn:
+        if db.DATABASE_TYPE == 'sqlite':
+            await conn.execute("BEGIN")
+            try:
+                yield Transaction(conn)
+            finally:
+                await conn.rollback()
+        else:
+            async with conn.transaction(isolation='repeatable_read', readonly=True):
+                yield Transaction(conn)
@@ -1,33 +1,91 @@
-import json
-import os
-from urllib.parse import urlparse
 from flask import Flask, Blueprint, request, jsonify, make_response
 from flask_cors import CORS
-from db import query_db, execute_db
+from db import (query_db, iter_query, execute_db, transaction, read_transaction,
+                query_statement, iter_statement, set_session, current_tenant, apply_published_resets)
+from pagination import InvalidPage, NEXT_CURSOR_HEADER
+from queries import (PRODUCT_REVIEWS_PAGE, FAVORITES_PAGE, USER_REVIEWS_PAGE, ORDERS_PAGE,
+                     product_query, product_reviews_query, favorites_query, cart_query, user_profile_query,
+                     user_favorites_query, user_reviews_query, user_orders_query, login_query,
+                     review_insert_query, favorite_exists_query, favorite_insert_query, favorite_delete_query,
+                     cart_insert_query, cart_delete_query, profile_update_query, stock_update_query,
+                     stock_query, orders_insert_query)
+from search import search_statement
+from streaming import stream_json
+from inventory import INVENTORY, OutOfStock
+from groupcommit import write_db
+from versions import conditional
+from jsonprovider import FastJSONProvider
+from views import (url_prefix, InvalidRequest, InsufficientStock, PRODUCT_ROW, PRODUCT_DETAIL_ROW,
+                   PRODUCT_DETAIL_RATED_ROW, PRODUCT_REVIEW_ROW, FAVORITE_ROW, CART_ROW, USER_FAVORITE_ROW,
+                   USER_REVIEW_ROW, ORDER_ROW, bearer_user, login_cookie, with_ratings, rating_tables,
+                   products_request, page_statement, paged_query, split_page, search_args, review_input,
+                   required_fields, profile_description, user_profile_item, profile_summary, order_lines,
+                   insufficient_stock_body)
+import metrics
+import snapshot
+import tenants
+import warmup
 import logging
 
 # Инициализация Flask приложения
 app = Flask(__name__)
-CORS(app, supports_credentials=True, origins=["*"])
+app.json = FastJSONProvider(app)
+CORS(app, supports_credentials=True, origins=["*"], expose_headers=[NEXT_CURSOR_HEADER, 'Server-Timing', 'ETag'])
+metrics.init_app(app)
+
+# Ключ клиента для read-your-writes при чтении из реплик (db.note_write)
+@app.before_request
+def remember_client():
+    set_session(request.headers.get('Authorization'))
+    # Сброс базы из CLI (snapshot.py) -- до проверки ETag и выдачи соединений
+    apply_published_resets()
 
 # Логирование
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Функция для извлечения пути из переменной окружения
-def extract_path_from_url(env_var_name, default='/lab/frontend/api'):
-    full_url = os.getenv(env_var_name, default)
-    logger.info(f"Full url {full_url}")
-    if full_url == default:
-        logger.info("No REACT_APP_BACKEND_URL env found, using defaults")
-        return default
-    parsed_url = urlparse(full_url)
-    return parsed_url.path
+# Создаем Blueprint. Префикс, именованные запросы, формат строк и
+# проверка запросов -- в views.py, общем с async_app.py
+api = Blueprint('api', __name__, url_prefix=url_prefix)
 
-url_prefix = extract_path_from_url('REACT_APP_BACKEND_URL')
 
-# Создаем Blueprint
-api = Blueprint('api', __name__, url_prefix=url_prefix)
+@api.errorhandler(InvalidPage)
+def invalid_page(e):
+    return jsonify({"message": str(e)}), 400
+
+
+@api.errorhandler(InvalidRequest)
+def invalid_request(e):
+    return jsonify(e.body()), e.status
+
+
+def paged_response(result, next_cursor):
+    response = jsonify(result)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return response
+
+
+# Готовность воркера: 503 до окончания прогрева (warmup.py)
+@api.route('/ready', methods=['GET'])
+def ready():
+    if not warmup.is_ready():
+        return jsonify({"status": "starting"}), 503
+    return jsonify({"status": "ready", "startup": warmup.timings()}), 200
+
+
+# Сброс базы лаборатории из снимка (snapshot.py)
+@api.route('/reset', methods=['POST'])
+def reset_database():
+    if not snapshot.authorized(request.headers.get('X-Reset-Token')):
+        return jsonify({"message": "Unauthorized"}), 401
+    try:
+        elapsed = snapshot.reset(current_tenant())
+        return jsonify({"message": "Database reset", "reset_ms": round(elapsed * 1000, 1)}), 200
+    except Exception as e:
+        logger.error(f"Error resetting database: {e}")
+        return jsonify({"error": str(e)}), 500
+
 
 # Роут для авторизации
 @api.route('/login', methods=['POST'])
@@ -36,23 +94,21 @@ def login():
     username = data.get('username')
     password = data.get('password')
 
-    query = f"SELECT * FROM users WHERE login = '{username}' AND password = '{password}'"
-    user = query_db(query, one=True)
+    user = query_db(login_query(username, password), one=True)
 
     if user:
         resp = make_response({"message": f"Login successful: user={user}"}, 200)
-        cookie_value = f"user={username}; Path=/; SameSite=Lax"
-        resp.headers.add('Set-Cookie', cookie_value)
+        resp.headers.add('Set-Cookie', login_cookie(username))
         return resp
     else:
         return jsonify({"message": "Invalid credentials"}), 401
 
 # Получение списка категорий продуктов
 @api.route('/categories', methods=['GET'])
+@conditional('product_categories')
 def get_categories():
-    query = "SELECT DISTINCT category FROM product_categories"
     try:
-        categories = query_db(query)
+        categories = query_statement('categories')
         result = [row['category'] for row in categories]
         return jsonify(result), 200
     except Exception as e:
@@ -68,54 +124,52 @@ def logout():
 
 # Получение списка продуктов
 @api.route('/products', methods=['GET'])
+@conditional('products', 'product_categories', extra=rating_tables)
 def get_products():
-    category = request.args.get('category', '')
-
-    query = """
-        SELECT 
-            p.article, 
-            p.name, 
-            c.store_name, 
-            c.category AS category_name, 
-            p.price, 
-            p.stock, 
-            p.released
-        FROM products p
-        LEFT JOIN product_categories c ON p.category_id = c.category_id
-        WHERE p.released = true
-    """
-    if category:
-        query += f" AND c.category = '{category}'"
+    statement, query, shape, page = products_request(request.args)
 
     try:
-        products = query_db(query)
-        result = [dict(row) for row in products]
-        return jsonify(result), 200
+        if not page:
+            if statement:
+                return stream_json(iter_statement(statement, shape=shape)), 200
+            return stream_json(iter_query(query, shape=shape)), 200
+        if statement:
+            products = query_statement(page_statement(statement, page), page.args(), shape=shape)
+        else:
+            products = query_db(paged_query(query, page), shape=shape)
+        products, next_cursor = page.split(products)
+        # Строки сериализуются как есть, без копирования в dict
+        return paged_response(products, next_cursor), 200
     except Exception as e:
         logger.info(e)
         return jsonify({"error": str(e)}), 500
 
 
 
+# Полнотекстовый поиск товаров
+@api.route('/products/search', methods=['GET'])
+@conditional('products', 'product_categories')
+def search_products():
+    args = search_args(request.args)
+
+    try:
+        products = query_statement(search_statement(), args, shape=PRODUCT_ROW)
+        return jsonify(products), 200
+    except Exception as e:
+        logger.info(e)
+        return jsonify({"error": str(e)}), 500
+
+
 # Получение информации о продукте
 @api.route('/products/<int:article>', methods=['GET'])
+@conditional('products', 'product_categories', extra=rating_tables)
 def get_product(article):
-    query = f"""
-        SELECT 
-            p.article, 
-            p.name, 
-            pc.category, 
-            pc.store_name,
-            p.price, 
-            p.stock, 
-            p.released
-        FROM products p
-        JOIN product_categories pc ON p.category_id = pc.category_id
-        WHERE p.article = {article}
-    """
-    product = query_db(query, one=True)
+    if with_ratings(request.args):
+        product = query_db(product_query(article, ratings=True), one=True, shape=PRODUCT_DETAIL_RATED_ROW)
+    else:
+        product = query_db(product_query(article), one=True, shape=PRODUCT_DETAIL_ROW)
     if product:
-        return jsonify(dict(product))
+        return jsonify(product)
     else:
         return jsonify({"message": "Product not found"}), 404
 
@@ -123,24 +177,11 @@ def get_product(article):
 # Добавление отзыва о продукте
 @api.route('/products/<int:article>/reviews', methods=['POST'])
 def add_product_review(article):
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith("Bearer "):
-        return jsonify({"error": "Unauthorized"}), 401
-
-    username = auth_header.split(" ")[1]
-    data = request.json
-    review_text = data.get('review')
-    rating = data.get('rating', 5)
-    if not review_text or not rating:
-        return jsonify({"error": "Review text and rating are required"}), 400
-
-    query = f"""
-        INSERT INTO reviews (article, login, review_text, review_date, rating)
-        VALUES ({article}, '{username}', '{review_text}', datetime('now'), {rating})
-    """
+    username = bearer_user(request.headers, key='error')
+    review_text, rating = review_input(request.json)
 
     try:
-        execute_db(query)
+        write_db(review_insert_query(article, username, review_text, rating))
         return jsonify({"message": "Review added successfully"}), 201
     except Exception as e:
         logger.info(e)
@@ -148,57 +189,29 @@ def add_product_review(article):
 
 # Получение отзывов о продукте
 @api.route('/products/<int:article>/reviews', methods=['GET'])
+@conditional('reviews')
 def get_product_reviews(article):
-    query = f"""
-        SELECT 
-            reviews.login, 
-            reviews.review_text, 
-            reviews.rating, 
-            reviews.review_date
-        FROM reviews
-        WHERE reviews.article = {article}
-    """
+    page = PRODUCT_REVIEWS_PAGE.parse(request.args)
+    query = paged_query(product_reviews_query(article), page)
     try:
-        reviews = query_db(query)
-        reviews_list = [
-            {
-                "username": row["login"],
-                "review_text": row["review_text"],
-                "rating": row["rating"],
-                "review_date": row["review_date"]
-            }
-            for row in reviews
-        ]
-        return jsonify(reviews_list), 200
+        reviews, next_cursor = split_page(query_db(query, shape=PRODUCT_REVIEW_ROW), page)
+        return paged_response(reviews, next_cursor), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 # Работа с избранными товарами
 @api.route('/favorites', methods=['POST'])
 def add_to_favorites():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith("Bearer "):
-        return jsonify({"message": "Unauthorized"}), 401
-
-    username = auth_header.split(" ")[1]
-    data = request.json
-    article = data.get('article')
+    username = bearer_user(request.headers)
+    article, = required_fields(request.json, 'article')
 
-    if not article:
-        return jsonify({"message": "Invalid request data"}), 400
-
-    check_query = f"SELECT 1 FROM favorite_products WHERE login = '{username}' AND article = {article}"
-    existing = query_db(check_query, one=True)
+    existing = query_db(favorite_exists_query(username, article), one=True)
 
     if existing:
         return jsonify({"message": "Product is already in favorites"}), 400
 
-    query = f"""
-        INSERT INTO favorite_products (login, article, added_date, secret)
-        VALUES ('{username}', {article}, datetime('now'), 'default_secret')
-    """
     try:
-        execute_db(query)
+        write_db(favorite_insert_query(username, article))
         return jsonify({"message": "Product added to favorites"}), 201
     except Exception as e:
         logger.info(e)
@@ -206,40 +219,22 @@ def add_to_favorites():
 
 @api.route('/favorites', methods=['GET'])
 def get_favorites():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith("Bearer "):
-        return jsonify({"message": "Unauthorized"}), 401
+    username = bearer_user(request.headers)
+    page = FAVORITES_PAGE.parse(request.args)
 
-    username = auth_header.split(" ")[1]
-
-    query = f"""
-        SELECT 
-            products.article, 
-            products.name, 
-            products.price, 
-            products.category
-        FROM favorite_products
-        JOIN products ON favorite_products.article = products.article
-        WHERE favorite_products.login = '{username}'
-    """
+    query = paged_query(favorites_query(username), page)
     try:
-        favorites = query_db(query)
-        favorites_list = [dict(row) for row in favorites]
-        return jsonify(favorites_list), 200
+        favorites, next_cursor = split_page(query_db(query, shape=FAVORITE_ROW), page)
+        return paged_response(favorites, next_cursor), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @api.route('/favorites/<int:article>', methods=['DELETE'])
 def remove_from_favorites(article):
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith("Bearer "):
-        return jsonify({"message": "Unauthorized"}), 401
-
-    username = auth_header.split(" ")[1]
+    username = bearer_user(request.headers)
 
-    query = f"DELETE FROM favorite_products WHERE login = '{username}' AND article = {article}"
     try:
-        execute_db(query)
+        write_db(favorite_delete_query(username, article))
         return jsonify({"message": "Product removed from favorites"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -247,64 +242,31 @@ def remove_from_favorites(article):
 # Работа с корзиной
 @api.route('/cart', methods=['POST'])
 def add_to_cart():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith("Bearer "):
-        return jsonify({"message": "Unauthorized"}), 401
-
-    username = auth_header.split(" ")[1]
-    data = request.json
-    article = data.get('article')
-    quantity = data.get('quantity')
-
-    if not all([article, quantity]):
-        return jsonify({"message": "Invalid request data"}), 400
+    username = bearer_user(request.headers)
+    article, quantity = required_fields(request.json, 'article', 'quantity')
 
-    query = f"""
-        INSERT INTO shopping_cart (login, article, quantity, secret)
-        VALUES ('{username}', {article}, {quantity}, 'default_secret')
-    """
     try:
-        execute_db(query)
+        write_db(cart_insert_query(username, article, quantity))
         return jsonify({"message": "Product added to cart"}), 201
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @api.route('/cart', methods=['GET'])
 def get_cart():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith("Bearer "):
-        return jsonify({"message": "Unauthorized"}), 401
+    username = bearer_user(request.headers)
 
-    username = auth_header.split(" ")[1]
-
-    query = f"""
-        SELECT 
-            products.article, 
-            products.name, 
-            products.price, 
-            shopping_cart.quantity
-        FROM shopping_cart
-        JOIN products ON shopping_cart.article = products.article
-        WHERE shopping_cart.login = '{username}'
-    """
     try:
-        cart = query_db(query)
-        cart_list = [dict(row) for row in cart]
-        return jsonify(cart_list), 200
+        cart = query_db(cart_query(username), shape=CART_ROW)
+        return jsonify(cart), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @api.route('/cart/<int:article>', methods=['DELETE'])
 def remove_from_cart(article):
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith("Bearer "):
-        return jsonify({"message": "Unauthorized"}), 401
+    username = bearer_user(request.headers)
 
-    username = auth_header.split(" ")[1]
-
-    query = f"DELETE FROM shopping_cart WHERE login = '{username}' AND article = {article}"
     try:
-        execute_db(query)
+        write_db(cart_delete_query(username, article))
         return jsonify({"message": "Product removed from cart"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -313,34 +275,12 @@ def remove_from_cart(article):
 # Получение профиля пользователя
 @api.route('/profile', methods=['GET'])
 def profile():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith("Bearer "):
-        return jsonify({"message": "Unauthorized"}), 401
+    username = bearer_user(request.headers)
 
-    username = auth_header.split(" ")[1]
-
-    query_user = f"""
-        SELECT 
-            login, 
-            name, 
-            birth_date, 
-            address, 
-            phone_number, 
-            secret AS description
-        FROM user_personal_info 
-        WHERE login = '{username}'
-    """
     try:
-        user = query_db(query_user, one=True)
+        user = query_db(user_profile_query(username), one=True)
         if user:
-            return jsonify({
-                "username": user['login'],
-                "name": user['name'],
-                "birthDate": user['birth_date'],
-                "address": user['address'],
-                "phone": user['phone_number'],
-                "description": user['description']
-            }), 200
+            return jsonify(user_profile_item(user)), 200
         else:
             return jsonify({"message": "User not found"}), 404
     except Exception as e:
@@ -350,59 +290,41 @@ def profile():
 # Обновление описания в профиле
 @api.route('/profile', methods=['POST'])
 def update_profile():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith("Bearer "):
-        return jsonify({"message": "Unauthorized"}), 401
-
-    username = auth_header.split(" ")[1]
-    data = request.json
-
-    if not data or 'description' not in data:
-        return jsonify({"message": "Invalid data"}), 400
+    username = bearer_user(request.headers)
+    new_description = profile_description(request.json)
 
-    new_description = data['description']
-
-    query = f"""
-        UPDATE user_personal_info
-        SET secret = '{new_description}'
-        WHERE login = '{username}'
-    """
     try:
-        execute_db(query)
+        execute_db(profile_update_query(username, new_description))
         return jsonify({"message": "Description updated successfully"}), 200
     except Exception as e:
         logger.error(f"Error updating profile: {e}")
         return jsonify({"error": str(e)}), 500
 
+# Сводка профиля: профиль, избранное, отзывы и заказы за один запрос
+@api.route('/profile/summary', methods=['GET'])
+def get_profile_summary():
+    username = bearer_user(request.headers)
+
+    try:
+        # Все четыре выборки на одном соединении в одной транзакции чтения
+        with read_transaction() as query:
+            user = query(user_profile_query(username), one=True)
+            favorites = query(user_favorites_query(username), shape=USER_FAVORITE_ROW)
+            reviews = query(user_reviews_query(username), shape=USER_REVIEW_ROW)
+            orders = query(user_orders_query(username), shape=ORDER_ROW)
+        return jsonify(profile_summary(user, favorites, reviews, orders)), 200
+    except Exception as e:
+        logger.error(f"Error fetching profile summary: {e}")
+        return jsonify({"error": str(e)}), 500
+
 # Получение избранных товаров пользователя
 @api.route('/profile/favorites', methods=['GET'])
 def get_user_favorites():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith("Bearer "):
-        return jsonify({"message": "Unauthorized"}), 401
+    username = bearer_user(request.headers)
 
-    username = auth_header.split(" ")[1]
-
-    query = f"""
-        SELECT 
-            p.name AS product_name, 
-            f.article, 
-            f.added_date
-        FROM favorite_products f
-        JOIN products p ON f.article = p.article
-        WHERE f.login = '{username}'
-    """
     try:
-        favorites = query_db(query)
-        favorites_list = [
-            {
-                "product_name": row["product_name"],
-                "article": row["article"],
-                "added_date": row["added_date"]
-            }
-            for row in favorites
-        ]
-        return jsonify({"favorites": favorites_list}), 200
+        favorites = query_db(user_favorites_query(username), shape=USER_FAVORITE_ROW)
+        return jsonify({"favorites": favorites}), 200
     except Exception as e:
         logger.error(f"Error fetching favorites: {e}")
         return jsonify({"error": str(e)}), 500
@@ -410,34 +332,13 @@ def get_user_favorites():
 # Получение отзывов пользователя
 @api.route('/profile/reviews', methods=['GET'])
 def get_user_reviews():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith("Bearer "):
-        return jsonify({"message": "Unauthorized"}), 401
+    username = bearer_user(request.headers)
+    page = USER_REVIEWS_PAGE.parse(request.args)
 
-    username = auth_header.split(" ")[1]
-
-    query = f"""
-        SELECT 
-            r.review_text, 
-            r.rating, 
-            r.review_date, 
-            p.name AS product_name
-        FROM reviews r
-        JOIN products p ON r.article = p.article
-        WHERE r.login = '{username}'
-    """
+    query = paged_query(user_reviews_query(username), page)
     try:
-        reviews = query_db(query)
-        reviews_list = [
-            {
-                "review_text": row["review_text"],
-                "rating": row["rating"],
-                "review_date": row["review_date"],
-                "product_name": row["product_name"]
-            }
-            for row in reviews
-        ]
-        return jsonify(reviews_list), 200
+        reviews, next_cursor = split_page(query_db(query, shape=USER_REVIEW_ROW), page)
+        return paged_response(reviews, next_cursor), 200
     except Exception as e:
         logger.error(f"Error fetching reviews: {e}")
         return jsonify({"error": str(e)}), 500
@@ -445,31 +346,15 @@ def get_user_reviews():
 # Получение заказов пользователя
 @api.route('/orders', methods=['GET'])
 def get_user_orders():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith("Bearer "):
-        return jsonify({"message": "Unauthorized"}), 401
-
-    username = auth_header.split(" ")[1]
+    username = bearer_user(request.headers)
+    page = ORDERS_PAGE.parse(request.args)
 
-    query = f"""
-        SELECT 
-            o.order_id, 
-            o.order_date, 
-            o.status
-        FROM orders o
-        WHERE o.login = '{username}'
-    """
+    query = paged_query(user_orders_query(username), page)
     try:
-        orders = query_db(query)
-        orders_list = [
-            {
-                "order_id": row["order_id"],
-                "order_date": row["order_date"],
-                "status": row["status"]
-            }
-            for row in orders
-        ]
-        return jsonify(orders_list), 200
+        if not page:
+            return stream_json(iter_query(query, shape=ORDER_ROW)), 200
+        orders, next_cursor = page.split(query_db(query, shape=ORDER_ROW))
+        return paged_response(orders, next_cursor), 200
     except Exception as e:
         logger.error(f"Error fetching orders: {e}")
         return jsonify({"error": str(e)}), 500
@@ -477,55 +362,38 @@ def get_user_orders():
 
 @api.route('/orders', methods=['POST'])
 def create_order():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith("Bearer "):
-        return jsonify({"message": "Unauthorized"}), 401
-
-    username = auth_header.split(" ")[1]
-    data = request.json
-
-    if not data or 'orders' not in data:
-        return jsonify({"message": "Invalid data"}), 400
-
-    orders = data['orders']
-    if not orders or not isinstance(orders, list):
-        return jsonify({"message": "Orders should be a list"}), 400
+    username = bearer_user(request.headers)
+    lines, totals = order_lines(request.json)
 
     try:
-        for order in orders:
-            article = order.get('article')
-            quantity = order.get('quantity', 1)
-            price = order.get('price')
-
-            if not article or not price or quantity <= 0:
-                return jsonify({"message": "Invalid order data"}), 400
-
-            # Проверяем, достаточно ли товара на складе
-            stock_query = f"SELECT stock FROM products WHERE article = {article}"
-            product = query_db(stock_query, one=True)
-
-            if not product or product['stock'] < quantity:
-                return jsonify({"message": f"Insufficient stock for article {article}"}), 400
-
-            # Обновляем количество на складе
-            update_stock_query = f"""
-                UPDATE products 
-                SET stock = stock - {quantity}
-                WHERE article = {article}
-            """
-            execute_db(update_stock_query)
-
-            # Вставляем заказ в таблицу
-            order_query = f"""
-                INSERT INTO orders (login, order_date, status, secret)
-                VALUES (
-                    '{username}', 
-                    datetime('now'), 
-                    'pending', 
-                    '{json.dumps({"article": article, "quantity": quantity, "price": price})}'
-                )
-            """
-            execute_db(order_query)
+        # Популярные товары резервируются в памяти (inventory.py), остальные -- UPDATE
+        hot = {}
+        if INVENTORY is not None:
+            hot, totals = INVENTORY.split(totals)
+
+        try:
+            reserved = INVENTORY.reserve(hot) if hot else {}
+        except OutOfStock as e:
+            return jsonify({"message": str(e)}), 400
+
+        try:
+            with transaction() as cursor:
+                if totals:
+                    cursor.execute(stock_update_query(totals))
+                    if cursor.rowcount != len(totals):
+                        raise InsufficientStock()
+                cursor.execute(orders_insert_query(username, lines))
+                if reserved:
+                    # Проданное из блоков больше не числится за процессом (inventory_claims)
+                    cursor.execute(INVENTORY.sold_query(reserved))
+        except InsufficientStock:
+            if reserved:
+                INVENTORY.release(reserved)
+            return jsonify(insufficient_stock_body(lines, totals, query_db(stock_query(totals)))), 400
+        except Exception:
+            if reserved:
+                INVENTORY.release(reserved)
+            raise
 
         return jsonify({"message": "Orders placed successfully"}), 201
     except Exception as e:
@@ -533,10 +401,13 @@ def create_order():
         return jsonify({"error": str(e)}), 500
 
 
-
 # Регистрация Blueprint
 app.register_blueprint(api)
+app.register_blueprint(metrics.blueprint, url_prefix=url_prefix)
+# Многоарендный режим: тот же Blueprint под /away/<uuid>/api
+tenants.init_app(app, api)
 
 # Запуск приложения
 if __name__ == '__main__':
+    warmup.start(app, url_prefix)
     app.run(host="0.0.0.0", debug=True)
@@ -0,0 +1,523 @@
+import asyncio
+import logging
+import re
+import time
+from functools import wraps
+
+from quart import Quart, Blueprint, request, jsonify, make_response
+from quart_cors import cors
+
+from adb import (query_db, iter_query, execute_db, transaction, read_transaction, init_pool, close_pool,
+                 query_statement, iter_statement, write_db)
+from db import apply_published_resets, set_session
+from queries import (PRODUCT_REVIEWS_PAGE, FAVORITES_PAGE, USER_REVIEWS_PAGE, ORDERS_PAGE,
+                     product_query, product_reviews_query, favorites_query, cart_query, user_profile_query,
+                     user_favorites_query, user_reviews_query, user_orders_query, login_query,
+                     review_insert_query, favorite_exists_query, favorite_insert_query, favorite_delete_query,
+                     cart_insert_query, cart_delete_query, profile_update_query, stock_update_query,
+                     stock_query, orders_insert_query)
+from inventory import INVENTORY, OutOfStock
+from pagination import InvalidPage, NEXT_CURSOR_HEADER
+from search import search_statement
+from versions import etag, cache_headers
+from views import (url_prefix, InvalidRequest, InsufficientStock, PRODUCT_ROW, PRODUCT_DETAIL_ROW,
+                   PRODUCT_DETAIL_RATED_ROW, PRODUCT_REVIEW_ROW, FAVORITE_ROW, CART_ROW, USER_FAVORITE_ROW,
+                   USER_REVIEW_ROW, ORDER_ROW, bearer_user, login_cookie, with_ratings, rating_tables,
+                   products_request, page_statement, paged_query, split_page, search_args, review_input,
+                   required_fields, profile_description, user_profile_item, profile_summary, order_lines,
+                   insufficient_stock_body)
+from jsonprovider import FastJSONProvider
+import snapshot
+import warmup
+
+# Асинхронный вариант app.py на Quart: те же роуты и ответы,
+# запросы к БД не блокируют воркер (asyncpg / aiosqlite). Разбор запросов,
+# формат строк и SQL общие с app.py (views.py, queries.py).
+# Запуск: WEB_MODE=async gunicorn -c gunicorn.conf.py async_app:app
+#
+# Чего здесь нет по сравнению с app.py (см. также README.md):
+# - многоарендных роутов /away/<uuid>/api (tenants.py): только url_prefix;
+#   /reset восстанавливает одну базу по умолчанию;
+# - /metrics и заголовка Server-Timing (metrics.py).
+# Поведение SQL на Postgres отличается: asyncpg выполняет чтения
+# (query_db, iter_query) подготовленными запросами, поэтому в них не
+# проходят несколько операторов через ';' (stacked queries), а запись
+# (execute_db) -- проходит, как и в app.py. Тексты ошибок в ответах 500 --
+# asyncpg, а не psycopg2. На SQLite оба варианта ведут себя одинаково
+# (sqlite3 выполняет один оператор за вызов).
+app = Quart(__name__)
+app.json = FastJSONProvider(app)
+app = cors(app, allow_origin=re.compile(".*"), allow_credentials=True,
+           expose_headers=[NEXT_CURSOR_HEADER, 'ETag'])
+
+logger = logging.getLogger(__name__)
+
+api = Blueprint('api', __name__, url_prefix=url_prefix)
+
+
+_warmup_task = None
+
+
+async def warm_up():
+    # Как warmup.warm_up: пул (asyncpg открывает min_size соединений и сам
+    # подготавливает запросы), затем запросы каталога; повтор при ошибке
+    # до warmup.WARMUP_MAX_ATTEMPTS раз
+    started = time.perf_counter()
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            steps = {}
+            step = time.perf_counter()
+            await init_pool()
+            steps['pool'] = time.perf_counter() - step
+            step = time.perf_counter()
+            client = app.test_client()
+            for path in warmup.WARMUP_PATHS + warmup.WARMUP_OPTIONAL_PATHS:
+                warmup.check_response(path, (await client.get(url_prefix + path)).status_code)
+            steps['catalog'] = time.perf_counter() - step
+            warmup.mark_ready(steps, started)
+            return
+        except Exception as e:
+            if warmup.give_up(attempt, e):
+                return
+            await asyncio.sleep(warmup.WARMUP_RETRY_INTERVAL)
+
+
+@app.before_serving
+async def open_pool():
+    # Пул создается в event loop воркера; прогрев идет в фоне, до его
+    # окончания /ready отвечает 503. При недоступной БД повторим на первом запросе
+    global _warmup_task
+    if not warmup.WARMUP_ENABLED:
+        warmup.mark_ready({}, time.perf_counter())
+        try:
+            await init_pool()
+        except Exception as e:
+            logger.error(f"Database pool init failed: {e}")
+        return
+    _warmup_task = asyncio.ensure_future(warm_up())
+
+
+@app.after_serving
+async def shutdown_pool():
+    if _warmup_task is not None:
+        _warmup_task.cancel()
+    await close_pool()
+
+
+@app.before_request
+async def remember_client():
+    # Как в app.py: ключ клиента для read-your-writes при чтении из реплик
+    set_session(request.headers.get('Authorization'))
+    apply_published_resets()
+
+
+@api.errorhandler(InvalidPage)
+async def invalid_page(e):
+    return jsonify({"message": str(e)}), 400
+
+
+@api.errorhandler(InvalidRequest)
+async def invalid_request(e):
+    return jsonify(e.body()), e.status
+
+
+def conditional(*tables, extra=None):
+    # Как versions.conditional, но для async view-функций
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(*args, **kwargs):
+            tag = etag(*tables, *(extra(request.args) if extra else ()))
+            if request.if_none_match.contains_weak(tag):
+                return cache_headers(await make_response('', 304), tag)
+            response = await make_response(await view(*args, **kwargs))
+            if response.status_code == 200:
+                cache_headers(response, tag)
+            return response
+        return wrapper
+    return decorator
+
+
+def paged_response(result, next_cursor):
+    response = jsonify(result)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return response
+
+
+async def stream_json(rows, transform=None):
+    # Как streaming.stream_json: первая строка выбирается до начала ответа
+    try:
+        first = await anext(rows)
+    except StopAsyncIteration:
+        return jsonify([])
+
+    dumps = app.json.dumps
+
+    async def generate():
+        try:
+            row = first
+            chunk = ['[']
+            separator = ''
+            while True:
+                if transform is not None:
+                    row = transform(row)
+                chunk.append(separator)
+                chunk.append(dumps(row, separators=(',', ':')))
+                separator = ','
+                if len(chunk) >= 1000:
+                    yield ''.join(chunk)
+                    chunk = []
+                try:
+                    row = await anext(rows)
+                except StopAsyncIteration:
+                    break
+            chunk.append(']\n')
+            yield ''.join(chunk)
+        finally:
+            await rows.aclose()
+
+    return app.response_class(generate(), mimetype=app.json.mimetype)
+
+
+# Готовность воркера: 503 до окончания прогрева
+@api.route('/ready', methods=['GET'])
+async def ready():
+    if not warmup.is_ready():
+        return jsonify({"status": "starting"}), 503
+    return jsonify({"status": "ready", "startup": warmup.timings()}), 200
+
+
+# Сброс базы из снимка; копирование базы идет в потоке
+@api.route('/reset', methods=['POST'])
+async def reset_database():
+    if not snapshot.authorized(request.headers.get('X-Reset-Token')):
+        return jsonify({"message": "Unauthorized"}), 401
+    try:
+        elapsed = await asyncio.to_thread(snapshot.reset)
+        return jsonify({"message": "Database reset", "reset_ms": round(elapsed * 1000, 1)}), 200
+    except Exception as e:
+        logger.error(f"Error resetting database: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+# Роут для авторизации
+@api.route('/login', methods=['POST'])
+async def login():
+    data = await request.get_json()
+    username = data.get('username')
+    password = data.get('password')
+
+    user = await query_db(login_query(username, password), one=True)
+
+    if user:
+        resp = await make_response({"message": f"Login successful: user={user}"}, 200)
+        resp.headers.add('Set-Cookie', login_cookie(username))
+        return resp
+    else:
+        return jsonify({"message": "Invalid credentials"}), 401
+
+# Получение списка категорий продуктов
+@api.route('/categories', methods=['GET'])
+@conditional('product_categories')
+async def get_categories():
+    try:
+        categories = await query_statement('categories')
+        result = [row['category'] for row in categories]
+        return jsonify(result), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# Роут для выхода
+@api.route('/logout', methods=['POST'])
+async def logout():
+    response = await make_response(jsonify({"message": "Вы успешно вышли из системы"}))
+    response.set_cookie('user', '', expires=0)
+    logger.info("User logged out and cookie cleared")
+    return response
+
+# Получение списка продуктов
+@api.route('/products', methods=['GET'])
+@conditional('products', 'product_categories', extra=rating_tables)
+async def get_products():
+    statement, query, shape, page = products_request(request.args)
+
+    try:
+        if not page:
+            if statement:
+                return await stream_json(iter_statement(statement, shape=shape)), 200
+            return await stream_json(iter_query(query, shape=shape)), 200
+        if statement:
+            products = await query_statement(page_statement(statement, page), page.args(), shape=shape)
+        else:
+            products = await query_db(paged_query(query, page), shape=shape)
+        products, next_cursor = page.split(products)
+        # Строки сериализуются как есть, без копирования в dict
+        return paged_response(products, next_cursor), 200
+    except Exception as e:
+        logger.info(e)
+        return jsonify({"error": str(e)}), 500
+
+
+
+# Полнотекстовый поиск товаров
+@api.route('/products/search', methods=['GET'])
+@conditional('products', 'product_categories')
+async def search_products():
+    args = search_args(request.args)
+
+    try:
+        products = await query_statement(search_statement(), args, shape=PRODUCT_ROW)
+        return jsonify(products), 200
+    except Exception as e:
+        logger.info(e)
+        return jsonify({"error": str(e)}), 500
+
+
+# Получение информации о продукте
+@api.route('/products/<int:article>', methods=['GET'])
+@conditional('products', 'product_categories', extra=rating_tables)
+async def get_product(article):
+    if with_ratings(request.args):
+        product = await query_db(product_query(article, ratings=True), one=True, shape=PRODUCT_DETAIL_RATED_ROW)
+    else:
+        product = await query_db(product_query(article), one=True, shape=PRODUCT_DETAIL_ROW)
+    if product:
+        return jsonify(product)
+    else:
+        return jsonify({"message": "Product not found"}), 404
+
+
+# Добавление отзыва о продукте
+@api.route('/products/<int:article>/reviews', methods=['POST'])
+async def add_product_review(article):
+    username = bearer_user(request.headers, key='error')
+    review_text, rating = review_input(await request.get_json())
+
+    try:
+        await write_db(review_insert_query(article, username, review_text, rating))
+        return jsonify({"message": "Review added successfully"}), 201
+    except Exception as e:
+        logger.info(e)
+        return jsonify({"error": str(e)}), 500
+
+# Получение отзывов о продукте
+@api.route('/products/<int:article>/reviews', methods=['GET'])
+@conditional('reviews')
+async def get_product_reviews(article):
+    page = PRODUCT_REVIEWS_PAGE.parse(request.args)
+    query = paged_query(product_reviews_query(article), page)
+    try:
+        reviews, next_cursor = split_page(await query_db(query, shape=PRODUCT_REVIEW_ROW), page)
+        return paged_response(reviews, next_cursor), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# Работа с избранными товарами
+@api.route('/favorites', methods=['POST'])
+async def add_to_favorites():
+    username = bearer_user(request.headers)
+    article, = required_fields(await request.get_json(), 'article')
+
+    existing = await query_db(favorite_exists_query(username, article), one=True)
+
+    if existing:
+        return jsonify({"message": "Product is already in favorites"}), 400
+
+    try:
+        await write_db(favorite_insert_query(username, article))
+        return jsonify({"message": "Product added to favorites"}), 201
+    except Exception as e:
+        logger.info(e)
+        return jsonify({"error": str(e)}), 500
+
+@api.route('/favorites', methods=['GET'])
+async def get_favorites():
+    username = bearer_user(request.headers)
+    page = FAVORITES_PAGE.parse(request.args)
+
+    query = paged_query(favorites_query(username), page)
+    try:
+        favorites, next_cursor = split_page(await query_db(query, shape=FAVORITE_ROW), page)
+        return paged_response(favorites, next_cursor), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@api.route('/favorites/<int:article>', methods=['DELETE'])
+async def remove_from_favorites(article):
+    username = bearer_user(request.headers)
+
+    try:
+        await write_db(favorite_delete_query(username, article))
+        return jsonify({"message": "Product removed from favorites"}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# Работа с корзиной
+@api.route('/cart', methods=['POST'])
+async def add_to_cart():
+    username = bearer_user(request.headers)
+    article, quantity = required_fields(await request.get_json(), 'article', 'quantity')
+
+    try:
+        await write_db(cart_insert_query(username, article, quantity))
+        return jsonify({"message": "Product added to cart"}), 201
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@api.route('/cart', methods=['GET'])
+async def get_cart():
+    username = bearer_user(request.headers)
+
+    try:
+        cart = await query_db(cart_query(username), shape=CART_ROW)
+        return jsonify(cart), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@api.route('/cart/<int:article>', methods=['DELETE'])
+async def remove_from_cart(article):
+    username = bearer_user(request.headers)
+
+    try:
+        await write_db(cart_delete_query(username, article))
+        return jsonify({"message": "Product removed from cart"}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# Получение профиля пользователя
+@api.route('/profile', methods=['GET'])
+async def profile():
+    username = bearer_user(request.headers)
+
+    try:
+        user = await query_db(user_profile_query(username), one=True)
+        if user:
+            return jsonify(user_profile_item(user)), 200
+        else:
+            return jsonify({"message": "User not found"}), 404
+    except Exception as e:
+        logger.error(f"Error fetching profile: {e}")
+        return jsonify({"error": str(e)}), 500
+
+# Обновление описания в профиле
+@api.route('/profile', methods=['POST'])
+async def update_profile():
+    username = bearer_user(request.headers)
+    new_description = profile_description(await request.get_json())
+
+    try:
+        await execute_db(profile_update_query(username, new_description))
+        return jsonify({"message": "Description updated successfully"}), 200
+    except Exception as e:
+        logger.error(f"Error updating profile: {e}")
+        return jsonify({"error": str(e)}), 500
+
+# Сводка профиля: профиль, избранное, отзывы и заказы за один запрос
+@api.route('/profile/summary', methods=['GET'])
+async def get_profile_summary():
+    username = bearer_user(request.headers)
+
+    try:
+        async with read_transaction() as cursor:
+            user = await cursor.query(user_profile_query(username), one=True)
+            favorites = await cursor.query(user_favorites_query(username), shape=USER_FAVORITE_ROW)
+            reviews = await cursor.query(user_reviews_query(username), shape=USER_REVIEW_ROW)
+            orders = await cursor.query(user_orders_query(username), shape=ORDER_ROW)
+        return jsonify(profile_summary(user, favorites, reviews, orders)), 200
+    except Exception as e:
+        logger.error(f"Error fetching profile summary: {e}")
+        return jsonify({"error": str(e)}), 500
+
+# Получение избранных товаров пользователя
+@api.route('/profile/favorites', methods=['GET'])
+async def get_user_favorites():
+    username = bearer_user(request.headers)
+
+    try:
+        favorites = await query_db(user_favorites_query(username), shape=USER_FAVORITE_ROW)
+        return jsonify({"favorites": favorites}), 200
+    except Exception as e:
+        logger.error(f"Error fetching favorites: {e}")
+        return jsonify({"error": str(e)}), 500
+
+# Получение отзывов пользователя
+@api.route('/profile/reviews', methods=['GET'])
+async def get_user_reviews():
+    username = bearer_user(request.headers)
+    page = USER_REVIEWS_PAGE.parse(request.args)
+
+    query = paged_query(user_reviews_query(username), page)
+    try:
+        reviews, next_cursor = split_page(await query_db(query, shape=USER_REVIEW_ROW), page)
+        return paged_response(reviews, next_cursor), 200
+    except Exception as e:
+        logger.error(f"Error fetching reviews: {e}")
+        return jsonify({"error": str(e)}), 500
+
+# Получение заказов пользователя
+@api.route('/orders', methods=['GET'])
+async def get_user_orders():
+    username = bearer_user(request.headers)
+    page = ORDERS_PAGE.parse(request.args)
+
+    query = paged_query(user_orders_query(username), page)
+    try:
+        if not page:
+            return await stream_json(iter_query(query, shape=ORDER_ROW)), 200
+        orders, next_cursor = page.split(await query_db(query, shape=ORDER_ROW))
+        return paged_response(orders, next_cursor), 200
+    except Exception as e:
+        logger.error(f"Error fetching orders: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@api.route('/orders', methods=['POST'])
+async def create_order():
+    username = bearer_user(request.headers)
+    lines, totals = order_lines(await request.get_json())
+
+    try:
+        # Популярные товары резервируются в памяти (inventory.py), остальные -- UPDATE
+        hot = {}
+        if INVENTORY is not None:
+            hot, totals = INVENTORY.split(totals)
+
+        try:
+            reserved = await INVENTORY.reserve_async(hot) if hot else {}
+        except OutOfStock as e:
+            return jsonify({"message": str(e)}), 400
+
+        try:
+            async with transaction() as cursor:
+                if totals:
+                    rowcount = await cursor.execute(stock_update_query(totals))
+                    if rowcount != len(totals):
+                        raise InsufficientStock()
+                await cursor.execute(orders_insert_query(username, lines))
+                if reserved:
+                    # Проданное из блоков больше не числится за процессом (inventory_claims)
+                    await cursor.execute(INVENTORY.sold_query(reserved))
+        except InsufficientStock:
+            if reserved:
+                INVENTORY.release(reserved)
+            return jsonify(insufficient_stock_body(lines, totals, await query_db(stock_query(totals)))), 400
+        except Exception:
+            if reserved:
+                INVENTORY.release(reserved)
+            raise
+
+        return jsonify({"message": "Orders placed successfully"}), 201
+    except Exception as e:
+        logger.error(f"Error creating orders: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+# Регистрация Blueprint
+app.register_blueprint(api)
+
+# Запуск приложения
+if __name__ == '__main__':
+    app.run(host="0.0.0.0")
@@ -0,0 +1,272 @@
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from psycopg2.extras import RealDictRow
+
+import db
+import filldb
+import simpledb
+
+# Микробенчмарки слоя БД и сериализации ответов.
+# Запуск: python bench.py [--save baseline.json] [--compare baseline.json]
+
+BENCH_SIZES = {
+    'users': 1_000,
+    'categories': 20,
+    'products': 20_000,
+    'orders': 20_000,
+    'reviews': 50_000,
+    'favorites_per_user': 5,
+    'cart_per_user': 20
+}
+HEAVY_USER = filldb._login(0)  # самый активный пользователь при Zipf-распределении
+
+BENCHMARKS = []
+
+
+def benchmark(name, backends=('sqlite',)):
+    def register(func):
+        BENCHMARKS.append((name, backends, func))
+        return func
+    return register
+
+
+def seed_sqlite(directory, seed=0, scale=1.0):
+    # create_delivery_db пишет delivery.db в текущий каталог
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        simpledb.create_delivery_db()
+        conn = sqlite3.connect('delivery.db')
+        sizes = {name: max(1, int(size * scale)) if not name.endswith('_per_user') else size
+                 for name, size in BENCH_SIZES.items()}
+        filldb.populate_large(conn, seed, sizes)
+        conn.close()
+    finally:
+        os.chdir(cwd)
+    return os.path.join(directory, 'delivery.db')
+
+
+def use_backend(backend, sqlite_path=None):
+    db.close_pool()
+    db.DATABASE_TYPE = backend
+    if sqlite_path:
+        db.DATABASE_CONFIG['sqlite']['database'] = sqlite_path
+
+
+# Слой БД
+
+@benchmark('query_db: product listing', backends=('sqlite', 'postgres'))
+def bench_query_listing():
+    return lambda: db.query_db("""
+        SELECT p.article, p.name, c.store_name, c.category AS category_name, p.price, p.stock, p.released
+        FROM products p
+        LEFT JOIN product_categories c ON p.category_id = c.category_id
+        WHERE p.released = true AND p.article < 1000500
+    """)
+
+
+@benchmark('query_db: point lookup', backends=('sqlite', 'postgres'))
+def bench_query_point():
+    return lambda: db.query_db("SELECT stock FROM products WHERE article = 1000042", one=True)
+
+
+@benchmark('execute_db: stock update', backends=('sqlite', 'postgres'))
+def bench_execute_update():
+    return lambda: db.execute_db("UPDATE products SET stock = stock WHERE article = 1000042")
+
+
+# Преобразование строк
+
+@benchmark('rows: sqlite3.Row -> dict')
+def bench_sqlite_rows():
+    conn = sqlite3.connect(db.DATABASE_CONFIG['sqlite']['database'])
+    conn.row_factory = sqlite3.Row
+    rows = conn.execute("SELECT * FROM products LIMIT 1000").fetchall()
+    return lambda: [dict(row) for row in rows]
+
+
+@benchmark('rows: tuple -> RealDictRow')
+def bench_realdict_rows():
+    # Повторяет то, что RealDictCursor делает для каждой строки
+    conn = sqlite3.connect(db.DATABASE_CONFIG['sqlite']['database'])
+    cursor = conn.execute("SELECT * FROM products LIMIT 1000")
+    columns = [column[0] for column in cursor.description]
+    rows = cursor.fetchall()
+    return lambda: [RealDictRow(zip(columns, row)) for row in rows]
+
+
+@benchmark('rows: tuple -> record')
+def bench_record_rows():
+    from rows import RowShape
+    conn = sqlite3.connect(db.DATABASE_CONFIG['sqlite']['database'])
+    cursor = conn.execute("SELECT * FROM products LIMIT 1000")
+    columns = [column[0] for column in cursor.description]
+    convert = RowShape('BenchRow', {column: column for column in columns}).converter(columns)
+    rows = cursor.fetchall()
+    return lambda: list(map(convert, rows))
+
+
+# JSON-провайдер на строках с Decimal и datetime, как у RealDictCursor
+
+def _postgres_like_rows(count=1000):
+    import datetime
+    import decimal
+    started = datetime.datetime(2024, 1, 1)
+    return [RealDictRow([
+        ('order_id', i),
+        ('order_date', started + datetime.timedelta(minutes=i)),
+        ('status', 'pending'),
+        ('price', decimal.Decimal(f"{i % 100}.99"))
+    ]) for i in range(count)]
+
+
+@benchmark('json: default provider')
+def bench_json_default():
+    from flask.json.provider import DefaultJSONProvider
+    import app as application
+    provider = DefaultJSONProvider(application.app)
+    rows = _postgres_like_rows()
+    with application.app.app_context():
+        return lambda: provider.response(rows).get_data()
+
+
+@benchmark('json: app provider')
+def bench_json_app():
+    import app as application
+    rows = _postgres_like_rows()
+    with application.app.app_context():
+        return lambda: application.app.json.response(rows).get_data()
+
+
+# Сериализация ответов view-функций
+
+def _endpoint(path, username=None):
+    import app as application
+    client = application.app.test_client()
+    headers = {'Authorization': f"Bearer {username}"} if username else {}
+    url = application.url_prefix + path
+
+    def run():
+        response = client.get(url, headers=headers)
+        body = response.get_data()
+        assert response.status_code == 200, body[:200]
+        return body
+    return run
+
+
+@benchmark('endpoint: get_products')
+def bench_get_products():
+    return _endpoint('/products?limit=500')
+
+
+@benchmark('endpoint: get_categories')
+def bench_get_categories():
+    return _endpoint('/categories')
+
+
+@benchmark('endpoint: get_cart')
+def bench_get_cart():
+    return _endpoint('/cart', HEAVY_USER)
+
+
+@benchmark('endpoint: get_user_orders')
+def bench_get_user_orders():
+    return _endpoint('/orders', HEAVY_USER)
+
+
+def measure(func, min_time=1.0, repeat=3):
+    func()  # прогрев
+    best = 0.0
+    for _ in range(repeat):
+        count = 0
+        started = time.perf_counter()
+        deadline = started + min_time
+        while True:
+            func()
+            count += 1
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+        best = max(best, count / (now - started))
+
+    tracemalloc.start()
+    func()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'ops_per_sec': best, 'peak_bytes': peak}
+
+
+def run(min_time=1.0, repeat=3, seed=0, scale=1.0, only=None):
+    postgres = bool(os.getenv('POSTGRES_HOST'))
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        sqlite_path = seed_sqlite(directory, seed, scale)
+        for backend in ('sqlite', 'postgres'):
+            if backend == 'postgres' and not postgres:
+                continue
+            use_backend(backend, sqlite_path)
+            for name, backends, setup in BENCHMARKS:
+                if backend not in backends or (only and only not in name):
+                    continue
+                key = f"{name} [{backend}]"
+                results[key] = measure(setup(), min_time, repeat)
+                print(f"{key:45} {results[key]['ops_per_sec']:12.1f} ops/s "
+                      f"{results[key]['peak_bytes'] / 1024:10.1f} KiB peak")
+        db.close_pool()
+    return results
+
+
+def compare(results, baseline, threshold):
+    # Регрессия: падение ops/s или рост пиковой памяти больше порога
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if not base:
+            continue
+        if result['ops_per_sec'] < base['ops_per_sec'] * (1 - threshold):
+            regressions.append(f"{key}: {base['ops_per_sec']:.1f} -> {result['ops_per_sec']:.1f} ops/s")
+        if result['peak_bytes'] > base['peak_bytes'] * (1 + threshold):
+            regressions.append(f"{key}: {base['peak_bytes']} -> {result['peak_bytes']} peak bytes")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Микробенчмарки delivery-back")
+    parser.add_argument('--save', help="сохранить результаты как baseline (JSON)")
+    parser.add_argument('--compare', help="сравнить с сохраненным baseline")
+    parser.add_argument('--threshold', type=float, default=0.15)
+    parser.add_argument('--min-time', type=float, default=1.0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--scale', type=float, default=1.0, help="множитель размера тестовой базы")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-k', dest='only', help="запускать только бенчмарки с подстрокой в имени")
+    args = parser.parse_args()
+
+    results = run(args.min_time, args.repeat, args.seed, args.scale, args.only)
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'results': results
+            }, f, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.save}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions")
@@ -1,15 +1,30 @@
+import argparse
+import os
+import re
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import psycopg2
 
+from indexes import create_indexes
+from ratings import create_rating_stats
+from search import create_search_index
 
-def execute_sql(file_path, db_name, user, password, host='localhost', port=5432):
-    # Подключение к базе данных
-    conn = psycopg2.connect(
+
+def connect(db_name, user, password, host='localhost', port=5432):
+    return psycopg2.connect(
         dbname=db_name,
         user=user,
         password=password,
         host=host,
         port=port
     )
+
+
+def execute_sql(file_path, db_name, user, password, host='localhost', port=5432):
+    # Подключение к базе данных
+    conn = connect(db_name, user, password, host, port)
     cursor = conn.cursor()
 
     # Чтение SQL-скрипта
@@ -29,6 +44,275 @@ def execute_sql(file_path, db_name, user, password, host='localhost', port=5432)
         conn.close()
 
 
-# Выполнение скриптов
-execute_sql('scripts/output_database_structure.sql', 'pharmacy_db', 'your_user', 'your_password')
-execute_sql('scripts/output_data.sql', 'pharmacy_db', 'your_user', 'your_password')
+def prepare_database(db_name, user, password, host='localhost', port=5432):
+    # Индексы, поиск и сводка оценок поверх загруженной схемы (оба пути загрузки)
+    conn = connect(db_name, user, password, host, port)
+    try:
+        create_indexes(conn)
+        create_search_index(conn)
+        create_rating_stats(conn)
+    finally:
+        conn.close()
+
+
+# Быстрая загрузка через COPY FROM STDIN
+
+_STATEMENT_RE = re.compile(r"(?:'(?:[^']|'')*'|--[^\n]*|[^;'-]+|-)+", re.S)
+_CREATE_TABLE_RE = re.compile(r"CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)\s*\((.*)\)\s*$", re.I | re.S)
+_CREATE_INDEX_RE = re.compile(r"CREATE\s+(?:UNIQUE\s+)?INDEX\b", re.I)
+_REFERENCES_RE = re.compile(r"REFERENCES\s+(\w+)", re.I)
+_INSERT_RE = re.compile(r"INSERT\s+INTO\s+(\w+)\s*\(([^)]*)\)\s*VALUES\s*", re.I)
+_VALUE_RE = re.compile(r"\s*('(?:[^']|'')*'|[^,()\s]+)\s*([,)])")
+_ROW_END_RE = re.compile(r"\s*([,;])\s*(\(?)")
+
+
+def split_statements(sql):
+    # Разбиение скрипта на запросы с учетом строк и комментариев
+    statements = []
+    for match in _STATEMENT_RE.finditer(sql):
+        lines = [line for line in match.group(0).splitlines() if not line.strip().startswith('--')]
+        statement = "\n".join(lines).strip()
+        if statement:
+            statements.append(statement)
+    return statements
+
+
+def _split_definitions(body):
+    # Запятые внутри скобок (NUMERIC(10, 2)) не разделяют определения
+    items, depth, current = [], 0, []
+    for char in body:
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        if char == ',' and depth == 0:
+            items.append(''.join(current).strip())
+            current = []
+        else:
+            current.append(char)
+    items.append(''.join(current).strip())
+    return [item for item in items if item]
+
+
+def parse_structure(sql):
+    # Возвращает DDL без ограничений и отложенные PK, FK и индексы
+    schema = {
+        'statements': [],
+        'tables': [],
+        'dependencies': {},
+        'primary_keys': [],
+        'foreign_keys': [],
+        'indexes': []
+    }
+    for statement in split_statements(sql):
+        if _CREATE_INDEX_RE.match(statement):
+            schema['indexes'].append(statement)
+            continue
+        match = _CREATE_TABLE_RE.match(statement)
+        if not match:
+            schema['statements'].append(statement)
+            continue
+
+        table, body = match.groups()
+        columns = []
+        schema['tables'].append(table)
+        schema['dependencies'][table] = set()
+        for item in _split_definitions(body):
+            keyword = item.split(None, 1)[0].upper()
+            if keyword == 'PRIMARY':
+                schema['primary_keys'].append(f"ALTER TABLE {table} ADD {item}")
+            elif keyword in ('FOREIGN', 'CONSTRAINT', 'UNIQUE'):
+                schema['foreign_keys'].append(f"ALTER TABLE {table} ADD {item}")
+                schema['dependencies'][table].update(
+                    ref for ref in _REFERENCES_RE.findall(item) if ref != table
+                )
+            else:
+                columns.append(item)
+        columns = ",\n    ".join(columns)
+        schema['statements'].append(f"CREATE TABLE {table} (\n    {columns}\n)")
+    return schema
+
+
+def load_levels(tables, dependencies):
+    # Группы таблиц в порядке внешних ключей; таблицы группы независимы
+    remaining = {table: set(dependencies.get(table, ())) & set(tables) for table in tables}
+    levels = []
+    while remaining:
+        level = [table for table, deps in remaining.items() if not deps]
+        if not level:
+            # Циклические ссылки: грузим оставшееся одной группой
+            level = list(remaining)
+        levels.append(level)
+        for table in level:
+            del remaining[table]
+        for deps in remaining.values():
+            deps.difference_update(level)
+    return levels
+
+
+def _copy_text(value):
+    # Литерал из INSERT -> поле формата COPY text
+    if value.startswith("'"):
+        value = value[1:-1].replace("''", "'")
+        return (value.replace('\\', '\\\\').replace('\t', '\\t')
+                .replace('\n', '\\n').replace('\r', '\\r'))
+    if value.upper() == 'NULL':
+        return '\\N'
+    return value
+
+
+def parse_inserts(sql):
+    # Генератор (таблица, колонки, строка в формате COPY text)
+    position = 0
+    while True:
+        match = _INSERT_RE.search(sql, position)
+        if not match:
+            return
+        table = match.group(1)
+        columns = tuple(column.strip() for column in match.group(2).split(','))
+        position = match.end()
+        while True:
+            if sql[position] != '(':
+                raise ValueError(f"Unexpected VALUES syntax for {table} at offset {position}")
+            position += 1
+            values = []
+            while True:
+                value = _VALUE_RE.match(sql, position)
+                if not value:
+                    raise ValueError(f"Cannot parse value for {table} at offset {position}")
+                values.append(_copy_text(value.group(1)))
+                position = value.end()
+                if value.group(2) == ')':
+                    break
+            yield table, columns, '\t'.join(values) + '\n'
+            end = _ROW_END_RE.match(sql, position)
+            if not end or end.group(1) == ';':
+                position = end.end(1) if end else position
+                break
+            position = end.start(2)
+
+
+def spool_inserts(data_path):
+    # Строки каждой таблицы копятся во временном файле, а не в памяти
+    with open(data_path, 'r', encoding='utf-8') as f:
+        sql = f.read()
+
+    spools = {}
+    for table, columns, line in parse_inserts(sql):
+        spool = spools.get((table, columns))
+        if spool is None:
+            spool = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024, mode='w+', encoding='utf-8')
+            spools[(table, columns)] = spool
+        spool.write(line)
+
+    sources = {}
+    for (table, columns), spool in spools.items():
+        spool.seek(0)
+        sources.setdefault(table, []).append(
+            (f"COPY {table} ({', '.join(columns)}) FROM STDIN", spool)
+        )
+    return sources
+
+
+def csv_sources(data_dir):
+    # Компаньон-дамп: scripts/data/<table>.csv с заголовком
+    sources = {}
+    for name in sorted(os.listdir(data_dir)):
+        if not name.endswith('.csv'):
+            continue
+        table = name[:-4]
+        f = open(os.path.join(data_dir, name), 'r', encoding='utf-8')
+        header = f.readline().strip()
+        sources[table] = [
+            (f"COPY {table} ({header}) FROM STDIN WITH (FORMAT csv)", f)
+        ]
+    return sources
+
+
+def _run_parallel(func, items, workers):
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for _ in executor.map(func, items):
+            pass
+
+
+def load_fast(structure_path, data_path, db_name, user, password, host='localhost', port=5432,
+              workers=4, defer_constraints=True):
+    # Схема -> COPY данных параллельно по уровням FK -> PK, FK, индексы, ANALYZE
+    started = time.monotonic()
+    params = (db_name, user, password, host, port)
+
+    with open(structure_path, 'r', encoding='utf-8') as f:
+        structure = f.read()
+    schema = parse_structure(structure)
+    if not defer_constraints:
+        # Таблицы создаются как есть, откладываются только индексы
+        schema['statements'] = [statement for statement in split_statements(structure)
+                                if not _CREATE_INDEX_RE.match(statement)]
+
+    def execute(statements):
+        conn = connect(*params)
+        try:
+            with conn.cursor() as cursor:
+                for statement in statements:
+                    cursor.execute(statement)
+            conn.commit()
+        finally:
+            conn.close()
+
+    execute(schema['statements'])
+
+    if os.path.isdir(data_path):
+        sources = csv_sources(data_path)
+    else:
+        sources = spool_inserts(data_path)
+
+    def copy_table(table):
+        conn = connect(*params)
+        try:
+            with conn.cursor() as cursor:
+                for copy_sql, source in sources[table]:
+                    cursor.copy_expert(copy_sql, source)
+            conn.commit()
+        finally:
+            conn.close()
+            for _, source in sources[table]:
+                source.close()
+
+    tables = [table for table in schema['tables'] if table in sources]
+    tables += [table for table in sources if table not in schema['tables']]
+    for level in load_levels(tables, schema['dependencies']):
+        _run_parallel(copy_table, level, workers)
+    print(f"Loaded {len(tables)} tables in {time.monotonic() - started:.2f}s")
+
+    if defer_constraints:
+        by_table = {}
+        for statement in schema['primary_keys']:
+            by_table.setdefault(statement.split()[2], []).append(statement)
+        _run_parallel(execute, list(by_table.values()), workers)
+        if schema['foreign_keys']:
+            execute(schema['foreign_keys'])
+    if schema['indexes']:
+        _run_parallel(execute, [[statement] for statement in schema['indexes']], workers)
+    prepare_database(*params)
+    execute([f"ANALYZE {table}" for table in tables])
+    print(f"Database ready in {time.monotonic() - started:.2f}s")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Создание и заполнение базы данных")
+    parser.add_argument('--copy', action='store_true', help="быстрая загрузка через COPY")
+    parser.add_argument('--data', default='scripts/output_data.sql',
+                        help="INSERT-скрипт или каталог с CSV-дампом")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--no-defer', action='store_true', help="не откладывать PK/FK до загрузки данных")
+    args = parser.parse_args()
+
+    # Выполнение скриптов
+    if args.copy:
+        load_fast('scripts/output_database_structure.sql', args.data,
+                  'pharmacy_db', 'your_user', 'your_password',
+                  workers=args.workers, defer_constraints=not args.no_defer)
+    else:
+        execute_sql('scripts/output_database_structure.sql', 'pharmacy_db', 'your_user', 'your_password')
+        execute_sql(args.data, 'pharmacy_db', 'your_user', 'your_password')
+        prepare_database('pharmacy_db', 'your_user', 'your_password')
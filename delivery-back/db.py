@@ -1,7 +1,19 @@
-import sqlite3
-import psycopg2
+import re
 import os
-from psycopg2.extras import RealDictCursor
+import itertools
+import logging
+import tempfile
+import threading
+import time
+import zlib
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from multiprocessing import Array
+from urllib.parse import quote
+
+from metrics import record_query
+import versions
 
 DATABASE_TYPE = 'postgres'  # Измените на 'postgres', если используете PostgreSQL
 #DATABASE_TYPE = 'sqlite'
@@ -9,7 +21,16 @@ db_name = str(os.getenv('POSTGRES_DB')).replace("-", "_")
 
 DATABASE_CONFIG = {
     'sqlite': {
-        'database': 'pharmacy.db'
+        'database': 'pharmacy.db',
+        # Размер кэша скомпилированных запросов на соединение
+        'cached_statements': int(os.getenv('DB_SQLITE_CACHED_STATEMENTS', 256)),
+        # 'tuned': WAL, mmap, кэш страниц, читатели только для чтения и один
+        # писатель на процесс; 'default': настройки sqlite3 по умолчанию
+        'profile': os.getenv('DB_SQLITE_PROFILE', 'tuned'),
+        'busy_timeout': float(os.getenv('DB_SQLITE_BUSY_TIMEOUT', 5)),
+        'cache_size_kb': int(os.getenv('DB_SQLITE_CACHE_SIZE_KB', 65536)),
+        'mmap_size': int(os.getenv('DB_SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+        'synchronous': os.getenv('DB_SQLITE_SYNCHRONOUS', 'NORMAL')
     },
     'postgres': {
         'dbname': db_name,
@@ -17,6 +38,64 @@ DATABASE_CONFIG = {
         'password': os.getenv('POSTGRES_PASS'),
         'host': os.getenv('POSTGRES_HOST'),
         'port': os.getenv('POSTGRES_PORT')
+    },
+    # Размер пачки строк для потоковой выборки
+    'stream_batch_size': int(os.getenv('DB_STREAM_BATCH_SIZE', 500)),
+    # Настройки пула соединений (только для Postgres)
+    'pool': {
+        'minconn': int(os.getenv('DB_POOL_MIN', 1)),
+        'maxconn': int(os.getenv('DB_POOL_MAX', 10)),
+        'timeout': float(os.getenv('DB_POOL_TIMEOUT', 30)),
+        'idle_timeout': float(os.getenv('DB_POOL_IDLE_TIMEOUT', 300)),
+        'health_check_interval': float(os.getenv('DB_POOL_HEALTH_CHECK', 30))
+    },
+    # Реплики Postgres для чтения: DB_REPLICA_HOSTS=replica1:5432,replica2
+    # (пользователь, пароль и база -- как у primary); пусто -- все на primary.
+    # ETag каталога считается по записям в primary, поэтому ответ реплики
+    # может отставать от своего ETag не больше чем на max_lag секунд
+    'replicas': {
+        'hosts': [dict(zip(('host', 'port'), host.strip().split(':', 1)))
+                  for host in os.getenv('DB_REPLICA_HOSTS', '').split(',') if host.strip()],
+        # Чтения клиента после его записи идут в primary в течение этого окна
+        'sticky_window': float(os.getenv('DB_REPLICA_STICKY_SECONDS', 2)),
+        'max_lag': float(os.getenv('DB_REPLICA_MAX_LAG', 1)),
+        'lag_check_interval': float(os.getenv('DB_REPLICA_LAG_CHECK_INTERVAL', 1))
+    },
+    # Многоарендный режим (tenants.py): лаборатория /away/<uuid>/api работает
+    # со своей базой ('database') или схемой в общей базе ('schema'; для SQLite --
+    # файл в sqlite_dir). В name {tenant} -- uuid лаборатории с '_' вместо '-'
+    'tenants': {
+        'enabled': os.getenv('TENANT_MODE', '0') == '1',
+        'isolation': os.getenv('TENANT_ISOLATION', 'database'),
+        'name': os.getenv('TENANT_DB_NAME', 'lab_{tenant}'),
+        'sqlite_dir': os.getenv('TENANT_SQLITE_DIR', 'tenants'),
+        # Пул лаборатории закрывается после стольких секунд без запросов
+        'idle_timeout': float(os.getenv('TENANT_IDLE_TIMEOUT', 600)),
+        # Сверх этого числа открытых пулов вытесняется давно не использованный
+        'max_active': int(os.getenv('TENANT_MAX_ACTIVE', 200)),
+        'pool': {
+            'minconn': int(os.getenv('TENANT_POOL_MIN', 1)),
+            'maxconn': int(os.getenv('TENANT_POOL_MAX', 3)),
+            'timeout': float(os.getenv('TENANT_POOL_TIMEOUT', 10)),
+            'idle_timeout': float(os.getenv('TENANT_POOL_IDLE_TIMEOUT', 60)),
+            'health_check_interval': float(os.getenv('DB_POOL_HEALTH_CHECK', 30))
+        }
+    },
+    # Снимок для сброса базы (snapshot.py): база-шаблон Postgres или файл SQLite;
+    # пусто -- '<база>_template' / '<файл>.template'. maintenance_db -- база,
+    # из которой выполняются CREATE/DROP DATABASE
+    'snapshot': {
+        'template': os.getenv('SNAPSHOT_TEMPLATE', ''),
+        'maintenance_db': os.getenv('SNAPSHOT_MAINTENANCE_DB', 'postgres'),
+        # Журнал сбросов из CLI для запущенного сервера; пусто --
+        # '<файл SQLite>.resets' или '<tmp>/<база Postgres>.resets'
+        'reset_log': os.getenv('SNAPSHOT_RESET_LOG', '')
+    },
+    # Групповой commit записей (groupcommit.py): окно ожидания и размер пачки
+    'group_commit': {
+        'enabled': os.getenv('DB_GROUP_COMMIT', '0') == '1',
+        'max_delay': float(os.getenv('DB_GROUP_COMMIT_MAX_DELAY_MS', 2)) / 1000,
+        'max_batch': int(os.getenv('DB_GROUP_COMMIT_MAX_BATCH', 64))
     }
 }
 # DATABASE_CONFIG = {
@@ -33,41 +112,1229 @@ DATABASE_CONFIG = {
 # }
 
 
-def get_connection():
+# Схема открытого соединения (SQLite или Postgres): для createdb.py,
+# indexes.py, search.py и ratings.py, работающих с соединением напрямую
+
+def is_sqlite(conn):
+    import sqlite3
+    return isinstance(conn, sqlite3.Connection)
+
+
+def table_exists(conn, table):
+    cursor = conn.cursor()
+    try:
+        if is_sqlite(conn):
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (table,))
+            return cursor.fetchone() is not None
+        cursor.execute("SELECT to_regclass(%s)", (table,))
+        return cursor.fetchone()[0] is not None
+    finally:
+        cursor.close()
+
+
+def table_columns(conn, table):
+    # Пустое множество, если таблицы нет
+    cursor = conn.cursor()
+    try:
+        if is_sqlite(conn):
+            cursor.execute(f"PRAGMA table_info({table})")
+            return {row[1] for row in cursor.fetchall()}
+        cursor.execute("""
+            SELECT attname FROM pg_attribute
+            WHERE attrelid = to_regclass(%s) AND attnum > 0 AND NOT attisdropped
+        """, (table,))
+        return {row[0] for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class PoolClosed(Exception):
+    pass
+
+
+class UnknownTenant(Exception):
+    def __init__(self, tenant):
+        super().__init__(f"Unknown lab {tenant}")
+        self.tenant = tenant
+
+
+# Драйвер импортируется при первом соединении и только для используемой
+# базы: импорт db.py не тянет ни sqlite3, ни psycopg2
+_connection_classes = {}
+
+
+def _connection_class(name, base, **attrs):
+    # Соединения помнят, какие запросы реестра на них уже подготовлены
+    if name not in _connection_classes:
+        def __init__(self, *args, **kwargs):
+            base.__init__(self, *args, **kwargs)
+            self.prepared = set()
+        _connection_classes[name] = type(name, (base,), dict(attrs, __init__=__init__))
+    return _connection_classes[name]
+
+
+def sqlite_pragmas(readonly=False):
+    # PRAGMA профиля 'tuned'; режим WAL сохраняется в файле базы
+    config = DATABASE_CONFIG['sqlite']
+    pragmas = [f"PRAGMA cache_size = -{config['cache_size_kb']}",
+               f"PRAGMA mmap_size = {config['mmap_size']}"]
+    if not readonly:
+        pragmas += ["PRAGMA journal_mode = WAL", f"PRAGMA synchronous = {config['synchronous']}"]
+    return pragmas
+
+
+def tenant_name(tenant):
+    return DATABASE_CONFIG['tenants']['name'].format(tenant=tenant.replace('-', '_'))
+
+
+def tenant_settings(tenant):
+    # Параметры подключения лаборатории поверх DATABASE_CONFIG
+    if tenant is None:
+        return {}
+    config = DATABASE_CONFIG['tenants']
+    name = tenant_name(tenant)
+    if DATABASE_TYPE == 'sqlite':
+        return {'database': os.path.join(config['sqlite_dir'], f"{name}.db")}
+    if config['isolation'] == 'schema':
+        return {'options': f"-c search_path={name}"}
+    return {'dbname': name}
+
+
+# Поколения баз: после пересоздания базы (snapshot.py) счетчик ее слота
+# растет, и соединения Postgres к старой базе во всех воркерах отбрасываются
+# пулом при следующей выдаче. Массив в разделяемой памяти, как в versions.py
+RESET_EPOCH_SLOTS = 1024
+_reset_epochs = Array('q', RESET_EPOCH_SLOTS)
+
+
+def _reset_slot(tenant):
+    return zlib.crc32((tenant or '').encode()) % RESET_EPOCH_SLOTS
+
+
+def database_reset(tenant=None):
+    slot = _reset_slot(tenant)
+    with _reset_epochs.get_lock():
+        _reset_epochs[slot] += 1
+
+
+def reset_epoch(tenant=None):
+    return _reset_epochs[_reset_slot(tenant)]
+
+
+# Сбросы из другого процесса (python snapshot.py reset при запущенном
+# сервере): разделяемые массивы поколений и версий у CLI свои, поэтому CLI
+# дописывает строку в журнал сбросов, а воркеры перед запросом сверяют
+# размер журнала и применяют новые строки. Строки старше запуска сервера
+# пропускаются. [inode журнала, прочитано байт]
+_reset_log_position = Array('q', 2)
+_BOOT_TIME = time.time()
+
+
+def reset_log_path():
+    path = DATABASE_CONFIG['snapshot']['reset_log']
+    if path:
+        return path
+    if DATABASE_TYPE == 'sqlite':
+        return f"{DATABASE_CONFIG['sqlite']['database']}.resets"
+    return os.path.join(tempfile.gettempdir(), f"{DATABASE_CONFIG['postgres']['dbname']}.resets")
+
+
+def publish_reset(tenant=None):
+    # Одна строка одним write с O_APPEND: читатели не видят половину строки
+    fd = os.open(reset_log_path(), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, f"{time.time():.6f} {tenant or '-'}\n".encode())
+    finally:
+        os.close(fd)
+
+
+def apply_published_resets():
+    path = reset_log_path()
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return
+    if _reset_log_position[0] == stat.st_ino and _reset_log_position[1] == stat.st_size:
+        return
+    with _reset_log_position.get_lock():
+        inode, offset = _reset_log_position[0], _reset_log_position[1]
+        if inode != stat.st_ino or offset > stat.st_size:
+            # Новый или усеченный журнал
+            offset = 0
+        with open(path, 'rb') as log:
+            log.seek(offset)
+            data = log.read()
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].decode().splitlines():
+            published, tenant = line.split(' ', 1)
+            if float(published) < _BOOT_TIME:
+                continue
+            database_reset(None if tenant == '-' else tenant)
+            versions.bump(*versions.TRACKED_TABLES)
+            logger.info(f"Applied database reset of {tenant} published by another process")
+        _reset_log_position[0], _reset_log_position[1] = stat.st_ino, offset + end
+
+
+def get_connection(readonly=False, replica=None, tenant=None):
+    # readonly -- соединение читателя (только для SQLite-профиля 'tuned');
+    # replica -- {'host', 'port'} реплики Postgres вместо primary;
+    # tenant -- uuid лаборатории в многоарендном режиме
     if DATABASE_TYPE == 'sqlite':
-        return sqlite3.connect(DATABASE_CONFIG['sqlite']['database'])
+        import sqlite3
+        config = dict(DATABASE_CONFIG['sqlite'], **tenant_settings(tenant))
+        tuned = config['profile'] == 'tuned'
+        database = config['database']
+        if tuned and readonly:
+            database = f"file:{quote(os.path.abspath(database))}?mode=ro"
+        # Писатель профиля 'tuned' один на процесс и передается между потоками под блокировкой
+        conn = sqlite3.connect(database, uri=tuned and readonly, timeout=config['busy_timeout'],
+                               check_same_thread=not tuned or readonly,
+                               factory=_connection_class('SQLiteConnection', sqlite3.Connection),
+                               cached_statements=config['cached_statements'])
+        conn.row_factory = sqlite3.Row
+        if tuned:
+            for pragma in sqlite_pragmas(readonly):
+                conn.execute(pragma)
+        return conn
     elif DATABASE_TYPE == 'postgres':
-        config = DATABASE_CONFIG['postgres']
-        return psycopg2.connect(
+        import psycopg2
+        import psycopg2.extensions
+        from psycopg2.extras import RealDictCursor
+        config = dict(DATABASE_CONFIG['postgres'], **(replica or {}), **tenant_settings(tenant))
+        slot = _reset_slot(tenant)
+        epoch = _reset_epochs[slot]
+        conn = psycopg2.connect(
             dbname=config['dbname'],
             user=config['user'],
             password=config['password'],
             host=config['host'],
-            port=config['port']
+            port=config['port'],
+            options=config.get('options'),
+            connection_factory=_connection_class('PostgresConnection', psycopg2.extensions.connection,
+                                                  dict_cursor=RealDictCursor)
         )
+        conn.reset_slot, conn.reset_epoch = slot, epoch
+        return conn
+
+
+# psycopg2.extensions.TRANSACTION_STATUS_IDLE
+TRANSACTION_STATUS_IDLE = 0
+
+
+class ConnectionPool:
+    # Пул соединений Postgres: соединение выдается потоку целиком,
+    # повторный checkout в том же потоке возвращает то же соединение
+    def __init__(self, connect, minconn=1, maxconn=10, timeout=30,
+                 idle_timeout=300, health_check_interval=30):
+        self.connect = connect
+        self.minconn = minconn
+        self.maxconn = max(maxconn, minconn, 1)
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.pid = os.getpid()
+
+        self._idle = deque()  # (conn, время возврата в пул)
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+            'timeouts': 0,
+            'created': 0,
+            'closed': 0,
+            'health_check_failures': 0
+        }
+
+    def fill(self):
+        # Прогрев пула до minconn соединений
+        while True:
+            with self._cond:
+                if self._size >= self.minconn:
+                    return
+                self._size += 1
+            try:
+                conn = self._create()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                if not self._closed:
+                    self._idle.append((conn, time.monotonic()))
+                    self._cond.notify()
+                    continue
+            self._close(conn)
+            return
+
+    def warm(self, init):
+        # Прогрев: пул заполняется до minconn, init(conn) вызывается на каждом соединении
+        self.fill()
+        taken = []
+        try:
+            for _ in range(self.minconn):
+                taken.append(self._acquire())
+            for conn in taken:
+                init(conn)
+        finally:
+            for conn in taken:
+                self._release(conn)
+
+    def getconn(self, write=False):
+        held = getattr(self._local, 'conn', None)
+        if held is not None:
+            self._local.depth += 1
+            return held
+
+        conn = self._acquire()
+        self._local.conn = conn
+        self._local.depth = 1
+        return conn
+
+    def held(self):
+        # Поток уже держит соединение (например, внутри transaction())
+        return getattr(self._local, 'conn', None) is not None
+
+    def putconn(self, conn):
+        if getattr(self._local, 'conn', None) is not conn:
+            self._release(conn)
+            return
+        self._local.depth -= 1
+        if self._local.depth > 0:
+            return
+        self._local.conn = None
+        self._release(conn)
+
+    def closeall(self):
+        # Выданные соединения закрываются при возврате (_release),
+        # новые выдачи после закрытия -- PoolClosed
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, deque()
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close(conn)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats['size'] = self._size
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self._size - len(self._idle)
+        waits = stats['checkouts']
+        stats['wait_time_avg'] = stats['wait_time_total'] / waits if waits else 0.0
+        return stats
+
+    def _acquire(self):
+        started = time.monotonic()
+        deadline = started + self.timeout
+        waited = False
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolClosed("Connection pool is closed")
+                self._reap(time.monotonic())
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    self._size += 1
+                    conn, returned_at = None, None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout(f"No free connection in pool after {self.timeout}s")
+                waited = True
+                self._cond.wait(remaining)
+
+            wait_time = time.monotonic() - started
+            self._stats['checkouts'] += 1
+            self._stats['wait_time_total'] += wait_time
+            if waited:
+                self._stats['waits'] += 1
+            if wait_time > self._stats['wait_time_max']:
+                self._stats['wait_time_max'] = wait_time
+
+        try:
+            if conn is None:
+                return self._create()
+            if not self._healthy(conn, returned_at):
+                self._close(conn, counted=False)
+                return self._create()
+            return conn
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def _release(self, conn):
+        if not self._closed and self._reset(conn):
+            with self._cond:
+                if not self._closed:
+                    self._idle.append((conn, time.monotonic()))
+                    self._cond.notify()
+                    return
+        self._close(conn)
+
+    def _create(self):
+        conn = self.connect()
+        with self._cond:
+            self._stats['created'] += 1
+        return conn
+
+    def _close(self, conn, counted=True):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._stats['closed'] += 1
+            if counted:
+                self._size -= 1
+                self._cond.notify()
+
+    def _reap(self, now):
+        # Закрываем самые старые простаивающие соединения сверх minconn
+        while (self._idle and self._size > self.minconn
+               and now - self._idle[0][1] > self.idle_timeout):
+            conn, _ = self._idle.popleft()
+            try:
+                conn.close()
+            except Exception:
+                pass
+            self._size -= 1
+            self._stats['closed'] += 1
+
+    def _healthy(self, conn, returned_at):
+        if conn.reset_epoch != _reset_epochs[conn.reset_slot]:
+            # База пересоздана после открытия соединения
+            return False
+        if conn.closed:
+            with self._cond:
+                self._stats['health_check_failures'] += 1
+            return False
+        if time.monotonic() - returned_at < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            with self._cond:
+                self._stats['health_check_failures'] += 1
+            return False
+
+    @staticmethod
+    def _reset(conn):
+        # Незавершенная транзакция откатывается перед возвратом в пул
+        if conn.closed:
+            return False
+        try:
+            if conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            return True
+        except Exception:
+            return False
+
+
+class ThreadLocalConnections:
+    # Для SQLite: одно соединение на поток, без переоткрытия файла на каждый запрос
+    def __init__(self, connect):
+        self.connect = connect
+        self.pid = os.getpid()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._all = []
+        self._stats = {'checkouts': 0, 'created': 0}
+
+    def fill(self):
+        self.getconn()
+
+    def warm(self, init):
+        init(self.getconn())
+
+    def getconn(self, write=False):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self.connect()
+            self._local.conn = conn
+            with self._lock:
+                self._all.append(conn)
+                self._stats['created'] += 1
+        self._stats['checkouts'] += 1
+        return conn
+
+    def putconn(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+
+    def closeall(self):
+        with self._lock:
+            connections, self._all = self._all, []
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        self._local = threading.local()
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats['size'] = len(self._all)
+        return stats
+
+
+class SQLiteConnections:
+    # SQLite-профиль 'tuned': чтения идут через соединения только для чтения,
+    # по одному на поток, и в режиме WAL не ждут записи; все записи процесса
+    # идут через одно соединение под блокировкой (SQLite допускает одного писателя)
+    def __init__(self, connect):
+        self.connect = connect
+        self.pid = os.getpid()
+        self.readers = ThreadLocalConnections(lambda: connect(readonly=True))
+        self._writer = None
+        self._write_lock = threading.RLock()
+        self._depth = 0
+        self._stats = {'writes': 0, 'write_waits': 0, 'write_wait_total': 0.0}
+
+    def _open_writer(self):
+        # Писатель открывается первым: он переводит базу в WAL до открытия читателей
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = self.connect()
+
+    def fill(self):
+        self._open_writer()
+        self.readers.fill()
+
+    def warm(self, init):
+        self._open_writer()
+        self.readers.warm(init)
+
+    def getconn(self, write=False):
+        if not write:
+            if self._writer is None:
+                self._open_writer()
+            return self.readers.getconn()
+        started = time.perf_counter()
+        if not self._write_lock.acquire(blocking=False):
+            self._write_lock.acquire()
+            self._stats['write_waits'] += 1
+            self._stats['write_wait_total'] += time.perf_counter() - started
+        if self._writer is None:
+            self._writer = self.connect()
+        self._depth += 1
+        self._stats['writes'] += 1
+        return self._writer
+
+    def putconn(self, conn):
+        if conn is not self._writer:
+            self.readers.putconn(conn)
+            return
+        self._depth -= 1
+        try:
+            if self._depth == 0 and conn.in_transaction:
+                conn.rollback()
+        finally:
+            self._write_lock.release()
+
+    def closeall(self):
+        self.readers.closeall()
+        with self._write_lock:
+            if self._writer is not None:
+                try:
+                    self._writer.close()
+                except Exception:
+                    pass
+                self._writer = None
+
+    def stats(self):
+        stats = self.readers.stats()
+        stats.update(self._stats)
+        return stats
+
+
+# Отставание реплики, секунд; 0, если все полученные WAL уже применены
+REPLICA_LAG_QUERY = """
+    SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+           END
+"""
+
+
+class Replicas:
+    # Пулы реплик Postgres: чтения распределяются по кругу между репликами,
+    # чье отставание не больше max_lag. Отставание проверяет фоновый поток;
+    # реплика, которая не ответила, до следующей проверки не используется
+    def __init__(self, hosts, max_lag=1, lag_check_interval=1):
+        self.hosts = hosts
+        self.max_lag = max_lag
+        self.lag_check_interval = lag_check_interval
+        self.pid = os.getpid()
+        self.pools = [ConnectionPool(lambda replica=replica: get_connection(replica=replica),
+                                     **DATABASE_CONFIG['pool'])
+                      for replica in hosts]
+        # None -- отставание неизвестно (еще не проверялось или реплика недоступна)
+        self.lags = [None] * len(hosts)
+        self._next = itertools.count()
+        self._monitor_conns = [None] * len(hosts)
+        self._monitor = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._stats = {'replica_reads': 0, 'primary_reads': 0, 'sticky_reads': 0, 'replica_errors': 0}
+
+    def count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def choose(self):
+        # Пул реплики для чтения или None -- читать из primary
+        self._start_monitor()
+        healthy = [pool for pool, lag in zip(self.pools, self.lags) if lag is not None and lag <= self.max_lag]
+        if not healthy:
+            self.count('primary_reads')
+            return None
+        self.count('replica_reads')
+        return healthy[next(self._next) % len(healthy)]
+
+    def mark_down(self, pool):
+        self.lags[self.pools.index(pool)] = None
+        self.count('replica_errors')
+
+    def check(self):
+        for i, replica in enumerate(self.hosts):
+            conn = self._monitor_conns[i]
+            try:
+                if conn is None or conn.closed:
+                    conn = self._monitor_conns[i] = get_connection(replica=replica)
+                with conn.cursor() as cursor:
+                    cursor.execute(REPLICA_LAG_QUERY)
+                    self.lags[i] = float(cursor.fetchone()[0])
+                conn.rollback()
+            except Exception as e:
+                if self.lags[i] is not None:
+                    logger.warning(f"Replica {replica['host']} unavailable: {e}")
+                self.lags[i] = None
+                self._monitor_conns[i] = None
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+    def _start_monitor(self):
+        if self._monitor is not None:
+            return
+        with self._lock:
+            if self._monitor is None:
+                self._monitor = threading.Thread(target=self._monitor_loop, name='replica-lag', daemon=True)
+                self._monitor.start()
+
+    def _monitor_loop(self):
+        while True:
+            self.check()
+            if self._stopped.wait(self.lag_check_interval):
+                return
 
-def query_db(query, args=(), one=False):
-    conn = get_connection()
+    def closeall(self):
+        self._stopped.set()
+        if self._monitor is not None:
+            self._monitor.join()
+        for conn in self._monitor_conns:
+            if conn is not None:
+                conn.close()
+        for pool in self.pools:
+            pool.closeall()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['replicas'] = [{'host': replica['host'], 'lag': lag, 'pool': pool.stats()}
+                             for replica, lag, pool in zip(self.hosts, self.lags, self.pools)]
+        return stats
+
+
+def create_pool(connect, config):
+    # connect(readonly=False) -> соединение; config -- настройки ConnectionPool
+    if DATABASE_TYPE != 'sqlite':
+        return ConnectionPool(connect, **config)
+    if DATABASE_CONFIG['sqlite']['profile'] == 'tuned':
+        return SQLiteConnections(connect)
+    return ThreadLocalConnections(connect)
+
+
+class TenantPools:
+    # Пулы лабораторий: пул создается при первом запросе лаборатории и
+    # закрывается фоновым потоком после idle_timeout без запросов, так что
+    # память процесса зависит от числа активных лабораторий. Сверх max_active
+    # вытесняется давно не использованный пул без выданных соединений; если
+    # заняты все, новая лаборатория ждет до wait_timeout (PoolTimeout)
+    def __init__(self, idle_timeout=600, max_active=200, wait_timeout=10):
+        self.idle_timeout = idle_timeout
+        self.max_active = max_active
+        self.wait_timeout = wait_timeout
+        self.pid = os.getpid()
+        self._pools = {}  # tenant -> [пул, время последнего запроса, выдано соединений]
+        self._lock = threading.Condition()
+        self._reaper = None
+        self._stopped = threading.Event()
+        self._stats = {'created': 0, 'evicted': 0}
+
+    def _entry(self, tenant, evicted):
+        # Вызывается под self._lock; вытесненные пулы добавляются в evicted
+        # и закрываются вызывающим после снятия блокировки
+        deadline = time.monotonic() + self.wait_timeout
+        entry = self._pools.get(tenant)
+        while entry is None and len(self._pools) >= self.max_active:
+            idle = [name for name, (_, _, active) in self._pools.items() if not active]
+            if idle:
+                evicted.extend(self._evict([min(idle, key=lambda name: self._pools[name][1])]))
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise PoolTimeout(f"All {self.max_active} lab pools are busy")
+            self._lock.wait(remaining)
+            entry = self._pools.get(tenant)
+        if entry is None:
+            pool = create_pool(lambda readonly=False: get_connection(readonly, tenant=tenant),
+                               DATABASE_CONFIG['tenants']['pool'])
+            entry = self._pools[tenant] = [pool, 0, 0]
+            self._stats['created'] += 1
+        entry[1] = time.monotonic()
+        return entry
+
+    @staticmethod
+    def _close(evicted):
+        for tenant, pool in evicted:
+            pool.closeall()
+            logger.info(f"Tenant {tenant} evicted")
+
+    def get(self, tenant):
+        evicted = []
+        try:
+            with self._lock:
+                pool = self._entry(tenant, evicted)[0]
+        finally:
+            self._close(evicted)
+        self._start_reaper()
+        return pool
+
+    @contextmanager
+    def checkout(self, tenant):
+        # Пул на время выдачи соединения: счетчик растет под той же блокировкой,
+        # под которой _evict проверяет занятость, поэтому пул не закроется
+        # между поиском и getconn (для пулов любого типа)
+        evicted = []
+        try:
+            with self._lock:
+                entry = self._entry(tenant, evicted)
+                entry[2] += 1
+        finally:
+            self._close(evicted)
+        self._start_reaper()
+        try:
+            yield entry[0]
+        finally:
+            with self._lock:
+                entry[2] -= 1
+                entry[1] = time.monotonic()
+                if not entry[2]:
+                    self._lock.notify_all()
+
+    def exists(self, tenant):
+        # База лаборатории создается не здесь: неизвестный uuid -- UnknownTenant
+        with self._lock:
+            if tenant in self._pools:
+                return True
+        config = DATABASE_CONFIG['tenants']
+        if DATABASE_TYPE == 'sqlite':
+            return os.path.exists(tenant_settings(tenant)['database'])
+        if config['isolation'] == 'schema':
+            query = "SELECT 1 FROM pg_namespace WHERE nspname = %s"
+        else:
+            query = "SELECT 1 FROM pg_database WHERE datname = %s"
+        with using_tenant(None):
+            return query_db(query, (tenant_name(tenant),), one=True) is not None
+
+    def _evict(self, tenants):
+        # Вызывается под self._lock; пул с выданными соединениями не вытесняется.
+        # Возвращает [(tenant, пул)] для закрытия после снятия блокировки
+        evicted = []
+        for tenant in tenants:
+            pool, _, active = self._pools[tenant]
+            if active:
+                continue
+            del self._pools[tenant]
+            evicted.append((tenant, pool))
+            self._stats['evicted'] += 1
+        if evicted:
+            self._lock.notify_all()
+        return evicted
+
+    def evict_idle(self):
+        now = time.monotonic()
+        with self._lock:
+            evicted = self._evict([tenant for tenant, (_, used_at, _) in self._pools.items()
+                                   if now - used_at > self.idle_timeout])
+        self._close(evicted)
+
+    def _start_reaper(self):
+        if self._reaper is not None:
+            return
+        with self._lock:
+            if self._reaper is None:
+                self._reaper = threading.Thread(target=self._reap_loop, name='tenant-reaper', daemon=True)
+                self._reaper.start()
+
+    def _reap_loop(self):
+        while not self._stopped.wait(min(self.idle_timeout / 2, 30)):
+            try:
+                self.evict_idle()
+            except Exception as e:
+                logger.error(f"Tenant eviction failed: {e}")
+
+    def closeall(self):
+        self._stopped.set()
+        with self._lock:
+            pools, self._pools = self._pools, {}
+        for pool, _, _ in pools.values():
+            pool.closeall()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['active'] = len(self._pools)
+        return stats
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_replicas = None
+_tenant_pools = None
+_tenant = ContextVar('db_tenant', default=None)
+
+
+def get_pool():
+    global _pool
+    tenant = _tenant.get()
+    if tenant is not None:
+        return get_tenant_pools().get(tenant)
+    pool = _pool
+    # После fork (gunicorn) соединения родителя не переиспользуем
+    if pool is not None and pool.pid == os.getpid():
+        return pool
+    with _pool_lock:
+        if _pool is None or _pool.pid != os.getpid():
+            _pool = create_pool(get_connection, DATABASE_CONFIG['pool'])
+        return _pool
+
+
+def get_tenant_pools():
+    global _tenant_pools
+    pools = _tenant_pools
+    if pools is not None and pools.pid == os.getpid():
+        return pools
+    with _pool_lock:
+        if _tenant_pools is None or _tenant_pools.pid != os.getpid():
+            config = DATABASE_CONFIG['tenants']
+            _tenant_pools = TenantPools(config['idle_timeout'], config['max_active'], config['pool']['timeout'])
+        return _tenant_pools
+
+
+def current_tenant():
+    return _tenant.get()
+
+
+def use_tenant(tenant):
+    # Запросы текущего потока (или задачи) идут в базу лаборатории tenant;
+    # None -- база по умолчанию
+    if tenant is not None and not get_tenant_pools().exists(tenant):
+        raise UnknownTenant(tenant)
+    _tenant.set(tenant)
+
+
+@contextmanager
+def using_tenant(tenant):
+    token = _tenant.set(tenant)
+    try:
+        yield
+    finally:
+        _tenant.reset(token)
+
+
+def tenant_stats():
+    return get_tenant_pools().stats() if DATABASE_CONFIG['tenants']['enabled'] else {}
+
+
+def get_replicas():
+    # None -- реплики не настроены
+    global _replicas
+    hosts = DATABASE_CONFIG['replicas']['hosts']
+    if DATABASE_TYPE == 'sqlite' or not hosts:
+        return None
+    replicas = _replicas
+    if replicas is not None and replicas.pid == os.getpid():
+        return replicas
+    with _pool_lock:
+        if _replicas is None or _replicas.pid != os.getpid():
+            config = DATABASE_CONFIG['replicas']
+            _replicas = Replicas(hosts, config['max_lag'], config['lag_check_interval'])
+        return _replicas
+
+
+def close_pool():
+    global _pool, _replicas, _tenant_pools
+    with _pool_lock:
+        for pool in (_pool, _replicas, _tenant_pools):
+            if pool is not None and pool.pid == os.getpid():
+                pool.closeall()
+        _pool = None
+        _replicas = None
+        _tenant_pools = None
+
+
+def pool_stats():
+    return get_pool().stats()
+
+
+def replica_stats():
+    replicas = get_replicas()
+    return replicas.stats() if replicas is not None else {}
+
+
+# Read-your-writes: время последней записи по ключу клиента (заголовок
+# Authorization) в разделяемой памяти, общей для воркеров gunicorn (как
+# счетчики versions.py). Ключи хэшируются в слоты: совпадение слотов только
+# отправляет лишние чтения в primary. time.monotonic() общий для процессов хоста
+RECENT_WRITE_SLOTS = 4096
+_recent_writes = Array('d', RECENT_WRITE_SLOTS)
+_session_key = ContextVar('db_session_key', default=None)
+
+
+def set_session(key):
+    # Ключ клиента текущего запроса (вызывается в before_request)
+    _session_key.set(key)
+
+
+def _session_slot():
+    key = _session_key.get()
+    return None if key is None else zlib.crc32(key.encode()) % RECENT_WRITE_SLOTS
+
+
+def note_write():
+    # После commit: чтения этого клиента какое-то время идут в primary
+    slot = _session_slot()
+    if slot is not None and DATABASE_CONFIG['replicas']['hosts']:
+        _recent_writes[slot] = time.monotonic()
+
+
+def read_replica():
+    # Replicas и пул реплики для чтения или (replicas, None) -- читать из primary
+    replicas = get_replicas()
+    if replicas is None:
+        return None, None
+    slot = _session_slot()
+    if slot is not None and time.monotonic() - _recent_writes[slot] < DATABASE_CONFIG['replicas']['sticky_window']:
+        replicas.count('sticky_reads')
+        return replicas, None
+    return replicas, replicas.choose()
+
+
+@contextmanager
+def connection(write=False):
+    # write -- соединение для записи (в SQLite-профиле 'tuned' -- общий писатель);
+    # чтения базы по умолчанию идут в реплику, если они настроены и поток
+    # не держит соединение primary
+    tenant = _tenant.get()
+    if tenant is not None:
+        with get_tenant_pools().checkout(tenant) as pool:
+            conn = pool.getconn(write)
+            try:
+                yield conn
+            finally:
+                pool.putconn(conn)
+        return
+    pool = get_pool()
+    replica = None
+    if not write and DATABASE_TYPE != 'sqlite' and not pool.held():
+        replicas, replica = read_replica()
+    if replica is not None:
+        try:
+            conn = replica.getconn()
+            pool = replica
+        except Exception as e:
+            logger.warning(f"Replica read failed, using primary: {e}")
+            replicas.mark_down(replica)
+            conn = pool.getconn(write)
+    else:
+        conn = pool.getconn(write)
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn)
+
+
+def _cursor(conn, shape, name=None):
+    # С shape строки читаются кортежами и сразу собираются в записи
     if DATABASE_TYPE == 'sqlite':
-        conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
-    else:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)  # Используем RealDictCursor для Postgres
-    cursor.execute(query, args)
-    rv = cursor.fetchall()
-    conn.close()
+        if shape is not None:
+            cursor.row_factory = None
+        return cursor
+    if shape is not None:
+        return conn.cursor(name) if name else conn.cursor()
+    return conn.cursor(name, cursor_factory=conn.dict_cursor)  # RealDictCursor для Postgres
+
 
+def _converter(cursor, shape):
+    if shape is not None:
+        return shape.converter([column[0] for column in cursor.description])
     if DATABASE_TYPE == 'sqlite':
-        data = [dict(row) for row in rv]
-    else:
-        data = rv
+        return dict
+    return None
+
+
+def _fetch(conn, query, args, shape=None):
+    cursor = _cursor(conn, shape)
+    try:
+        started = time.perf_counter()
+        cursor.execute(query, args)
+        executed = time.perf_counter()
+        rv = cursor.fetchall()
+        fetched = time.perf_counter()
+        convert = _converter(cursor, shape)
+    finally:
+        cursor.close()
+
+    data = rv if convert is None else list(map(convert, rv))
+    return data, executed - started, fetched - executed
+
+
+def query_db(query, args=(), one=False, shape=None):
+    # shape (rows.RowShape) -- вернуть компактные записи вместо dict
+    started = time.perf_counter()
+    with connection() as conn:
+        connected = time.perf_counter()
+        data, execute_time, fetch_time = _fetch(conn, query, args, shape)
+    record_query(connected - started, execute_time, fetch_time, len(data))
 
     return (data[0] if data else None) if one else data
 
 
+@contextmanager
+def read_transaction():
+    # Несколько чтений на одном соединении в одной транзакции
+    # (согласованный снимок); возвращает функцию query(query, args, one, shape)
+    started = time.perf_counter()
+    with connection() as conn:
+        record_query(time.perf_counter() - started, 0.0, 0.0, queries=0)
+        if DATABASE_TYPE == 'sqlite':
+            conn.execute("BEGIN")
+        else:
+            with conn.cursor() as cursor:
+                cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+
+        def query(query, args=(), one=False, shape=None):
+            data, execute_time, fetch_time = _fetch(conn, query, args, shape)
+            record_query(0.0, execute_time, fetch_time, len(data))
+            return (data[0] if data else None) if one else data
+
+        try:
+            yield query
+        finally:
+            conn.rollback()
+
+
+_stream_ids = itertools.count()
+
+
+def iter_query(query, args=(), shape=None, statement=None):
+    # Потоковая выборка пачками: серверный курсор в Postgres,
+    # fetchmany в SQLite. Соединение занято до конца итерации.
+    # statement -- имя запроса реестра (см. iter_statement)
+    batch_size = DATABASE_CONFIG['stream_batch_size']
+    started = time.perf_counter()
+    with connection() as conn:
+        connected = time.perf_counter()
+        fetch_time = 0.0
+        row_count = 0
+        name = None
+        if DATABASE_TYPE != 'sqlite':
+            name = f"stream_{os.getpid()}_{next(_stream_ids)}"
+        cursor = _cursor(conn, shape, name)
+        if name:
+            cursor.itersize = batch_size
+        try:
+            if statement and DATABASE_TYPE == 'sqlite':
+                query = _statement_sql(conn, statement, args)
+            cursor.execute(query, args)
+            executed = time.perf_counter()
+            record_query(connected - started, executed - connected, 0.0)
+            convert = False
+            while True:
+                fetch_started = time.perf_counter()
+                rows = cursor.fetchmany(batch_size)
+                fetch_time += time.perf_counter() - fetch_started
+                if not rows:
+                    break
+                row_count += len(rows)
+                # У серверного курсора description известен после первой выборки
+                if convert is False:
+                    convert = _converter(cursor, shape)
+                yield from (rows if convert is None else map(convert, rows))
+        finally:
+            cursor.close()
+            record_query(0.0, 0.0, fetch_time, row_count, queries=0)
+
+
 def execute_db(query, args=()):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute(query, args)
-    conn.commit()
-    conn.close()
+    started = time.perf_counter()
+    with connection(write=True) as conn:
+        connected = time.perf_counter()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(query, args)
+            conn.commit()
+        finally:
+            cursor.close()
+    record_query(connected - started, time.perf_counter() - connected, 0.0)
+    note_write()
+    versions.bump_for([query])
+
+
+class TrackedCursor:
+    # Курсор транзакции, запоминающий запросы для счетчиков версий
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.queries = []
+
+    def execute(self, query, *args):
+        self.queries.append(query)
+        return self._cursor.execute(query, *args)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+@contextmanager
+def transaction():
+    # Несколько запросов на одном соединении с одним commit;
+    # в метриках транзакция считается одним запросом
+    started = time.perf_counter()
+    with connection(write=True) as conn:
+        connected = time.perf_counter()
+        cursor = TrackedCursor(conn.cursor())
+        try:
+            yield cursor
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+    record_query(connected - started, time.perf_counter() - connected, 0.0)
+    note_write()
+    versions.bump_for(cursor.queries)
+
+
+# Реестр именованных запросов с постоянным текстом. В Postgres запрос
+# подготавливается (PREPARE) один раз на соединение пула и дальше
+# выполняется через EXECUTE; в SQLite одинаковый текст запроса берется
+# из кэша скомпилированных запросов соединения.
+# Параметры в тексте: $1, $2, ...
+STATEMENTS = {}
+_statement_stats = {}
+_statement_lock = threading.Lock()
+_param_re = re.compile(r"\$(\d+)")
+
+
+def register_statement(name, sql):
+    STATEMENTS[name] = sql
+    with _statement_lock:
+        _statement_stats.setdefault(name, {'prepares': 0, 'hits': 0})
+
+
+def statement_stats():
+    with _statement_lock:
+        return {name: dict(stats) for name, stats in _statement_stats.items()}
+
+
+def _count_statement(name, key):
+    with _statement_lock:
+        _statement_stats[name][key] += 1
+
+
+def _statement_sql(conn, name, args):
+    # Текст запроса для выполнения на данном соединении
+    if DATABASE_TYPE == 'sqlite':
+        sql = _param_re.sub(r"?\1", STATEMENTS[name])
+    else:
+        if name not in conn.prepared:
+            with conn.cursor() as cursor:
+                cursor.execute(f"PREPARE {name} AS {STATEMENTS[name]}")
+        params = f" ({', '.join(['%s'] * len(args))})" if args else ""
+        sql = f"EXECUTE {name}{params}"
+    if name in conn.prepared:
+        _count_statement(name, 'hits')
+    else:
+        conn.prepared.add(name)
+        _count_statement(name, 'prepares')
+    return sql
+
+
+def prepare_statements(conn):
+    # Прогрев: PREPARE всех запросов реестра на соединении Postgres.
+    # Запросы другой базы (например, поиск FTS5) и запросы к отсутствующим
+    # таблицам пропускаются
+    if DATABASE_TYPE == 'sqlite':
+        return
+    for name in STATEMENTS:
+        if name in conn.prepared:
+            continue
+        try:
+            _statement_sql(conn, name, ())
+        except Exception:
+            conn.rollback()
+    conn.rollback()
+
+
+def query_statement(name, args=(), one=False, shape=None):
+    started = time.perf_counter()
+    with connection() as conn:
+        connected = time.perf_counter()
+        sql = _statement_sql(conn, name, args)
+        try:
+            data, execute_time, fetch_time = _fetch(conn, sql, args, shape)
+        except Exception as e:
+            # Подготовленный запрос потерян на сервере (DISCARD ALL и т.п.):
+            # 26000 -- invalid_sql_statement_name
+            if getattr(e, 'pgcode', None) != '26000':
+                raise
+            conn.rollback()
+            conn.prepared.discard(name)
+            sql = _statement_sql(conn, name, args)
+            data, execute_time, fetch_time = _fetch(conn, sql, args, shape)
+    record_query(connected - started, execute_time, fetch_time, len(data))
+
+    return (data[0] if data else None) if one else data
+
+
+def iter_statement(name, args=(), shape=None):
+    # Серверный курсор Postgres нельзя открыть для EXECUTE,
+    # поэтому в Postgres потоковая выборка идет по тексту запроса
+    return iter_query(_param_re.sub("%s", STATEMENTS[name]), args, shape, statement=name)
@@ -1,4 +1,11 @@
+import argparse
+import io
+import random
 import sqlite3
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from itertools import accumulate, islice
 
 def populate_delivery_db():
     conn = sqlite3.connect('delivery.db')
@@ -99,5 +106,269 @@ def populate_delivery_db():
     conn.commit()
     conn.close()
 
+# Генератор больших детерминированных наборов данных
+
+DEFAULT_SIZES = {
+    'users': 10_000,
+    'categories': 50,
+    'products': 100_000,
+    'orders': 200_000,
+    'reviews': 1_000_000,
+    'favorites_per_user': 5,
+    'cart_per_user': 2
+}
+
+FIRST_NAMES = ['Alice', 'Bob', 'Carol', 'Dmitry', 'Elena', 'Fedor', 'Galina', 'Ivan', 'Maria', 'Oleg']
+LAST_NAMES = ['Johnson', 'Smith', 'Ivanov', 'Petrova', 'Sidorov', 'Kuznetsova', 'Brown', 'Orlov']
+CITIES = ['Cityville', 'Townsville', 'Moscow', 'Kazan', 'Novosibirsk', 'Samara', 'Tver', 'Omsk']
+STREETS = ['Main St', 'Elm St', 'Lenina', 'Pushkina', 'Gagarina', 'Sadovaya', 'Mira']
+STORES = ['Grocery Store', 'Farm Market', 'City Bakery', 'Dairy House', 'Fresh & Co']
+CATEGORIES = ['Fruits', 'Bakery', 'Dairy', 'Vegetables', 'Meat', 'Fish', 'Drinks', 'Sweets', 'Frozen', 'Snacks']
+ADJECTIVES = ['Organic', 'Fresh', 'Whole Wheat', 'Farm', 'Premium', 'Classic', 'Low Fat', 'Spicy', 'Sweet']
+NOUNS = ['Apples', 'Bread', 'Milk', 'Cheese', 'Yogurt', 'Tomatoes', 'Salmon', 'Juice', 'Cookies', 'Chips']
+REVIEW_WORDS = ['great', 'good', 'fresh', 'tasty', 'bad', 'dry', 'cheap', 'expensive', 'fast', 'delivery',
+                'quality', 'would', 'buy', 'again', 'not', 'very', 'okay', 'packaging']
+ORDER_STATUSES = ['pending', 'completed', 'completed', 'completed', 'shipped', 'cancelled']
+PAYMENT_METHODS = ['Credit Card', 'Credit Card', 'PayPal', 'Cash', 'SBP']
+RATING_WEIGHTS = [5, 7, 12, 30, 46]  # оценки 1..5
+
+EPOCH = datetime(2023, 1, 1)
+ARTICLE_BASE = 1_000_000
+
+
+class ZipfSampler:
+    # Ранги 1..n с вероятностью ~ 1/k^s; популярные ранги перемешаны по номерам
+    def __init__(self, n, rng, s=1.1):
+        self.n = n
+        self.rng = rng
+        self.cumulative = array('d', accumulate(1.0 / k ** s for k in range(1, n + 1)))
+        self.total = self.cumulative[-1]
+        self.stride = _coprime_stride(n)
+
+    def sample(self):
+        rank = bisect_left(self.cumulative, self.rng.random() * self.total)
+        return (min(rank, self.n - 1) * self.stride) % self.n
+
+
+def _coprime_stride(n):
+    stride = max(1, int(n * 0.618))
+    while _gcd(stride, n) != 1:
+        stride += 1
+    return stride
+
+
+def _gcd(a, b):
+    while b:
+        a, b = b, a % b
+    return a
+
+
+def _rng(seed, table):
+    # Отдельный поток случайных чисел на таблицу: размеры одной таблицы не влияют на другие
+    return random.Random(f"{seed}:{table}")
+
+
+def _login(i):
+    return f"user{i:07d}@example.com"
+
+
+def _date(rng, days=730):
+    return (EPOCH + timedelta(seconds=rng.randrange(days * 86400))).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def gen_users(seed, sizes):
+    rng = _rng(seed, 'users')
+    for i in range(sizes['users']):
+        yield (_login(i), f"pw{rng.getrandbits(48):012x}", 'admin' if i == 0 else 'customer')
+
+
+def gen_user_personal_info(seed, sizes):
+    rng = _rng(seed, 'user_personal_info')
+    for i in range(sizes['users']):
+        yield (
+            _login(i),
+            f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            (datetime(1950, 1, 1) + timedelta(days=rng.randrange(20000))).strftime('%Y-%m-%d'),
+            f"{rng.randint(1, 300)} {rng.choice(STREETS)}, {rng.choice(CITIES)}",
+            f"555-{rng.randrange(10000):04d}",
+            f"secret{i}"
+        )
+
+
+def gen_product_categories(seed, sizes):
+    rng = _rng(seed, 'product_categories')
+    for i in range(sizes['categories']):
+        category = CATEGORIES[i % len(CATEGORIES)]
+        if i >= len(CATEGORIES):
+            category = f"{category} {i // len(CATEGORIES) + 1}"
+        yield (i + 1, rng.choice(STORES), category, f"secret{i}")
+
+
+def gen_products(seed, sizes):
+    rng = _rng(seed, 'products')
+    categories = ZipfSampler(sizes['categories'], rng, s=0.8)
+    for i in range(sizes['products']):
+        yield (
+            ARTICLE_BASE + i,
+            f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {i}",
+            categories.sample() + 1,
+            round(rng.lognormvariate(1.2, 0.8), 2),
+            rng.randint(0, 500),
+            rng.random() < 0.95,
+            f"secret{i}"
+        )
+
+
+def gen_orders(seed, sizes):
+    rng = _rng(seed, 'orders')
+    users = ZipfSampler(sizes['users'], rng, s=0.9)
+    for i in range(sizes['orders']):
+        yield (i + 1, _login(users.sample()), _date(rng), rng.choice(ORDER_STATUSES), f"secret{i}")
+
+
+def gen_payments(seed, sizes):
+    rng = _rng(seed, 'payments')
+    for i in range(sizes['orders']):
+        if rng.random() < 0.9:
+            yield (i + 1, rng.choice(PAYMENT_METHODS), round(rng.lognormvariate(2.5, 0.9), 2),
+                   'Paid' if rng.random() < 0.85 else 'Pending', f"secret{i}")
+
+
+def gen_reviews(seed, sizes):
+    rng = _rng(seed, 'reviews')
+    users = ZipfSampler(sizes['users'], rng, s=0.9)
+    products = ZipfSampler(sizes['products'], rng)
+    for i in range(sizes['reviews']):
+        words = rng.choices(REVIEW_WORDS, k=rng.randint(3, 12))
+        yield (
+            i + 1,
+            _login(users.sample()),
+            ARTICLE_BASE + products.sample(),
+            rng.choices(range(1, 6), weights=RATING_WEIGHTS)[0],
+            ' '.join(words).capitalize() + '.',
+            _date(rng),
+            f"secret{i}"
+        )
+
+
+def gen_shipping_addresses(seed, sizes):
+    rng = _rng(seed, 'shipping_addresses')
+    address_id = 0
+    for i in range(sizes['users']):
+        for _ in range(1 + (rng.random() < 0.2)):
+            address_id += 1
+            yield (address_id, _login(i), 'USA' if rng.random() < 0.3 else 'Russia',
+                   rng.choice(CITIES), f"{rng.randint(1, 300)} {rng.choice(STREETS)}", f"secret{address_id}")
+
+
+def _distinct_articles(rng, products, count):
+    articles = set()
+    for _ in range(count * 3):
+        if len(articles) >= count:
+            break
+        articles.add(ARTICLE_BASE + products.sample())
+    return sorted(articles)
+
+
+def gen_favorite_products(seed, sizes):
+    rng = _rng(seed, 'favorite_products')
+    products = ZipfSampler(sizes['products'], rng)
+    for i in range(sizes['users']):
+        count = rng.randint(0, 2 * sizes['favorites_per_user'])
+        for article in _distinct_articles(rng, products, min(count, sizes['products'])):
+            yield (_login(i), article, _date(rng), f"secret{i}")
+
+
+def gen_shopping_cart(seed, sizes):
+    rng = _rng(seed, 'shopping_cart')
+    products = ZipfSampler(sizes['products'], rng)
+    for i in range(sizes['users']):
+        count = rng.randint(0, 2 * sizes['cart_per_user'])
+        for article in _distinct_articles(rng, products, min(count, sizes['products'])):
+            yield (_login(i), article, rng.randint(1, 5), f"secret{i}")
+
+
+# Порядок учитывает внешние ключи create_delivery_db
+GENERATORS = [
+    ('users', ('login', 'password', 'role'), gen_users),
+    ('user_personal_info', ('login', 'name', 'birth_date', 'address', 'phone_number', 'secret'),
+     gen_user_personal_info),
+    ('product_categories', ('category_id', 'store_name', 'category', 'secret'), gen_product_categories),
+    ('products', ('article', 'name', 'category_id', 'price', 'stock', 'released', 'secret'), gen_products),
+    ('orders', ('order_id', 'login', 'order_date', 'status', 'secret'), gen_orders),
+    ('payments', ('order_id', 'payment_method', 'amount', 'payment_status', 'secret'), gen_payments),
+    ('reviews', ('review_id', 'login', 'article', 'rating', 'review_text', 'review_date', 'secret'), gen_reviews),
+    ('shipping_addresses', ('address_id', 'login', 'country', 'city', 'street', 'secret'),
+     gen_shipping_addresses),
+    ('favorite_products', ('login', 'article', 'added_date', 'secret'), gen_favorite_products),
+    ('shopping_cart', ('login', 'article', 'quantity', 'secret'), gen_shopping_cart)
+]
+
+
+def _copy_field(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def _write_batch(conn, table, columns, batch):
+    if isinstance(conn, sqlite3.Connection):
+        placeholders = ', '.join('?' * len(columns))
+        conn.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", batch)
+        return
+    buffer = io.StringIO()
+    for row in batch:
+        buffer.write('\t'.join(map(_copy_field, row)))
+        buffer.write('\n')
+    buffer.seek(0)
+    with conn.cursor() as cursor:
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+
+
+def populate_large(conn, seed=0, sizes=None, batch_size=10_000, tables=None):
+    # Строки пишутся пачками: executemany для SQLite, COPY для Postgres
+    sizes = dict(DEFAULT_SIZES, **(sizes or {}))
+    counts = {}
+    for table, columns, generate in GENERATORS:
+        if tables and table not in tables:
+            continue
+        rows = generate(seed, sizes)
+        counts[table] = 0
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            _write_batch(conn, table, columns, batch)
+            counts[table] += len(batch)
+        conn.commit()
+        print(f"{table}: {counts[table]} rows")
+    return counts
+
+
 if __name__ == '__main__':
-    populate_delivery_db()
+    parser = argparse.ArgumentParser(description="Заполнение delivery-базы")
+    parser.add_argument('--large', action='store_true', help="сгенерировать большой набор данных")
+    parser.add_argument('--backend', choices=['sqlite', 'postgres'], default='sqlite')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--batch-size', type=int, default=10_000)
+    for name, default in DEFAULT_SIZES.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=int, default=default)
+    args = parser.parse_args()
+
+    if not args.large:
+        populate_delivery_db()
+    else:
+        sizes = {name: getattr(args, name) for name in DEFAULT_SIZES}
+        if args.backend == 'sqlite':
+            connection = sqlite3.connect('delivery.db')
+        else:
+            import db
+            db.DATABASE_TYPE = 'postgres'
+            connection = db.get_connection()
+        try:
+            populate_large(connection, args.seed, sizes, args.batch_size)
+        finally:
+            connection.close()
@@ -0,0 +1,169 @@
+import atexit
+import os
+import queue
+import threading
+import time
+from bisect import bisect_left
+from concurrent.futures import Future
+
+import db
+import versions
+from metrics import record_query
+
+# Групповой commit: одиночные записи из параллельных запросов (отзывы,
+# избранное, корзина) копятся в очереди и фиксируются одной транзакцией,
+# то есть одним fsync на пачку. Каждая запись выполняется в своем
+# SAVEPOINT, поэтому ошибка одной записи не откатывает остальные и
+# вызывающий получает свой собственный результат.
+# Включается DB_GROUP_COMMIT=1, настройки -- db.DATABASE_CONFIG['group_commit'].
+
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+class GroupCommitWriter:
+    def __init__(self, max_delay=0.002, max_batch=64):
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stats = {'batches': 0, 'statements': 0, 'errors': 0, 'failed_batches': 0, 'commit_time': 0.0}
+        self._sizes = [0] * (len(BATCH_BUCKETS) + 1)
+
+    def submit(self, query):
+        # Возвращает Future: None после commit или исключение этой записи
+        self._start()
+        future = Future()
+        # Запись идет в базу лаборатории вызывающего (многоарендный режим)
+        self._queue.put((query, future, db.current_tenant()))
+        return future
+
+    def _start(self):
+        # Поток создается в воркере: после fork потоки мастера не наследуются
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._thread = threading.Thread(target=self._run, name='group-commit', daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def close(self):
+        if self._pid == os.getpid() and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._pid = None
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            # Пачка закрывается по размеру или по окну ожидания
+            deadline = time.monotonic() + self.max_delay
+            stop = False
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._commit(batch)
+            if stop:
+                return
+
+    def _commit(self, batch):
+        # Пачка фиксируется отдельной транзакцией в каждой базе
+        by_tenant = {}
+        for item in batch:
+            by_tenant.setdefault(item[2], []).append(item)
+        for tenant, items in by_tenant.items():
+            with db.using_tenant(tenant):
+                self._commit_batch(items)
+
+    def _commit_batch(self, batch):
+        started = time.perf_counter()
+        errors = []
+        try:
+            with db.connection(write=True) as conn:
+                cursor = conn.cursor()
+                try:
+                    if db.DATABASE_TYPE == 'sqlite':
+                        cursor.execute("BEGIN IMMEDIATE")
+                    for query, _, _ in batch:
+                        cursor.execute("SAVEPOINT group_write")
+                        try:
+                            cursor.execute(query)
+                            errors.append(None)
+                        except Exception as e:
+                            cursor.execute("ROLLBACK TO SAVEPOINT group_write")
+                            errors.append(e)
+                        cursor.execute("RELEASE SAVEPOINT group_write")
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                finally:
+                    cursor.close()
+        except Exception as e:
+            # Commit не прошел -- ошибка у всех записей пачки
+            self._count(batch, [e] * len(batch), started, failed=True)
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        versions.bump_for([query for (query, _, _), error in zip(batch, errors) if error is None])
+        self._count(batch, errors, started)
+        for (_, future, _), error in zip(batch, errors):
+            if error is None:
+                future.set_result(None)
+            else:
+                future.set_exception(error)
+
+    def _count(self, batch, errors, started, failed=False):
+        with self._lock:
+            self._stats['batches'] += 1
+            self._stats['statements'] += len(batch)
+            self._stats['errors'] += sum(error is not None for error in errors)
+            self._stats['failed_batches'] += failed
+            self._stats['commit_time'] += time.perf_counter() - started
+            self._sizes[bisect_left(BATCH_BUCKETS, len(batch))] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['batch_sizes'] = list(zip(BATCH_BUCKETS + ('+Inf',), self._sizes))
+        return stats
+
+
+_config = db.DATABASE_CONFIG['group_commit']
+WRITER = GroupCommitWriter(_config['max_delay'], _config['max_batch']) if _config['enabled'] else None
+
+
+def write_db(query):
+    # execute_db через групповой commit (если включен)
+    if WRITER is None:
+        return db.execute_db(query)
+    started = time.perf_counter()
+    try:
+        WRITER.submit(query).result()
+    finally:
+        record_query(0.0, time.perf_counter() - started, 0.0)
+    db.note_write()
+
+
+def close_writer():
+    if WRITER is not None:
+        WRITER.close()
+
+
+def group_commit_stats():
+    return WRITER.stats() if WRITER is not None else {}
+
+
+atexit.register(close_writer)
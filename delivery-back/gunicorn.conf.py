@@ -0,0 +1,70 @@
+import multiprocessing
+import os
+import time
+
+import db
+import groupcommit
+import inventory
+import warmup
+
+# Конфигурация production-сервера: gunicorn -c gunicorn.conf.py [app:app]
+bind = f"0.0.0.0:{os.getenv('PORT', 5000)}"
+
+# Воркеры и потоки
+# WEB_MODE=async: async_app:app на event loop (uvicorn), по одному процессу на ядро
+web_mode = os.getenv('WEB_MODE', 'sync')
+if web_mode == 'async':
+    workers = int(os.getenv('WEB_WORKERS', multiprocessing.cpu_count()))
+    worker_class = 'uvicorn.workers.UvicornWorker'
+    wsgi_app = 'async_app:app'
+else:
+    workers = int(os.getenv('WEB_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+    threads = int(os.getenv('WEB_THREADS', 4))
+    worker_class = 'gthread' if threads > 1 else 'sync'
+    wsgi_app = 'app:app'
+
+# Приложение загружается один раз в мастере до fork
+preload_app = True
+
+# Очередь входящих соединений и таймауты
+backlog = int(os.getenv('WEB_BACKLOG', 2048))
+timeout = int(os.getenv('WEB_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('WEB_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('WEB_KEEPALIVE', 5))
+
+# Плавный перезапуск воркеров после N запросов
+max_requests = int(os.getenv('WEB_MAX_REQUESTS', 10000))
+max_requests_jitter = int(os.getenv('WEB_MAX_REQUESTS_JITTER', 1000))
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.getenv('WEB_LOG_LEVEL', 'info')
+
+
+# Время старта сервера для логов прогрева
+boot_time = time.time()
+
+
+def when_ready(server):
+    # Приложение уже загружено в мастере (preload_app)
+    server.log.info(f"App loaded in {time.time() - boot_time:.3f}s")
+
+
+def post_fork(server, worker):
+    # Соединения, открытые мастером при preload, воркеру не передаются
+    db.close_pool()
+
+
+def post_worker_init(worker):
+    # Sync-воркер прогревается в фоне; async_app -- в before_serving
+    if web_mode != 'async':
+        from app import app, url_prefix
+        warmup.start(app, url_prefix, boot_time)
+
+
+def worker_exit(server, worker):
+    # SIGTERM: gunicorn дожидается текущих запросов, дописываем очередь
+    # группового commit, возвращаем неиспользованные блоки остатков и закрываем пул
+    groupcommit.close_writer()
+    inventory.close_inventory()
+    db.close_pool()
@@ -0,0 +1,172 @@
+import argparse
+import json
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime
+
+import db
+import queries
+from pagination import PAGE_LIMIT_DEFAULT, Page
+
+# Вторичные индексы delivery-схемы: (имя, таблица, колонки)
+INDEXES = [
+    ('idx_reviews_article', 'reviews', ('article', 'review_id')),
+    ('idx_reviews_login', 'reviews', ('login', 'review_id')),
+    ('idx_orders_login', 'orders', ('login', 'order_id')),
+    ('idx_product_categories_category', 'product_categories', ('category',)),
+    ('idx_products_category_id', 'products', ('category_id',)),
+    ('idx_products_released', 'products', ('released', 'article')),
+    ('idx_favorite_products_login_added', 'favorite_products', ('login', 'added_date', 'article'))
+]
+
+# Таблицы, на которых последовательный просмотр недопустим
+LARGE_TABLES = {'products', 'reviews', 'orders', 'favorite_products', 'shopping_cart'}
+# Псевдонимы таблиц в запросах app.py
+ALIASES = {'p': 'products', 'c': 'product_categories', 'pc': 'product_categories',
+           'r': 'reviews', 'o': 'orders', 'f': 'favorite_products'}
+
+# Формы запросов endpoint'ов с типичными параметрами; строятся теми же
+# функциями, что и запросы роутов (queries.py)
+SAMPLE_USER = 'user0000000@example.com'
+SAMPLE_ARTICLE = 1000001
+SAMPLE_CATEGORY = 'Snacks'
+
+
+def _paged(query, keyset, *after):
+    return query + Page(keyset, PAGE_LIMIT_DEFAULT, list(after)).clause()
+
+
+def query_shapes(login=SAMPLE_USER, article=SAMPLE_ARTICLE, category=SAMPLE_CATEGORY):
+    return [
+        ('get_products?category', queries.PRODUCTS_QUERY + queries.category_filter(category)),
+        ('get_products?limit', _paged(queries.PRODUCTS_QUERY, queries.PRODUCTS_PAGE, article)),
+        ('get_product', queries.product_query(article)),
+        ('get_product_reviews', queries.product_reviews_query(article)),
+        ('get_product_reviews?limit', _paged(queries.product_reviews_query(article),
+                                             queries.PRODUCT_REVIEWS_PAGE, 0)),
+        ('get_user_favorites', queries.user_favorites_query(login)),
+        ('get_user_reviews', queries.user_reviews_query(login)),
+        ('get_user_reviews?limit', _paged(queries.user_reviews_query(login), queries.USER_REVIEWS_PAGE, 0)),
+        ('get_user_orders', queries.user_orders_query(login)),
+        ('get_user_orders?limit', _paged(queries.user_orders_query(login), queries.ORDERS_PAGE, 0)),
+        ('get_favorites?limit', _paged(queries.favorites_query(login), queries.FAVORITES_PAGE,
+                                       datetime(2000, 1, 1), 0)),
+        ('get_cart', queries.cart_query(login))
+    ]
+
+
+def create_indexes(conn):
+    # Индексы создаются только для существующих таблиц и колонок
+    created = []
+    cursor = conn.cursor()
+    try:
+        columns_cache = {}
+        for name, table, columns in INDEXES:
+            if table not in columns_cache:
+                columns_cache[table] = db.table_columns(conn, table)
+            if not set(columns) <= columns_cache[table]:
+                continue
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})")
+            created.append(name)
+        conn.commit()
+    finally:
+        cursor.close()
+    return created
+
+
+def _scanned_tables_sqlite(conn, query):
+    scanned = []
+    for row in conn.execute(f"EXPLAIN QUERY PLAN {query}"):
+        match = re.match(r"SCAN (?:TABLE )?(\w+)", row[3])
+        if match:
+            scanned.append((ALIASES.get(match.group(1), match.group(1)), row[3]))
+    return scanned
+
+
+def _scanned_tables_postgres(conn, query):
+    with conn.cursor() as cursor:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {query}")
+        plan = cursor.fetchone()[0]
+    conn.rollback()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    scanned = []
+    nodes = [plan[0]['Plan']]
+    while nodes:
+        node = nodes.pop()
+        if node['Node Type'] == 'Seq Scan':
+            scanned.append((node['Relation Name'], f"Seq Scan on {node['Relation Name']}"))
+        nodes.extend(node.get('Plans', ()))
+    return scanned
+
+
+def verify_plans(conn, params=None):
+    # Последовательные просмотры больших таблиц в планах запросов endpoint'ов
+    # и запросы, которые на этой схеме не выполняются (отсутствующие колонки)
+    explain = _scanned_tables_sqlite if db.is_sqlite(conn) else _scanned_tables_postgres
+    failures, skipped = [], []
+    for endpoint, query in query_shapes(**(params or {})):
+        try:
+            scanned = explain(conn, query)
+        except Exception as e:
+            if not db.is_sqlite(conn):
+                conn.rollback()
+            skipped.append((endpoint, str(e).strip()))
+            continue
+        for table, detail in scanned:
+            if table in LARGE_TABLES:
+                failures.append((endpoint, detail))
+    return failures, skipped
+
+
+def _scaled_sqlite(directory, scale):
+    import filldb
+    import simpledb
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        simpledb.create_delivery_db()
+        conn = sqlite3.connect('delivery.db')
+        sizes = {name: int(size * scale) for name, size in filldb.DEFAULT_SIZES.items()
+                 if not name.endswith('_per_user') and name != 'categories'}
+        filldb.populate_large(conn, sizes=sizes)
+    finally:
+        os.chdir(cwd)
+    return conn
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Индексы delivery-схемы и проверка планов")
+    parser.add_argument('--backend', choices=['sqlite', 'postgres'], default='sqlite')
+    parser.add_argument('--verify', action='store_true',
+                        help="проверить планы (SQLite: на временной масштабированной базе)")
+    parser.add_argument('--scale', type=float, default=0.1, help="масштаб тестовой базы SQLite")
+    args = parser.parse_args()
+
+    db.DATABASE_TYPE = args.backend
+    with tempfile.TemporaryDirectory() as directory:
+        if args.verify and args.backend == 'sqlite':
+            connection = _scaled_sqlite(directory, args.scale)
+        else:
+            connection = db.get_connection()
+        try:
+            print(f"Indexes: {', '.join(create_indexes(connection)) or 'none'}")
+            if args.verify:
+                cursor = connection.cursor()
+                cursor.execute("ANALYZE")
+                cursor.close()
+                connection.commit()
+                failures, skipped = verify_plans(connection)
+                for endpoint, error in skipped:
+                    print(f"SKIP {endpoint}: {error}")
+                for endpoint, detail in failures:
+                    print(f"FAIL {endpoint}: {detail}")
+                if failures:
+                    sys.exit(1)
+                print("All query plans use indexes")
+        finally:
+            connection.close()
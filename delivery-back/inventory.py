@@ -0,0 +1,403 @@
+import asyncio
+import atexit
+import logging
+import os
+import secrets
+import threading
+import time
+
+from db import apply_published_resets, query_db, reset_epoch, transaction
+
+# Остатки популярных товаров (write-behind). Вместо UPDATE products на
+# каждую строку заказа процесс забирает из products.stock блок остатка
+# и раздает резервы из памяти; неиспользованный остаток возвращается
+# пачкой после простоя товара и при остановке воркера. Товар, забранный
+# блоком, в products.stock уже не виден, поэтому перепродажа между
+# процессами невозможна. Забранные блоки записываются в inventory_claims
+# (владелец -- процесс) в той же транзакции; владелец раз в
+# INVENTORY_FLUSH_INTERVAL продлевает свои записи, а записи упавшего
+# процесса старше INVENTORY_CLAIM_TTL возвращаются в products другими
+# воркерами. После сброса базы из снимка (snapshot.py) блоки всех воркеров отбрасываются
+# без возврата: каждый воркер сверяет поколение базы (db.reset_epoch).
+# INVENTORY_HOT_ARTICLES=1001,1002 -- список артикулов, пусто -- выключено.
+
+INVENTORY_HOT_ARTICLES = [int(article) for article in os.getenv('INVENTORY_HOT_ARTICLES', '').split(',')
+                          if article.strip()]
+INVENTORY_BLOCK_SIZE = int(os.getenv('INVENTORY_BLOCK_SIZE', 50))
+INVENTORY_SHARDS = int(os.getenv('INVENTORY_SHARDS', 4))
+# Блок товара без резервов дольше этого времени возвращается в products
+INVENTORY_FLUSH_INTERVAL = float(os.getenv('INVENTORY_FLUSH_INTERVAL', 2))
+INVENTORY_CLAIM_RETRIES = 3
+# Записи inventory_claims без продления дольше этого времени считаются брошенными
+INVENTORY_CLAIM_TTL = float(os.getenv('INVENTORY_CLAIM_TTL', 30))
+
+CLAIMS_TABLE = """
+    CREATE TABLE IF NOT EXISTS inventory_claims (
+        owner VARCHAR(40) NOT NULL,
+        article BIGINT NOT NULL,
+        quantity INT NOT NULL,
+        seen_at DOUBLE PRECISION NOT NULL,
+        PRIMARY KEY (owner, article)
+    )
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class OutOfStock(Exception):
+    def __init__(self, article):
+        super().__init__(f"Insufficient stock for article {article}")
+        self.article = article
+
+
+def _add_stock(cursor, amounts):
+    articles = ", ".join(str(article) for article in amounts)
+    quantities = " ".join(f"WHEN {article} THEN {quantity}" for article, quantity in amounts.items())
+    cursor.execute(f"""
+        UPDATE products
+        SET stock = stock + CASE article {quantities} END
+        WHERE article IN ({articles})
+    """)
+
+
+def claims_query(owner, amounts):
+    # Уменьшение записей владельца: остаток вернулся или продан
+    articles = ", ".join(str(article) for article in amounts)
+    quantities = " ".join(f"WHEN {article} THEN {quantity}" for article, quantity in amounts.items())
+    return f"""
+        UPDATE inventory_claims
+        SET quantity = quantity - CASE article {quantities} END
+        WHERE owner = '{owner}' AND article IN ({articles})
+    """
+
+
+def create_claims_table():
+    with transaction() as cursor:
+        cursor.execute(CLAIMS_TABLE)
+
+
+def claim_stock(article, quantity, owner):
+    # Забирает из products до quantity единиц, возвращает сколько забрано
+    for _ in range(INVENTORY_CLAIM_RETRIES):
+        with transaction() as cursor:
+            cursor.execute(f"SELECT stock FROM products WHERE article = {article}")
+            row = cursor.fetchone()
+            taken = min(quantity, row[0]) if row else 0
+            if taken <= 0:
+                return 0
+            cursor.execute(f"""
+                UPDATE products SET stock = stock - {taken}
+                WHERE article = {article} AND stock >= {taken}
+            """)
+            if cursor.rowcount != 1:
+                continue
+            cursor.execute(f"""
+                INSERT INTO inventory_claims (owner, article, quantity, seen_at)
+                VALUES ('{owner}', {article}, {taken}, {time.time()})
+                ON CONFLICT (owner, article) DO UPDATE
+                SET quantity = inventory_claims.quantity + excluded.quantity, seen_at = excluded.seen_at
+            """)
+            return taken
+    return 0
+
+
+def return_stock(amounts, owner):
+    # Возврат остатков по нескольким товарам одним запросом
+    amounts = {article: quantity for article, quantity in amounts.items() if quantity}
+    if not amounts:
+        return
+    with transaction() as cursor:
+        _add_stock(cursor, amounts)
+        cursor.execute(claims_query(owner, amounts))
+        cursor.execute(f"DELETE FROM inventory_claims WHERE owner = '{owner}' AND quantity <= 0")
+
+
+def touch_claims(owner):
+    with transaction() as cursor:
+        cursor.execute(f"UPDATE inventory_claims SET seen_at = {time.time()} WHERE owner = '{owner}'")
+
+
+def recover_claims(ttl=INVENTORY_CLAIM_TTL):
+    # Возвращает в products блоки процессов, переставших продлевать записи;
+    # запись удаляется вместе с возвратом, поэтому воркеры не вернут ее дважды
+    stale = f"seen_at < {time.time() - ttl}"
+    rows = query_db(f"SELECT owner, article, quantity FROM inventory_claims WHERE {stale}")
+    if not rows:
+        return {}
+    amounts = {}
+    with transaction() as cursor:
+        for row in rows:
+            cursor.execute(f"""
+                DELETE FROM inventory_claims
+                WHERE owner = '{row['owner']}' AND article = {row['article']}
+                  AND quantity = {row['quantity']} AND {stale}
+            """)
+            if cursor.rowcount == 1 and row['quantity'] > 0:
+                amounts[row['article']] = amounts.get(row['article'], 0) + row['quantity']
+        if amounts:
+            _add_stock(cursor, amounts)
+    return amounts
+
+
+class Shard:
+    __slots__ = ('lock', 'available')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.available = 0
+
+
+class HotArticle:
+    # Остаток товара в процессе, разбитый на шарды: потоки резервируют
+    # каждый из "своего" шарда и не ждут друг друга на одной блокировке
+    def __init__(self, shards):
+        self.shards = [Shard() for _ in range(shards)]
+        self.refill = threading.Lock()
+        self.used_at = time.monotonic()
+
+    def _order(self):
+        start = threading.get_ident() % len(self.shards)
+        return self.shards[start:] + self.shards[:start]
+
+    def take(self, quantity):
+        self.used_at = time.monotonic()
+        taken = []
+        needed = quantity
+        for shard in self._order():
+            with shard.lock:
+                part = min(shard.available, needed)
+                shard.available -= part
+            if part:
+                taken.append((shard, part))
+                needed -= part
+                if not needed:
+                    return True
+        # Не хватило -- возвращаем собранное
+        for shard, part in taken:
+            with shard.lock:
+                shard.available += part
+        return False
+
+    def put(self, quantity):
+        shard = self._order()[0]
+        with shard.lock:
+            shard.available += quantity
+
+    def available(self):
+        return sum(shard.available for shard in self.shards)
+
+    def drain(self):
+        drained = 0
+        for shard in self.shards:
+            with shard.lock:
+                drained += shard.available
+                shard.available = 0
+        return drained
+
+
+class Inventory:
+    def __init__(self, articles, block_size=INVENTORY_BLOCK_SIZE, shards=INVENTORY_SHARDS,
+                 flush_interval=INVENTORY_FLUSH_INTERVAL):
+        self.items = {article: HotArticle(shards) for article in articles}
+        self.block_size = block_size
+        self.flush_interval = flush_interval
+        self._stats = {'reservations': 0, 'refused': 0, 'claims': 0, 'claimed': 0, 'returned': 0,
+                       'recovered': 0}
+        self._stats_lock = threading.Lock()
+        self._flusher_pid = None
+        self._stopped = threading.Event()
+        self.generation = reset_epoch()
+        # Владелец записей inventory_claims: свой в каждом процессе и поколении базы
+        self.owner = None
+        self._claims_generation = None
+        self._claimed = False
+
+    def _count(self, **counts):
+        with self._stats_lock:
+            for key, value in counts.items():
+                self._stats[key] += value
+
+    def split(self, totals):
+        # {артикул: количество} -> (популярные товары, остальные)
+        hot, cold = {}, {}
+        for article, quantity in totals.items():
+            try:
+                key = int(article)
+            except (TypeError, ValueError):
+                key = None
+            if key in self.items:
+                hot[key] = hot.get(key, 0) + quantity
+            else:
+                cold[article] = quantity
+        return hot, cold
+
+    def _take_all(self, totals):
+        # Резерв только из памяти; None, если какого-то товара не хватило
+        reserved = {}
+        for article, quantity in totals.items():
+            if not self.items[article].take(quantity):
+                self.release(reserved)
+                return None
+            reserved[article] = quantity
+        return reserved
+
+    def _check_generation(self):
+        # База пересоздана в другом воркере или процессе (CLI) -- блоки
+        # относятся к старым остаткам
+        apply_published_resets()
+        if reset_epoch() != self.generation:
+            self.discard()
+
+    def reserve(self, totals):
+        # Резервирует все позиции или ни одной; OutOfStock -- товара нет и в products
+        self._start_flusher()
+        self._check_generation()
+        reserved = self._take_all(totals)
+        if reserved is None:
+            reserved = {}
+            try:
+                for article, quantity in totals.items():
+                    self._reserve_one(article, quantity)
+                    reserved[article] = quantity
+            except Exception:
+                self.release(reserved)
+                self._count(refused=1)
+                raise
+        self._count(reservations=1)
+        return reserved
+
+    async def reserve_async(self, totals):
+        # Для async_app: резерв из памяти без ожидания, добор блоков -- в потоке
+        self._start_flusher()
+        self._check_generation()
+        reserved = self._take_all(totals)
+        if reserved is None:
+            return await asyncio.to_thread(self.reserve, totals)
+        self._count(reservations=1)
+        return reserved
+
+    def _reserve_one(self, article, quantity):
+        item = self.items[article]
+        if item.take(quantity):
+            return
+        with item.refill:
+            while not item.take(quantity):
+                self._prepare_claims()
+                claimed = claim_stock(article, max(self.block_size, quantity - item.available()), self.owner)
+                if not claimed:
+                    raise OutOfStock(article)
+                self._claimed = True
+                self._count(claims=1, claimed=claimed)
+                item.put(claimed)
+
+    def _prepare_claims(self):
+        # Таблицы может не быть в новой базе (например, в снимке)
+        generation = self.generation
+        if self._claims_generation != generation:
+            create_claims_table()
+            self._claims_generation = generation
+
+    def sold_query(self, reserved):
+        # Запрос для транзакции заказа: проданное больше не числится за процессом
+        return claims_query(self.owner, reserved)
+
+    def release(self, reserved):
+        # Отмена резерва (например, заказ не записался)
+        for article, quantity in reserved.items():
+            self.items[article].put(quantity)
+
+    def flush(self, idle_only=False):
+        # Возвращает в products остаток простаивающих (или всех) товаров
+        self._check_generation()
+        generation = self.generation
+        now = time.monotonic()
+        amounts = {}
+        for article, item in self.items.items():
+            if idle_only and now - item.used_at < self.flush_interval:
+                continue
+            with item.refill:
+                amounts[article] = item.drain()
+        apply_published_resets()
+        if reset_epoch() != generation:
+            # Сброс во время сбора остатков -- в новую базу не возвращаем
+            return
+        try:
+            return_stock(amounts, self.owner)
+        except Exception:
+            # Не удалось вернуть -- остаток снова доступен процессу
+            for article, quantity in amounts.items():
+                self.items[article].put(quantity)
+            raise
+        self._count(returned=sum(amounts.values()))
+
+    def discard(self):
+        # База пересоздана из снимка (snapshot.py): блоки относятся к старым
+        # остаткам, в products они не возвращаются. Записи inventory_claims,
+        # попавшие в снимок, вернут остаток как брошенные: владелец сменяется
+        generation = reset_epoch()
+        for item in self.items.values():
+            with item.refill:
+                item.drain()
+        self._new_owner()
+        self.generation = generation
+
+    def _new_owner(self):
+        self.owner = f"{os.getpid()}-{secrets.token_hex(8)}"
+        self._claimed = False
+
+    def _start_flusher(self):
+        # Поток создается в воркере: после fork потоки мастера не наследуются
+        if self._flusher_pid == os.getpid():
+            return
+        with self._stats_lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+            self._new_owner()
+        threading.Thread(target=self._flush_loop, name='inventory-flush', daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            try:
+                # Старт воркера и каждый проход: возврат блоков упавших процессов
+                self._prepare_claims()
+                recovered = recover_claims()
+                if recovered:
+                    logger.warning(f"Returned orphaned inventory claims: {recovered}")
+                    self._count(recovered=sum(recovered.values()))
+            except Exception as e:
+                logger.error(f"Inventory claim recovery failed: {e}")
+            if self._stopped.wait(self.flush_interval):
+                return
+            try:
+                self.flush(idle_only=True)
+                if self._claimed:
+                    touch_claims(self.owner)
+            except Exception as e:
+                logger.error(f"Inventory flush failed: {e}")
+
+    def close(self):
+        self._stopped.set()
+        if self._flusher_pid == os.getpid():
+            self.flush()
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['available'] = {article: item.available() for article, item in self.items.items()}
+        return stats
+
+
+INVENTORY = Inventory(INVENTORY_HOT_ARTICLES) if INVENTORY_HOT_ARTICLES else None
+
+
+def close_inventory():
+    if INVENTORY is not None:
+        INVENTORY.close()
+
+
+def inventory_stats():
+    return INVENTORY.stats() if INVENTORY is not None else {}
+
+
+atexit.register(close_inventory)
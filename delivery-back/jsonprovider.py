@@ -0,0 +1,69 @@
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+from flask.json.provider import DefaultJSONProvider, _default as flask_default
+
+from rows import Record
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# JSON-провайдер на orjson (если установлен) для Flask и Quart.
+# Decimal, datetime и date кодируются тем же default, что и в Flask:
+# строка и HTTP-дата; ключи сортируются. Отличие от стандартного json:
+# не-ASCII символы выводятся в UTF-8, а не как \uXXXX.
+
+COMPACT_SEPARATORS = (',', ':')
+
+_DAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+_HTTP_DATE = '%s, %02d %s %04d %02d:%02d:%02d GMT'
+
+
+def _default(o):
+    # Тот же результат, что у flask_default (werkzeug http_date для дат),
+    # но без промежуточных timetuple и email.utils
+    if isinstance(o, datetime):
+        if o.tzinfo is not None and o.tzinfo != timezone.utc:
+            o = o.astimezone(timezone.utc)
+        return _HTTP_DATE % (_DAYS[o.weekday()], o.day, _MONTHS[o.month - 1], o.year,
+                             o.hour, o.minute, o.second)
+    if isinstance(o, date):
+        return _HTTP_DATE % (_DAYS[o.weekday()], o.day, _MONTHS[o.month - 1], o.year, 0, 0, 0)
+    if isinstance(o, Decimal):
+        return str(o)
+    if isinstance(o, Record):
+        return o.as_dict()
+    return flask_default(o)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    default = staticmethod(_default)
+
+    def _options(self):
+        # datetime/date отдаются в default, чтобы формат совпадал с Flask
+        options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        return options
+
+    def dumps(self, obj, **kwargs):
+        # orjson пишет только компактный JSON; остальные параметры -- через json
+        if orjson is None or kwargs.get('separators', COMPACT_SEPARATORS) != COMPACT_SEPARATORS \
+                or kwargs.keys() - {'separators'}:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self._options()).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if orjson is None or (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=self._options() | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
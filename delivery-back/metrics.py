@@ -0,0 +1,250 @@
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from flask import Blueprint, Response, request
+
+# Метрики запросов: время БД на запрос (заголовок Server-Timing)
+# и гистограммы по endpoint'ам в формате Prometheus (/metrics)
+METRICS_SAMPLE_RATE = float(os.getenv('METRICS_SAMPLE_RATE', 1.0))
+METRICS_MAX_SERIES = int(os.getenv('METRICS_MAX_SERIES', 200))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+ROWS_BUCKETS = (0, 1, 10, 50, 100, 500, 1000, 5000, 10000, 100000)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+class RequestStats:
+    __slots__ = ('queries', 'connect', 'execute', 'fetch', 'rows', 'started')
+
+    def __init__(self):
+        self.queries = 0
+        self.connect = self.execute = self.fetch = 0.0
+        self.rows = 0
+        self.started = time.perf_counter()
+
+    def db_time(self):
+        return self.connect + self.execute + self.fetch
+
+
+# Статистика текущего HTTP-запроса. ContextVar, а не threading.local:
+# контекст копируется в asyncio.to_thread и не смешивает запросы,
+# которые поочередно выполняются в одном потоке
+_request = ContextVar('metrics_request', default=None)
+
+
+def record_query(connect, execute, fetch, rows=0, queries=1):
+    # Вызывается из db.py; вне HTTP-запроса ничего не делает
+    stats = _request.get()
+    if stats is None:
+        return
+    stats.queries += queries
+    stats.connect += connect
+    stats.execute += execute
+    stats.fetch += fetch
+    stats.rows += rows
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # Число наборов меток ограничено
+                if len(self._series) >= METRICS_MAX_SERIES:
+                    labels = ('other', labels[1])
+                    series = self._series.get(labels)
+                if series is None:
+                    series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self, lines):
+        lines.append(f"# HELP {self.name} {self.help_text}")
+        lines.append(f"# TYPE {self.name} histogram")
+        with self._lock:
+            items = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        for (endpoint, method), counts, total in sorted(items):
+            label = f'endpoint="{endpoint}",method="{method}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label}}} {total}')
+            lines.append(f'{self.name}_count{{{label}}} {cumulative}')
+
+
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', "Request latency", LATENCY_BUCKETS)
+REQUEST_DB_TIME = Histogram('http_request_db_seconds', "Time spent in the database per request", LATENCY_BUCKETS)
+REQUEST_ROWS = Histogram('http_request_db_rows', "Rows returned by the database per request", ROWS_BUCKETS)
+RESPONSE_BYTES = Histogram('http_response_size_bytes', "Response body size", BYTES_BUCKETS)
+HISTOGRAMS = (REQUEST_LATENCY, REQUEST_DB_TIME, REQUEST_ROWS, RESPONSE_BYTES)
+
+
+def _before_request():
+    _request.set(RequestStats())
+
+
+def _server_timing(stats, total):
+    return (f'db;dur={stats.db_time() * 1000:.2f};desc="{stats.queries} queries", '
+            f'db-connect;dur={stats.connect * 1000:.2f}, '
+            f'db-execute;dur={stats.execute * 1000:.2f}, '
+            f'db-fetch;dur={stats.fetch * 1000:.2f}, '
+            f'total;dur={total * 1000:.2f}')
+
+
+def _counted(body, size):
+    for chunk in body:
+        size[0] += len(chunk)
+        yield chunk
+
+
+def _after_request(response):
+    stats = _request.get()
+    if stats is None:
+        return response
+    elapsed = time.perf_counter() - stats.started
+    if response.is_streamed:
+        # Заголовки уходят до выборки строк: время БД потокового ответа
+        # попадает только в гистограммы (при закрытии ответа)
+        response.headers['Server-Timing'] = f'total;dur={elapsed * 1000:.2f};desc="streamed"'
+    else:
+        response.headers['Server-Timing'] = _server_timing(stats, elapsed)
+
+    if METRICS_SAMPLE_RATE < 1.0 and random.random() >= METRICS_SAMPLE_RATE:
+        _request.set(None)
+        return response
+
+    labels = (request.endpoint or 'other', request.method)
+    size = [0]
+    if response.is_streamed:
+        # Потоковый ответ: размер и время выборки известны только после отправки
+        response.response = _counted(response.response, size)
+    else:
+        size[0] = response.content_length or 0
+
+    def observe():
+        REQUEST_LATENCY.observe(labels, time.perf_counter() - stats.started)
+        REQUEST_DB_TIME.observe(labels, stats.db_time())
+        REQUEST_ROWS.observe(labels, stats.rows)
+        RESPONSE_BYTES.observe(labels, size[0])
+        _request.set(None)
+
+    response.call_on_close(observe)
+    return response
+
+
+def render():
+    import db
+    lines = []
+    for histogram in HISTOGRAMS:
+        histogram.render(lines)
+    lines.append("# HELP db_pool_connections Connection pool state")
+    lines.append("# TYPE db_pool_connections gauge")
+    stats = db.pool_stats()
+    for state in ('size', 'idle', 'in_use'):
+        if state in stats:
+            lines.append(f'db_pool_connections{{state="{state}"}} {stats[state]}')
+    if 'wait_time_total' in stats:
+        lines.append("# TYPE db_pool_wait_seconds_total counter")
+        lines.append(f"db_pool_wait_seconds_total {stats['wait_time_total']}")
+        lines.append("# TYPE db_pool_checkouts_total counter")
+        lines.append(f"db_pool_checkouts_total {stats['checkouts']}")
+    replicas = db.replica_stats()
+    if replicas:
+        lines.append("# HELP db_replica_lag_seconds Replica replay lag, absent while a replica is unavailable")
+        lines.append("# TYPE db_replica_lag_seconds gauge")
+        for replica in replicas['replicas']:
+            if replica['lag'] is not None:
+                lines.append(f'db_replica_lag_seconds{{replica="{replica["host"]}"}} {replica["lag"]}')
+        lines.append("# HELP db_reads_total Reads by routing decision")
+        lines.append("# TYPE db_reads_total counter")
+        for key in ('replica_reads', 'primary_reads', 'sticky_reads'):
+            lines.append(f'db_reads_total{{target="{key[:-len("_reads")]}"}} {replicas[key]}')
+        lines.append("# TYPE db_replica_errors_total counter")
+        lines.append(f"db_replica_errors_total {replicas['replica_errors']}")
+    tenants = db.tenant_stats()
+    if tenants:
+        lines.append("# HELP db_tenant_pools Open per-lab connection pools")
+        lines.append("# TYPE db_tenant_pools gauge")
+        lines.append(f"db_tenant_pools {tenants['active']}")
+        for key, help_text in (('created', "Per-lab pools opened on first request"),
+                               ('evicted', "Per-lab pools closed after going idle")):
+            lines.append(f"# HELP db_tenant_pools_{key}_total {help_text}")
+            lines.append(f"# TYPE db_tenant_pools_{key}_total counter")
+            lines.append(f"db_tenant_pools_{key}_total {tenants[key]}")
+    from snapshot import reset_stats
+    resets = reset_stats()
+    for key, help_text in (('resets', "Databases restored from the snapshot"),
+                           ('failures', "Failed snapshot restores")):
+        lines.append(f"# HELP db_snapshot_{key}_total {help_text}")
+        lines.append(f"# TYPE db_snapshot_{key}_total counter")
+        lines.append(f"db_snapshot_{key}_total {resets[key]}")
+    lines.append("# TYPE db_snapshot_reset_seconds_total counter")
+    lines.append(f"db_snapshot_reset_seconds_total {resets['reset_time_total']}")
+    statements = db.statement_stats()
+    for key, help_text in (('prepares', "Named statements prepared on a connection"),
+                           ('hits', "Named statement executions reusing a prepared statement")):
+        lines.append(f"# HELP db_statement_{key}_total {help_text}")
+        lines.append(f"# TYPE db_statement_{key}_total counter")
+        for name, counts in sorted(statements.items()):
+            lines.append(f'db_statement_{key}_total{{statement="{name}"}} {counts[key]}')
+    from groupcommit import group_commit_stats
+    writes = group_commit_stats()
+    if writes:
+        lines.append("# HELP db_group_commit_batch_size Statements committed per group commit")
+        lines.append("# TYPE db_group_commit_batch_size histogram")
+        cumulative = 0
+        for bound, count in writes['batch_sizes']:
+            cumulative += count
+            lines.append(f'db_group_commit_batch_size_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f"db_group_commit_batch_size_sum {writes['statements']}")
+        lines.append(f"db_group_commit_batch_size_count {writes['batches']}")
+        for key, help_text in (('errors', "Grouped statements rolled back to their savepoint"),
+                               ('failed_batches', "Group commits that failed as a whole")):
+            lines.append(f"# HELP db_group_commit_{key}_total {help_text}")
+            lines.append(f"# TYPE db_group_commit_{key}_total counter")
+            lines.append(f"db_group_commit_{key}_total {writes[key]}")
+        lines.append("# TYPE db_group_commit_seconds_total counter")
+        lines.append(f"db_group_commit_seconds_total {writes['commit_time']}")
+    from inventory import inventory_stats
+    stock = inventory_stats()
+    if stock:
+        for key, help_text in (('reservations', "Orders reserved from in-process stock blocks"),
+                               ('refused', "Reservations refused for lack of stock"),
+                               ('claims', "Stock blocks claimed from products"),
+                               ('claimed', "Units claimed from products"),
+                               ('returned', "Unused units returned to products")):
+            lines.append(f"# HELP inventory_{key}_total {help_text}")
+            lines.append(f"# TYPE inventory_{key}_total counter")
+            lines.append(f"inventory_{key}_total {stock[key]}")
+        lines.append("# TYPE inventory_available gauge")
+        for article, available in sorted(stock['available'].items()):
+            lines.append(f'inventory_available{{article="{article}"}} {available}')
+    return "\n".join(lines) + "\n"
+
+
+blueprint = Blueprint('metrics', __name__)
+
+
+@blueprint.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(render(), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    app.before_request(_before_request)
+    app.after_request(_after_request)
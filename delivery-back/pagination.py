@@ -0,0 +1,128 @@
+import base64
+import json
+import os
+from datetime import datetime
+
+# Keyset-пагинация: включается параметрами limit и/или cursor,
+# курсор следующей страницы возвращается в заголовке X-Next-Cursor
+PAGE_LIMIT_DEFAULT = int(os.getenv('PAGE_LIMIT_DEFAULT', 50))
+PAGE_LIMIT_MAX = int(os.getenv('PAGE_LIMIT_MAX', 500))
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+
+class InvalidPage(Exception):
+    pass
+
+
+def encode_cursor(values):
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except ValueError:
+        raise InvalidPage("Invalid cursor")
+    if not isinstance(values, list):
+        raise InvalidPage("Invalid cursor")
+    return values
+
+
+def _value(value, kind):
+    # Значения курсора не подставляются в запрос как есть
+    try:
+        if kind == 'int':
+            if isinstance(value, bool):
+                raise ValueError(value)
+            return int(value)
+        if kind == 'timestamp':
+            return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise InvalidPage("Invalid cursor")
+    raise ValueError(f"Unknown key kind: {kind}")
+
+
+def _literal(value):
+    if isinstance(value, datetime):
+        return f"'{value.isoformat(sep=' ')}'"
+    return str(value)
+
+
+def _clause(columns, after, limit):
+    # Дописывается к запросу, у которого уже есть WHERE
+    sql = ""
+    if after is not None:
+        if len(columns) == 1:
+            sql += f" AND {columns[0]} > {after[0]}"
+        else:
+            sql += f" AND ({', '.join(columns)}) > ({', '.join(after)})"
+    sql += f" ORDER BY {', '.join(columns)} LIMIT {limit}"
+    return sql
+
+
+def _cursor_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ')
+    return value
+
+
+class Keyset:
+    # keys: (выражение в SQL, поле в строке результата, тип)
+    def __init__(self, *keys):
+        self.keys = keys
+
+    def parse(self, args):
+        limit = args.get('limit')
+        cursor = args.get('cursor')
+        if limit is None and cursor is None:
+            return None
+
+        try:
+            limit = int(limit) if limit is not None else PAGE_LIMIT_DEFAULT
+        except ValueError:
+            raise InvalidPage("Invalid limit")
+        if limit <= 0:
+            raise InvalidPage("Invalid limit")
+
+        after = None
+        if cursor:
+            values = decode_cursor(cursor)
+            if len(values) != len(self.keys):
+                raise InvalidPage("Invalid cursor")
+            after = [_value(value, kind) for value, (_, _, kind) in zip(values, self.keys)]
+        return Page(self, min(limit, PAGE_LIMIT_MAX), after)
+
+    def template(self, after):
+        # Тот же фрагмент, что и Page.clause(), с параметрами $1, $2, ...
+        # для именованных запросов; значения дает Page.args()
+        columns = [column for column, _, _ in self.keys]
+        params = [f"${i}" for i in range(1, len(columns) + 2)]
+        if not after:
+            return _clause(columns, None, params[0])
+        return _clause(columns, params[:-1], params[-1])
+
+
+class Page:
+    def __init__(self, keyset, limit, after):
+        self.keyset = keyset
+        self.limit = limit
+        self.after = after
+
+    def clause(self):
+        columns = [column for column, _, _ in self.keyset.keys]
+        after = None if self.after is None else [_literal(value) for value in self.after]
+        return _clause(columns, after, self.limit + 1)
+
+    def args(self):
+        # Параметры для Keyset.template(after=self.after is not None)
+        return (self.after or []) + [self.limit + 1]
+
+    def split(self, rows):
+        # Лишняя строка означает, что есть следующая страница
+        if len(rows) <= self.limit:
+            return rows, None
+        rows = rows[:self.limit]
+        last = rows[-1]
+        return rows, encode_cursor([_cursor_value(last[field]) for _, field, _ in self.keyset.keys])
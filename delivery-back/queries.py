@@ -0,0 +1,229 @@
+import json
+
+from pagination import Keyset
+from ratings import RATING_COLUMNS, RATING_HISTOGRAM_COLUMNS, RATING_JOIN
+
+# Запросы роутов: общие для app.py, async_app.py и проверки планов
+# в indexes.py, чтобы формы запросов не расходились
+
+# Ключи keyset-пагинации списков
+PRODUCTS_PAGE = Keyset(('p.article', 'article', 'int'))
+PRODUCT_REVIEWS_PAGE = Keyset(('reviews.review_id', 'review_id', 'int'))
+FAVORITES_PAGE = Keyset(('favorite_products.added_date', 'added_date', 'timestamp'),
+                        ('favorite_products.article', 'article', 'int'))
+USER_REVIEWS_PAGE = Keyset(('r.review_id', 'review_id', 'int'))
+ORDERS_PAGE = Keyset(('o.order_id', 'order_id', 'int'))
+
+
+# Базовый запрос каталога; ratings добавляет сводку оценок (ratings.py)
+def products_query(ratings=False):
+    return f"""
+    SELECT
+        p.article,
+        p.name,
+        c.store_name,
+        c.category AS category_name,
+        p.price,
+        p.stock,
+        p.released{RATING_COLUMNS if ratings else ''}
+    FROM products p
+    LEFT JOIN product_categories c ON p.category_id = c.category_id{RATING_JOIN if ratings else ''}
+    WHERE p.released = true
+"""
+
+PRODUCTS_QUERY = products_query()
+PRODUCTS_RATED_QUERY = products_query(ratings=True)
+
+
+def category_filter(category):
+    return f" AND c.category = '{category}'"
+
+
+def product_query(article, ratings=False):
+    return f"""
+        SELECT
+            p.article,
+            p.name,
+            pc.category,
+            pc.store_name,
+            p.price,
+            p.stock,
+            p.released{(RATING_COLUMNS + RATING_HISTOGRAM_COLUMNS) if ratings else ''}
+        FROM products p
+        JOIN product_categories pc ON p.category_id = pc.category_id{RATING_JOIN if ratings else ''}
+        WHERE p.article = {article}
+    """
+
+
+def product_reviews_query(article):
+    return f"""
+        SELECT
+            reviews.review_id,
+            reviews.login,
+            reviews.review_text,
+            reviews.rating,
+            reviews.review_date
+        FROM reviews
+        WHERE reviews.article = {article}
+    """
+
+
+def favorites_query(username):
+    return f"""
+        SELECT
+            products.article,
+            products.name,
+            products.price,
+            products.category,
+            favorite_products.added_date
+        FROM favorite_products
+        JOIN products ON favorite_products.article = products.article
+        WHERE favorite_products.login = '{username}'
+    """
+
+
+def cart_query(username):
+    return f"""
+        SELECT
+            products.article,
+            products.name,
+            products.price,
+            shopping_cart.quantity
+        FROM shopping_cart
+        JOIN products ON shopping_cart.article = products.article
+        WHERE shopping_cart.login = '{username}'
+    """
+
+
+# Запросы профиля; общие для отдельных роутов и /profile/summary
+def user_profile_query(username):
+    return f"""
+        SELECT
+            login,
+            name,
+            birth_date,
+            address,
+            phone_number,
+            secret AS description
+        FROM user_personal_info
+        WHERE login = '{username}'
+    """
+
+
+def user_favorites_query(username):
+    return f"""
+        SELECT
+            p.name AS product_name,
+            f.article,
+            f.added_date
+        FROM favorite_products f
+        JOIN products p ON f.article = p.article
+        WHERE f.login = '{username}'
+    """
+
+
+def user_reviews_query(username):
+    return f"""
+        SELECT
+            r.review_id,
+            r.review_text,
+            r.rating,
+            r.review_date,
+            p.name AS product_name
+        FROM reviews r
+        JOIN products p ON r.article = p.article
+        WHERE r.login = '{username}'
+    """
+
+
+def user_orders_query(username):
+    return f"""
+        SELECT
+            o.order_id,
+            o.order_date,
+            o.status
+        FROM orders o
+        WHERE o.login = '{username}'
+    """
+
+
+# Запросы авторизации и записи. Значения подставляются в текст как есть:
+# это уязвимые места лаборатории, их не экранируем
+def login_query(username, password):
+    return f"SELECT * FROM users WHERE login = '{username}' AND password = '{password}'"
+
+
+def review_insert_query(article, username, review_text, rating):
+    return f"""
+        INSERT INTO reviews (article, login, review_text, review_date, rating)
+        VALUES ({article}, '{username}', '{review_text}', datetime('now'), {rating})
+    """
+
+
+def favorite_exists_query(username, article):
+    return f"SELECT 1 FROM favorite_products WHERE login = '{username}' AND article = {article}"
+
+
+def favorite_insert_query(username, article):
+    return f"""
+        INSERT INTO favorite_products (login, article, added_date, secret)
+        VALUES ('{username}', {article}, datetime('now'), 'default_secret')
+    """
+
+
+def favorite_delete_query(username, article):
+    return f"DELETE FROM favorite_products WHERE login = '{username}' AND article = {article}"
+
+
+def cart_insert_query(username, article, quantity):
+    return f"""
+        INSERT INTO shopping_cart (login, article, quantity, secret)
+        VALUES ('{username}', {article}, {quantity}, 'default_secret')
+    """
+
+
+def cart_delete_query(username, article):
+    return f"DELETE FROM shopping_cart WHERE login = '{username}' AND article = {article}"
+
+
+def profile_update_query(username, description):
+    return f"""
+        UPDATE user_personal_info
+        SET secret = '{description}'
+        WHERE login = '{username}'
+    """
+
+
+# Запросы заказа; totals -- {числовой артикул: количество}
+def stock_update_query(totals):
+    # Проверка и списание остатков одним запросом по всем позициям
+    articles = ", ".join(str(article) for article in totals)
+    quantities = " ".join(f"WHEN {article} THEN {quantity}" for article, quantity in totals.items())
+    return f"""
+        UPDATE products
+        SET stock = stock - CASE article {quantities} END
+        WHERE article IN ({articles})
+          AND stock >= CASE article {quantities} END
+    """
+
+
+def stock_query(totals):
+    articles = ", ".join(str(article) for article in totals)
+    return f"SELECT article, stock FROM products WHERE article IN ({articles})"
+
+
+def orders_insert_query(username, lines):
+    # Все позиции заказа вставляются одним запросом
+    values = ", ".join(
+        f"""(
+            '{username}', 
+            datetime('now'), 
+            'pending', 
+            '{json.dumps({"article": article, "quantity": quantity, "price": price})}'
+        )"""
+        for article, quantity, price in lines
+    )
+    return f"""
+        INSERT INTO orders (login, order_date, status, secret)
+        VALUES {values}
+    """
@@ -0,0 +1,134 @@
+import argparse
+
+import db
+
+# Сводка отзывов по товару: число, сумма и гистограмма оценок.
+# Поддерживается триггерами на reviews в той же транзакции, что и
+# запись отзыва, поэтому средняя оценка не требует агрегации по reviews.
+
+RATING_VALUES = (1, 2, 3, 4, 5)
+# Колонки reviews, на которых построены триггеры и пересчет
+REVIEW_COLUMNS = {'article', 'rating'}
+HISTOGRAM_COLUMNS = [f"rating_{value}" for value in RATING_VALUES]
+
+
+def _histogram(row):
+    # Оценки вне 1..5 учитываются только в count и sum
+    return [f"CASE WHEN {row}.rating = {value} THEN 1 ELSE 0 END" for value in RATING_VALUES]
+
+
+def _upsert(row, sign, excluded):
+    # Прибавляет (sign = '+') или вычитает (sign = '-') отзыв row из сводки
+    columns = ['review_count', 'rating_sum'] + HISTOGRAM_COLUMNS
+    values = [f"{sign}1", f"{sign}{row}.rating"] + [sign + case for case in _histogram(row)]
+    updates = ", ".join(f"{column} = product_rating_stats.{column} + {excluded}.{column}" for column in columns)
+    return f"""
+        INSERT INTO product_rating_stats (article, {', '.join(columns)})
+        VALUES ({row}.article, {', '.join(values)})
+        ON CONFLICT (article) DO UPDATE SET {updates}
+    """
+
+
+RATING_TABLE = f"""
+    CREATE TABLE IF NOT EXISTS product_rating_stats (
+        article BIGINT NOT NULL PRIMARY KEY,
+        review_count BIGINT NOT NULL DEFAULT 0,
+        rating_sum BIGINT NOT NULL DEFAULT 0,
+        {', '.join(f'{column} BIGINT NOT NULL DEFAULT 0' for column in HISTOGRAM_COLUMNS)}
+    )
+"""
+
+SQLITE_SCHEMA = [
+    RATING_TABLE,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS product_rating_insert AFTER INSERT ON reviews BEGIN
+        {_upsert('new', '+', 'excluded')};
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS product_rating_update AFTER UPDATE OF article, rating ON reviews BEGIN
+        {_upsert('old', '-', 'excluded')};
+        {_upsert('new', '+', 'excluded')};
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS product_rating_delete AFTER DELETE ON reviews BEGIN
+        {_upsert('old', '-', 'excluded')};
+    END
+    """
+]
+
+POSTGRES_SCHEMA = [
+    RATING_TABLE,
+    f"""
+    CREATE OR REPLACE FUNCTION product_rating_sync() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            {_upsert('OLD', '-', 'EXCLUDED')};
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            {_upsert('NEW', '+', 'EXCLUDED')};
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS product_rating_sync ON reviews",
+    """
+    CREATE TRIGGER product_rating_sync AFTER INSERT OR DELETE OR UPDATE OF article, rating ON reviews
+    FOR EACH ROW EXECUTE FUNCTION product_rating_sync()
+    """
+]
+
+RATING_FILL = f"""
+    INSERT INTO product_rating_stats (article, review_count, rating_sum, {', '.join(HISTOGRAM_COLUMNS)})
+    SELECT reviews.article, COUNT(*), SUM(reviews.rating),
+           {', '.join(f'SUM({case})' for case in _histogram('reviews'))}
+    FROM reviews
+    GROUP BY reviews.article
+"""
+
+# Колонки для запросов каталога: LEFT JOIN по первичному ключу,
+# без сводки у товара 0 отзывов и средняя оценка NULL
+RATING_COLUMNS = """,
+        COALESCE(rs.review_count, 0) AS review_count,
+        CAST(ROUND(rs.rating_sum * 1.0 / NULLIF(rs.review_count, 0), 2) AS DOUBLE PRECISION) AS rating_avg"""
+RATING_HISTOGRAM_COLUMNS = "".join(f",\n        COALESCE(rs.{column}, 0) AS {column}"
+                                   for column in HISTOGRAM_COLUMNS)
+RATING_JOIN = "\n    LEFT JOIN product_rating_stats rs ON rs.article = p.article"
+
+
+def create_rating_stats(conn, rebuild=False):
+    # Создает сводку и триггеры; пересчитывает ее при создании или rebuild.
+    # Схема без reviews.article/rating (например, аптечная) пропускается
+    if not REVIEW_COLUMNS <= db.table_columns(conn, 'reviews'):
+        return False
+    fill = rebuild or not db.table_exists(conn, 'product_rating_stats')
+    cursor = conn.cursor()
+    try:
+        for statement in (SQLITE_SCHEMA if db.is_sqlite(conn) else POSTGRES_SCHEMA):
+            cursor.execute(statement)
+        if fill:
+            cursor.execute("DELETE FROM product_rating_stats")
+            cursor.execute(RATING_FILL)
+        conn.commit()
+    finally:
+        cursor.close()
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Сводка оценок товаров")
+    parser.add_argument('--backend', choices=['sqlite', 'postgres'], default='sqlite')
+    parser.add_argument('--rebuild', action='store_true', help="пересчитать сводку по reviews")
+    args = parser.parse_args()
+
+    db.DATABASE_TYPE = args.backend
+    connection = db.get_connection()
+    try:
+        if create_rating_stats(connection, args.rebuild):
+            print("Rating stats ready")
+        else:
+            print("No reviews.article/rating columns, rating stats skipped")
+    finally:
+        connection.close()
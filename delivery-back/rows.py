@@ -0,0 +1,44 @@
+from dataclasses import make_dataclass
+from operator import itemgetter
+
+# Компактные строки результата: вместо dict на строку -- запись со __slots__,
+# поля которой сразу совпадают с ключами ответа. Такие записи передаются
+# в jsonify/stream_json как есть, без промежуточных словарей.
+
+
+class Record:
+    __slots__ = ()
+
+    # Поля с "_" в начале нужны только для курсора пагинации:
+    # orjson их пропускает, для стандартного json есть as_dict()
+    def __getitem__(self, field):
+        try:
+            return getattr(self, field)
+        except AttributeError:
+            return getattr(self, '_' + field)
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__dataclass_fields__ if not name.startswith('_')}
+
+
+class RowShape:
+    # fields: {ключ в ответе: колонка запроса}; keys: колонки только для курсора
+    def __init__(self, name, fields, keys=()):
+        names = sorted(fields)
+        self.columns = [fields[name] for name in names] + list(keys)
+        self.record = make_dataclass(name, names + ['_' + key for key in keys], bases=(Record,), slots=True)
+
+    def converter(self, columns):
+        # columns -- имена колонок результата в порядке запроса
+        index = {column: i for i, column in enumerate(columns)}
+        try:
+            positions = [index[column] for column in self.columns]
+        except KeyError as e:
+            raise KeyError(f"{self.record.__name__}: column {e} is missing in the result")
+        record = self.record
+        if positions == list(range(len(columns))):
+            return lambda row: record(*row)
+        getter = itemgetter(*positions)
+        if len(positions) == 1:
+            return lambda row: record(getter(row))
+        return lambda row: record(*getter(row))
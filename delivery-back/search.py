@@ -0,0 +1,224 @@
+import argparse
+import os
+import re
+
+import db
+
+# Полнотекстовый поиск по товарам: название, категория и магазин.
+# SQLite: FTS5-таблица products_fts (rowid = article);
+# Postgres: таблица product_search с tsvector и GIN-индексом.
+# Индекс поддерживается триггерами на products и product_categories.
+
+SEARCH_MAX_TERMS = 8
+SEARCH_LIMIT_DEFAULT = int(os.getenv('SEARCH_LIMIT_DEFAULT', 20))
+# С products соединяются только N лучших по рангу совпадений: на частых
+# словах соединение и сортировка сотен тысяч строк занимают сотни миллисекунд
+SEARCH_RANK_WINDOW = int(os.getenv('SEARCH_RANK_WINDOW', 1000))
+
+SQLITE_SCHEMA = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+        name, category, store_name,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+    """,
+    # Остаток (stock) меняется при каждом заказе, поэтому только OF name, category_id
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts (rowid, name, category, store_name)
+        VALUES (new.article, new.name,
+                (SELECT category FROM product_categories WHERE category_id = new.category_id),
+                (SELECT store_name FROM product_categories WHERE category_id = new.category_id));
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF article, name, category_id ON products BEGIN
+        DELETE FROM products_fts WHERE rowid = old.article;
+        INSERT INTO products_fts (rowid, name, category, store_name)
+        VALUES (new.article, new.name,
+                (SELECT category FROM product_categories WHERE category_id = new.category_id),
+                (SELECT store_name FROM product_categories WHERE category_id = new.category_id));
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+        DELETE FROM products_fts WHERE rowid = old.article;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_category AFTER UPDATE OF category, store_name ON product_categories BEGIN
+        DELETE FROM products_fts WHERE rowid IN (SELECT article FROM products WHERE category_id = new.category_id);
+        INSERT INTO products_fts (rowid, name, category, store_name)
+        SELECT article, name, new.category, new.store_name FROM products WHERE category_id = new.category_id;
+    END
+    """
+]
+SQLITE_FILL = """
+    INSERT INTO products_fts (rowid, name, category, store_name)
+    SELECT p.article, p.name, c.category, c.store_name
+    FROM products p
+    LEFT JOIN product_categories c ON p.category_id = c.category_id
+"""
+
+POSTGRES_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS product_search (
+        article BIGINT PRIMARY KEY REFERENCES products (article) ON DELETE CASCADE,
+        document tsvector NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_product_search_document ON product_search USING GIN (document)",
+    # Веса: название A, категория B, магазин C
+    """
+    CREATE OR REPLACE FUNCTION product_search_document(p_name text, p_category_id bigint) RETURNS tsvector AS $$
+        SELECT setweight(to_tsvector('simple', coalesce(p_name, '')), 'A')
+            || setweight(to_tsvector('simple', coalesce(c.category, '')), 'B')
+            || setweight(to_tsvector('simple', coalesce(c.store_name, '')), 'C')
+        FROM (SELECT 1) one
+        LEFT JOIN product_categories c ON c.category_id = p_category_id
+    $$ LANGUAGE sql STABLE
+    """,
+    """
+    CREATE OR REPLACE FUNCTION product_search_sync() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO product_search (article, document)
+        VALUES (NEW.article, product_search_document(NEW.name, NEW.category_id))
+        ON CONFLICT (article) DO UPDATE SET document = EXCLUDED.document;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION product_search_category_sync() RETURNS trigger AS $$
+    BEGIN
+        UPDATE product_search s
+        SET document = product_search_document(p.name, p.category_id)
+        FROM products p
+        WHERE p.article = s.article AND p.category_id = NEW.category_id;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS product_search_sync ON products",
+    """
+    CREATE TRIGGER product_search_sync AFTER INSERT OR UPDATE OF name, category_id ON products
+    FOR EACH ROW EXECUTE FUNCTION product_search_sync()
+    """,
+    "DROP TRIGGER IF EXISTS product_search_category_sync ON product_categories",
+    """
+    CREATE TRIGGER product_search_category_sync AFTER UPDATE OF category, store_name ON product_categories
+    FOR EACH ROW EXECUTE FUNCTION product_search_category_sync()
+    """
+]
+POSTGRES_FILL = """
+    INSERT INTO product_search (article, document)
+    SELECT article, product_search_document(name, category_id) FROM products
+    ON CONFLICT (article) DO UPDATE SET document = EXCLUDED.document
+"""
+
+PRODUCTS_SEARCH_COLUMNS = """
+    SELECT
+        p.article,
+        p.name,
+        c.store_name,
+        c.category AS category_name,
+        p.price,
+        p.stock,
+        p.released
+"""
+# Именованные запросы для db.query_statement:
+# $1 -- запрос, $2 -- лимит, $3 -- окно ранжирования
+SEARCH_STATEMENTS = {
+    'products_search_sqlite': PRODUCTS_SEARCH_COLUMNS + """
+        FROM (
+            SELECT rowid AS article, bm25(products_fts, 10.0, 5.0, 2.0) AS score
+            FROM products_fts
+            WHERE products_fts MATCH $1
+            ORDER BY score, article
+            LIMIT $3
+        ) f
+        JOIN products p ON p.article = f.article
+        LEFT JOIN product_categories c ON p.category_id = c.category_id
+        WHERE p.released = true
+        ORDER BY f.score, p.article
+        LIMIT $2
+    """,
+    'products_search_postgres': PRODUCTS_SEARCH_COLUMNS + """
+        FROM (
+            SELECT s.article, ts_rank_cd(s.document, q) AS score
+            FROM product_search s
+            CROSS JOIN to_tsquery('simple', $1) q
+            WHERE s.document @@ q
+            ORDER BY score DESC, s.article
+            LIMIT $3
+        ) f
+        JOIN products p ON p.article = f.article
+        LEFT JOIN product_categories c ON p.category_id = c.category_id
+        WHERE p.released = true
+        ORDER BY f.score DESC, p.article
+        LIMIT $2
+    """
+}
+
+_term_re = re.compile(r"\w+")
+
+
+def search_terms(text):
+    # Слова запроса без операторов и кавычек
+    return [term.lower() for term in _term_re.findall(text or '')][:SEARCH_MAX_TERMS]
+
+
+def search_statement():
+    return f"products_search_{db.DATABASE_TYPE}"
+
+
+def search_query(terms):
+    # Последнее слово ищется по префиксу ("свежие ябл" находит "свежие яблоки"),
+    # кроме однобуквенного -- такой префикс совпадает почти со всем каталогом
+    prefix = len(terms[-1]) > 1
+    if db.DATABASE_TYPE == 'sqlite':
+        words = [f'"{term}"' for term in terms]
+        if prefix:
+            words[-1] += '*'
+        return " ".join(words)
+    words = list(terms)
+    if prefix:
+        words[-1] += ':*'
+    return " & ".join(words)
+
+
+def create_search_index(conn, rebuild=False):
+    # Создает индекс и триггеры; заполняет индекс при создании или rebuild
+    if not db.table_exists(conn, 'products') or not db.table_exists(conn, 'product_categories'):
+        return False
+    table = 'products_fts' if db.is_sqlite(conn) else 'product_search'
+    fill = rebuild or not db.table_exists(conn, table)
+    cursor = conn.cursor()
+    try:
+        for statement in (SQLITE_SCHEMA if db.is_sqlite(conn) else POSTGRES_SCHEMA):
+            cursor.execute(statement)
+        if fill:
+            cursor.execute(f"DELETE FROM {table}")
+            cursor.execute(SQLITE_FILL if db.is_sqlite(conn) else POSTGRES_FILL)
+        conn.commit()
+    finally:
+        cursor.close()
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Полнотекстовый индекс товаров")
+    parser.add_argument('--backend', choices=['sqlite', 'postgres'], default='sqlite')
+    parser.add_argument('--rebuild', action='store_true', help="перестроить индекс заново")
+    args = parser.parse_args()
+
+    db.DATABASE_TYPE = args.backend
+    connection = db.get_connection()
+    try:
+        if create_search_index(connection, args.rebuild):
+            print("Search index ready")
+        else:
+            print("No products table, search index skipped")
+    finally:
+        connection.close()
@@ -1,5 +1,9 @@
 import sqlite3
 
+from indexes import create_indexes
+from ratings import create_rating_stats
+from search import create_search_index
+
 def create_delivery_db():
     conn = sqlite3.connect('delivery.db')
     c = conn.cursor()
@@ -130,6 +134,11 @@ def create_delivery_db():
     ''')
 
     conn.commit()
+
+    # Вторичные индексы (indexes.INDEXES), полнотекстовый индекс и сводка оценок товаров
+    create_indexes(conn)
+    create_search_index(conn)
+    create_rating_stats(conn)
     conn.close()
 
 if __name__ == '__main__':
@@ -0,0 +1,300 @@
+import argparse
+import hmac
+import logging
+import os
+import secrets
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import db
+import versions
+from inventory import INVENTORY
+
+# Сброс базы лаборатории из снимка вместо повторного выполнения
+# output_database_structure.sql и output_data.sql (createdb.py).
+# Заполненная база один раз сохраняется шаблоном (save), сброс (reset)
+# восстанавливает базу из шаблона:
+# - Postgres: CREATE DATABASE ... TEMPLATE под временным именем, затем
+#   DROP DATABASE ... WITH (FORCE) и переименование (PostgreSQL 13+,
+#   пользователю нужно право CREATEDB);
+# - SQLite: страницы шаблона копируются в базу через backup API под
+#   блокировками SQLite, поэтому открытые соединения воркеров остаются
+#   рабочими; база, которой еще нет (новая лаборатория), создается копией
+#   файла шаблона (reflink, если ФС поддерживает).
+# Сброс из CLI при запущенном сервере публикуется в журнал сбросов
+# (db.publish_reset): воркеры применяют его перед следующим запросом --
+# отбрасывают соединения к старой базе, ETag каталога и блоки остатков.
+# Журнал пишется до и после восстановления, чтобы воркеры не вернули
+# остатки в восстановленную базу.
+# Настройки -- db.DATABASE_CONFIG['snapshot'].
+
+# POST /reset требует заголовок X-Reset-Token с этим значением;
+# без настроенного токена сброс через API запрещен (CLI работает всегда)
+SNAPSHOT_RESET_TOKEN = os.getenv('SNAPSHOT_RESET_TOKEN', '')
+SAVE_RETRIES = 5
+# ioctl FICLONE из linux/fs.h
+FICLONE = 0x40049409
+
+logger = logging.getLogger(__name__)
+
+_stats = {'resets': 0, 'failures': 0, 'reset_time_total': 0.0, 'last_reset_ms': 0.0}
+_stats_lock = threading.Lock()
+
+
+def database_name(tenant=None):
+    # Имя базы Postgres или путь к файлу SQLite лаборатории
+    if db.DATABASE_TYPE == 'sqlite':
+        return dict(db.DATABASE_CONFIG['sqlite'], **db.tenant_settings(tenant))['database']
+    if tenant is not None and db.DATABASE_CONFIG['tenants']['isolation'] == 'schema':
+        raise ValueError("Snapshots are not supported with TENANT_ISOLATION=schema")
+    return dict(db.DATABASE_CONFIG['postgres'], **db.tenant_settings(tenant))['dbname']
+
+
+def template_name():
+    template = db.DATABASE_CONFIG['snapshot']['template']
+    if template:
+        return template
+    if db.DATABASE_TYPE == 'sqlite':
+        return db.DATABASE_CONFIG['sqlite']['database'] + '.template'
+    return db.DATABASE_CONFIG['postgres']['dbname'] + '_template'
+
+
+# Postgres
+
+def _maintenance_connection():
+    import psycopg2
+    config = db.DATABASE_CONFIG['postgres']
+    conn = psycopg2.connect(
+        dbname=db.DATABASE_CONFIG['snapshot']['maintenance_db'],
+        user=config['user'],
+        password=config['password'],
+        host=config['host'],
+        port=config['port']
+    )
+    # CREATE/DROP DATABASE не выполняются внутри транзакции
+    conn.autocommit = True
+    return conn
+
+
+def _staging_name(name):
+    # Временное имя укладывается в 63 символа идентификатора Postgres
+    return f"{name[:48]}_s{secrets.token_hex(4)}"
+
+
+def _execute(cursor, statement, *names):
+    from psycopg2 import sql
+    cursor.execute(sql.SQL(statement).format(*map(sql.Identifier, names)))
+
+
+def _database_exists(cursor, name):
+    cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s", (name,))
+    return cursor.fetchone() is not None
+
+
+def _save_postgres(source, template):
+    import psycopg2.errors
+    conn = _maintenance_connection()
+    cursor = conn.cursor()
+    staging = _staging_name(template)
+    try:
+        # Шаблон копируется только без других сессий в базе-источнике:
+        # соединения пулов закрываются, пулы переподключатся сами
+        for attempt in range(SAVE_RETRIES):
+            cursor.execute("""
+                SELECT pg_terminate_backend(pid) FROM pg_stat_activity
+                WHERE datname = %s AND pid <> pg_backend_pid()
+            """, (source,))
+            try:
+                _execute(cursor, "CREATE DATABASE {} TEMPLATE {}", staging, source)
+                break
+            except psycopg2.errors.ObjectInUse:
+                if attempt == SAVE_RETRIES - 1:
+                    raise
+                time.sleep(0.1)
+        try:
+            if _database_exists(cursor, template):
+                _execute(cursor, "ALTER DATABASE {} WITH IS_TEMPLATE false", template)
+                _execute(cursor, "DROP DATABASE {} WITH (FORCE)", template)
+            _execute(cursor, "ALTER DATABASE {} RENAME TO {}", staging, template)
+            _execute(cursor, "ALTER DATABASE {} WITH IS_TEMPLATE true ALLOW_CONNECTIONS false", template)
+        except Exception:
+            _execute(cursor, "DROP DATABASE IF EXISTS {}", staging)
+            raise
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def _reset_postgres(name, template):
+    # Копия шаблона готовится под временным именем; база без данных видна
+    # клиентам только между DROP и RENAME
+    conn = _maintenance_connection()
+    cursor = conn.cursor()
+    staging = _staging_name(name)
+    try:
+        _execute(cursor, "CREATE DATABASE {} TEMPLATE {}", staging, template)
+        try:
+            _execute(cursor, "DROP DATABASE IF EXISTS {} WITH (FORCE)", name)
+            _execute(cursor, "ALTER DATABASE {} RENAME TO {}", staging, name)
+        except Exception:
+            _execute(cursor, "DROP DATABASE IF EXISTS {}", staging)
+            raise
+    finally:
+        cursor.close()
+        conn.close()
+
+
+# SQLite
+
+def _open_readonly(path):
+    import sqlite3
+    return sqlite3.connect(f"file:{quote(os.path.abspath(path))}?mode=ro", uri=True)
+
+
+def _reflink(source, target):
+    try:
+        import fcntl
+        fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+        return True
+    except (ImportError, OSError):
+        return False
+
+
+def clone_file(source, target):
+    # Reflink делит блоки с исходным файлом (btrfs, XFS), иначе обычная копия;
+    # готовый файл подменяет target атомарно
+    temporary = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(source, 'rb') as src, open(temporary, 'wb') as dst:
+            cloned = _reflink(src, dst)
+        if not cloned:
+            shutil.copyfile(source, temporary)
+        os.replace(temporary, target)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+def _save_sqlite(source, template):
+    import sqlite3
+    temporary = f"{template}.tmp"
+    if os.path.exists(temporary):
+        os.remove(temporary)
+    src = _open_readonly(source)
+    dst = sqlite3.connect(temporary)
+    try:
+        # backup дает согласованный снимок и при открытом WAL
+        src.backup(dst)
+        # Шаблон без WAL: его копия открывается как обычный файл
+        dst.execute("PRAGMA journal_mode = DELETE")
+    finally:
+        dst.close()
+        src.close()
+    os.replace(temporary, template)
+
+
+def _reset_sqlite(tenant, path, template):
+    if not os.path.exists(template):
+        raise FileNotFoundError(f"No snapshot {template}, run: python snapshot.py save")
+    if not os.path.exists(path):
+        clone_file(template, path)
+        return
+    src = _open_readonly(template)
+    try:
+        # Писатель пула: запись идет под его блокировкой (SQLite-профиль 'tuned')
+        with db.using_tenant(tenant), db.connection(write=True) as conn:
+            src.backup(conn)
+    finally:
+        src.close()
+
+
+def save(tenant=None):
+    # Сохраняет текущую базу лаборатории шаблоном для reset
+    source, template = database_name(tenant), template_name()
+    started = time.perf_counter()
+    if db.DATABASE_TYPE == 'sqlite':
+        _save_sqlite(source, template)
+    else:
+        _save_postgres(source, template)
+        db.database_reset(tenant)
+    return time.perf_counter() - started
+
+
+def _invalidate(tenant, publish):
+    # Соединения к старой базе, ETag каталога и блоки остатков устарели;
+    # другие воркеры отбросят свои блоки, увидев новое поколение базы
+    db.database_reset(tenant)
+    versions.bump(*versions.TRACKED_TABLES)
+    if INVENTORY is not None and tenant is None:
+        INVENTORY.discard()
+    if publish:
+        db.publish_reset(tenant)
+
+
+def reset(tenant=None, publish=False):
+    # Восстанавливает базу лаборатории (tenant -- uuid в многоарендном режиме)
+    # из шаблона; база, которой нет, создается. Возвращает время в секундах.
+    # publish -- сброс вне сервера (CLI), см. журнал сбросов в заголовке
+    started = time.perf_counter()
+    name = database_name(tenant)
+    # До восстановления: остатки, собранные воркерами, не уйдут в новую базу
+    _invalidate(tenant, publish)
+    try:
+        if db.DATABASE_TYPE == 'sqlite':
+            _reset_sqlite(tenant, name, template_name())
+        else:
+            _reset_postgres(name, template_name())
+    except Exception:
+        with _stats_lock:
+            _stats['failures'] += 1
+        raise
+    # После: соединения и ETag, полученные во время восстановления
+    _invalidate(tenant, publish)
+    elapsed = time.perf_counter() - started
+    with _stats_lock:
+        _stats['resets'] += 1
+        _stats['reset_time_total'] += elapsed
+        _stats['last_reset_ms'] = round(elapsed * 1000, 1)
+    logger.info(f"Database {name} reset in {elapsed * 1000:.1f}ms")
+    return elapsed
+
+
+def authorized(token):
+    if not SNAPSHOT_RESET_TOKEN:
+        return False
+    return hmac.compare_digest(token or '', SNAPSHOT_RESET_TOKEN)
+
+
+def reset_stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Снимок базы лаборатории и сброс из него")
+    parser.add_argument('command', choices=['save', 'reset'])
+    parser.add_argument('--backend', choices=['sqlite', 'postgres'], default='sqlite')
+    parser.add_argument('--tenant', action='append', default=[],
+                        help="uuid лаборатории (многоарендный режим); можно указать несколько")
+    parser.add_argument('--workers', type=int, default=8, help="параллельные сбросы")
+    args = parser.parse_args()
+
+    db.DATABASE_TYPE = args.backend
+    try:
+        if args.command == 'save':
+            elapsed = save(args.tenant[0] if args.tenant else None)
+            print(f"Snapshot {template_name()} saved in {elapsed * 1000:.1f}ms")
+        else:
+            started = time.perf_counter()
+            tenants = args.tenant or [None]
+            with ThreadPoolExecutor(max_workers=args.workers) as executor:
+                results = executor.map(lambda tenant: reset(tenant, publish=True), tenants)
+                for tenant, elapsed in zip(tenants, results):
+                    print(f"Reset {database_name(tenant)} in {elapsed * 1000:.1f}ms")
+            print(f"{len(tenants)} databases reset in {(time.perf_counter() - started) * 1000:.1f}ms")
+    finally:
+        db.close_pool()
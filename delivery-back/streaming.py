@@ -0,0 +1,46 @@
+import itertools
+import os
+
+from flask import current_app
+
+# Потоковая отдача JSON-массива: строки кодируются по мере выборки из БД
+STREAM_CHUNK_SIZE = int(os.getenv('STREAM_CHUNK_SIZE', 64 * 1024))
+
+
+def stream_json(rows, transform=None):
+    # Первая пачка выбирается сразу, чтобы ошибка запроса
+    # попала в обработчик view, а не в середину ответа
+    source = iter(rows)
+    try:
+        first = next(source)
+    except StopIteration:
+        return current_app.json.response([])
+    rows = itertools.chain((first,), source)
+    if transform is not None:
+        rows = map(transform, rows)
+
+    dumps = current_app.json.dumps
+
+    def generate():
+        try:
+            chunk = ['[']
+            size = 1
+            separator = ''
+            for row in rows:
+                item = dumps(row, separators=(',', ':'))
+                chunk.append(separator)
+                chunk.append(item)
+                separator = ','
+                size += len(item) + 1
+                if size >= STREAM_CHUNK_SIZE:
+                    yield ''.join(chunk)
+                    chunk = []
+                    size = 0
+            chunk.append(']\n')
+            yield ''.join(chunk)
+        finally:
+            close = getattr(source, 'close', None)
+            if close is not None:
+                close()
+
+    return current_app.response_class(generate(), mimetype=current_app.json.mimetype)
@@ -0,0 +1,38 @@
+from flask import jsonify
+
+import db
+
+# Многоарендный режим (TENANT_MODE=1): один процесс обслуживает лаборатории
+# многих студентов вместо отдельного контейнера на каждый uuid. Blueprint api
+# дополнительно монтируется под /away/<uuid>/api, uuid из пути выбирает базу
+# лаборатории (db.DATABASE_CONFIG['tenants']), пулы создаются при первом
+# запросе и закрываются после простоя (db.TenantPools). Префикс url_prefix
+# по-прежнему обслуживает базу по умолчанию. Режим поддерживается в app.py;
+# async_app.py обслуживает только url_prefix.
+# Остатки популярных товаров (inventory.py) в этом режиме не поддерживаются:
+# их фоновый поток пишет в базу по умолчанию.
+
+TENANT_URL_PREFIX = '/away/<uuid:tenant_id>/api'
+
+
+def pull_tenant(endpoint, values):
+    # Для каждого запроса: поток обслуживает разные лаборатории по очереди,
+    # поэтому лаборатория (или ее отсутствие) выставляется заново
+    tenant = values.pop('tenant_id', None) if values else None
+    db.use_tenant(str(tenant) if tenant is not None else None)
+
+
+def unknown_tenant(e):
+    return jsonify({"message": str(e)}), 404
+
+
+def init_app(app, blueprint):
+    # Вызывается после объявления всех роутов blueprint
+    if not db.DATABASE_CONFIG['tenants']['enabled']:
+        return
+    from inventory import INVENTORY
+    if INVENTORY is not None:
+        raise RuntimeError("INVENTORY_HOT_ARTICLES is not supported with TENANT_MODE=1")
+    app.url_value_preprocessor(pull_tenant)
+    app.register_error_handler(db.UnknownTenant, unknown_tenant)
+    app.register_blueprint(blueprint, url_prefix=TENANT_URL_PREFIX, name='tenant_api')
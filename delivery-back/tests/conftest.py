@@ -0,0 +1,62 @@
+import os
+import sqlite3
+import sys
+
+import pytest
+
+# Модули бэкенда лежат плоско в delivery-back/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def seed_database(directory):
+    # Заполненная база simpledb/filldb с поиском и сводкой оценок
+    import filldb
+    import ratings
+    import search
+    import simpledb
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        simpledb.create_delivery_db()
+        filldb.populate_delivery_db()
+    finally:
+        os.chdir(cwd)
+    path = os.path.join(directory, 'delivery.db')
+    conn = sqlite3.connect(path)
+    try:
+        # В схеме simpledb нет products.category (избранное) и генерации
+        # order_id/review_id (запись заказа и отзыва)
+        conn.executescript("""
+            ALTER TABLE products ADD COLUMN category TEXT;
+            UPDATE products SET category = 'Food';
+            ALTER TABLE orders RENAME TO orders_seed;
+            CREATE TABLE orders (order_id INTEGER PRIMARY KEY AUTOINCREMENT, login TEXT NOT NULL,
+                                 order_date DATETIME NOT NULL, status TEXT NOT NULL, secret TEXT);
+            INSERT INTO orders SELECT * FROM orders_seed;
+            DROP TABLE orders_seed;
+            ALTER TABLE reviews RENAME TO reviews_seed;
+            CREATE TABLE reviews (review_id INTEGER PRIMARY KEY AUTOINCREMENT, login TEXT NOT NULL,
+                                  article BIGINT NOT NULL, rating INT NOT NULL, review_text TEXT NOT NULL,
+                                  review_date TIMESTAMP NOT NULL, secret TEXT);
+            INSERT INTO reviews SELECT * FROM reviews_seed;
+            DROP TABLE reviews_seed;
+        """)
+        search.create_search_index(conn)
+        ratings.create_rating_stats(conn)
+    finally:
+        conn.close()
+    return path
+
+
+@pytest.fixture
+def sqlite_db(tmp_path):
+    # Путь к заполненной базе; db.py на время теста работает с ней
+    import db
+    path = seed_database(tmp_path)
+    config = db.DATABASE_CONFIG['sqlite']
+    saved = db.DATABASE_TYPE, config['database']
+    db.DATABASE_TYPE, config['database'] = 'sqlite', path
+    db.close_pool()
+    yield path
+    db.close_pool()
+    db.DATABASE_TYPE, config['database'] = saved
@@ -0,0 +1,132 @@
+import asyncio
+import shutil
+
+import pytest
+
+import db
+from conftest import seed_database
+from pagination import NEXT_CURSOR_HEADER
+
+# app.py и async_app.py на копиях одной заполненной SQLite-базы:
+# одинаковая последовательность запросов дает одинаковые ответы
+
+AUTH = {'Authorization': 'Bearer customer1'}
+
+# (метод, путь, тело, заголовки); записи идут после чтений, ответы
+# после записей не зависят от времени запроса
+REQUESTS = [
+    ('GET', '/ready', None, None),
+    ('GET', '/categories', None, None),
+    ('GET', '/products', None, None),
+    ('GET', '/products?limit=2', None, None),
+    ('GET', '/products?category=Fruits', None, None),
+    ('GET', '/products?category=Dairy&limit=1', None, None),
+    ('GET', '/products?with_ratings=1', None, None),
+    ('GET', '/products?limit=1&with_ratings=1', None, None),
+    ('GET', '/products?cursor=bad', None, None),
+    ('GET', '/products/search?q=apple', None, None),
+    ('GET', '/products/search?q=fresh%20mi&limit=1', None, None),
+    ('GET', '/products/search', None, None),
+    ('GET', '/products/1001', None, None),
+    ('GET', '/products/1001?with_ratings=1', None, None),
+    ('GET', '/products/9999', None, None),
+    ('GET', '/products/1001/reviews', None, None),
+    ('GET', '/products/1001/reviews?limit=1', None, None),
+    ('GET', '/favorites', None, None),
+    ('GET', '/favorites', None, AUTH),
+    ('GET', '/favorites?limit=1', None, AUTH),
+    ('GET', '/cart', None, AUTH),
+    ('GET', '/profile', None, AUTH),
+    ('GET', '/profile', None, {'Authorization': 'Bearer nobody'}),
+    ('GET', '/profile/summary', None, AUTH),
+    ('GET', '/profile/summary', None, {'Authorization': 'Bearer nobody'}),
+    ('GET', '/profile/favorites', None, AUTH),
+    ('GET', '/profile/reviews', None, AUTH),
+    ('GET', '/profile/reviews?limit=1', None, AUTH),
+    ('GET', '/orders', None, AUTH),
+    ('GET', '/orders?limit=1', None, AUTH),
+    ('POST', '/login', {'username': 'customer1', 'password': 'password1'}, None),
+    ('POST', '/login', {'username': 'customer1', 'password': 'wrong'}, None),
+    ('POST', '/logout', None, None),
+    ('POST', '/products/1001/reviews', {'review': 'Crisp', 'rating': 4}, AUTH),
+    ('POST', '/products/1001/reviews', {'review': ''}, AUTH),
+    ('POST', '/favorites', {'article': 1003}, AUTH),
+    ('POST', '/favorites', {'article': 1003}, AUTH),
+    ('DELETE', '/favorites/1003', None, AUTH),
+    ('POST', '/cart', {'article': 1002, 'quantity': 1}, AUTH),
+    ('DELETE', '/cart/1002', None, AUTH),
+    ('POST', '/profile', {'description': 'updated'}, AUTH),
+    ('GET', '/profile', None, AUTH),
+    ('POST', '/orders', {'orders': [{'article': 1001, 'quantity': 2, 'price': 3.5}]}, AUTH),
+    ('POST', '/orders', {'orders': [{'article': 'x', 'quantity': 1, 'price': 1}]}, AUTH),
+    ('POST', '/orders', {'orders': [{'article': 1002, 'quantity': 1000, 'price': 2}]}, AUTH),
+    ('POST', '/reset', None, None),
+    ('GET', '/products/1001?with_ratings=1', None, None),
+    ('GET', '/products/1002', None, None),
+]
+
+
+def _result(status, headers, body):
+    return status, headers.get(NEXT_CURSOR_HEADER), body
+
+
+def _run_sync(prefix):
+    import app
+    client = app.app.test_client()
+    results = []
+    for method, path, body, headers in REQUESTS:
+        response = client.open(prefix + path, method=method, json=body, headers=headers)
+        results.append(_result(response.status_code, response.headers, response.get_json(silent=True)))
+    db.close_pool()
+    return results
+
+
+async def _run_async(prefix):
+    import adb
+    import async_app
+    client = async_app.app.test_client()
+    results = []
+    for method, path, body, headers in REQUESTS:
+        response = await client.open(prefix + path, method=method, json=body, headers=headers)
+        results.append(_result(response.status_code, response.headers, await response.get_json()))
+    await adb.close_pool()
+    return results
+
+
+@pytest.fixture(scope='module')
+def responses(tmp_path_factory):
+    seed = seed_database(tmp_path_factory.mktemp('seed'))
+    config = db.DATABASE_CONFIG['sqlite']
+    saved = db.DATABASE_TYPE, config['database']
+    db.DATABASE_TYPE = 'sqlite'
+    try:
+        import app
+        paths = []
+        for name in ('sync', 'async'):
+            path = str(tmp_path_factory.mktemp(name) / 'delivery.db')
+            shutil.copyfile(seed, path)
+            paths.append(path)
+        config['database'] = paths[0]
+        sync_results = _run_sync(app.url_prefix)
+        config['database'] = paths[1]
+        async_results = asyncio.run(_run_async(app.url_prefix))
+    finally:
+        db.DATABASE_TYPE, config['database'] = saved
+    return sync_results, async_results
+
+
+@pytest.mark.parametrize('index', range(len(REQUESTS)),
+                         ids=[f"{method} {path}" for method, path, _, _ in REQUESTS])
+def test_same_response(responses, index):
+    sync_results, async_results = responses
+    assert async_results[index] == sync_results[index]
+
+
+def test_summary_without_profile_row(responses):
+    # Нет строки user_personal_info: списки отдаются, profile равен null
+    sync_results, _ = responses
+    index = REQUESTS.index(('GET', '/profile/summary', None, {'Authorization': 'Bearer nobody'}))
+    status, _, body = sync_results[index]
+    assert status == 200
+    assert body['profile'] is None
+    assert body['orders'] == [] and body['favorites'] == [] and body['reviews'] == []
@@ -0,0 +1,33 @@
+import sqlite3
+
+import pytest
+
+import db
+from groupcommit import GroupCommitWriter
+
+
+def cart_insert(article):
+    return f"""
+        INSERT INTO shopping_cart (login, article, quantity, secret)
+        VALUES ('customer3', {article}, 1, 'default_secret')
+    """
+
+
+def test_error_goes_only_to_its_writer(sqlite_db):
+    # Окно ожидания с запасом: все три записи попадают в одну пачку
+    writer = GroupCommitWriter(max_delay=0.5, max_batch=3)
+    try:
+        futures = [writer.submit(cart_insert(1001)),
+                   writer.submit("INSERT INTO no_such_table VALUES (1)"),
+                   writer.submit(cart_insert(1003))]
+        assert futures[0].result(timeout=5) is None
+        with pytest.raises(sqlite3.OperationalError):
+            futures[1].result(timeout=5)
+        assert futures[2].result(timeout=5) is None
+    finally:
+        writer.close()
+
+    rows = db.query_db("SELECT article FROM shopping_cart WHERE login = 'customer3' ORDER BY article")
+    assert [row['article'] for row in rows] == [1001, 1003]
+    stats = writer.stats()
+    assert (stats['batches'], stats['statements'], stats['errors'], stats['failed_batches']) == (1, 3, 1, 0)
@@ -0,0 +1,41 @@
+import threading
+
+import db
+from inventory import Inventory, OutOfStock
+
+
+def stock(article):
+    return db.query_db(f"SELECT stock FROM products WHERE article = {article}", one=True)['stock']
+
+
+def test_two_reservers_do_not_oversell(sqlite_db):
+    # Два процесса с блоками остатка (здесь -- два Inventory с разными
+    # владельцами) и фоновым возвратом простаивающих блоков
+    initial = stock(1002)
+    inventories = [Inventory([1002], block_size=7, shards=2, flush_interval=0.01) for _ in range(2)]
+    sold = []
+
+    def buy(inventory):
+        while True:
+            try:
+                reserved = inventory.reserve({1002: 1})
+            except OutOfStock:
+                return
+            with db.transaction() as cursor:
+                cursor.execute(inventory.sold_query(reserved))
+            sold.append(reserved[1002])
+
+    threads = [threading.Thread(target=buy, args=(inventory,)) for inventory in inventories for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for inventory in inventories:
+        inventory.close()
+
+    assert sum(sold) > initial // 2, sum(sold)
+    assert stock(1002) >= 0
+    # Все забранное из products либо продано, либо вернулось
+    assert sum(sold) + stock(1002) == initial
+    claims = db.query_db("SELECT COALESCE(SUM(quantity), 0) AS n FROM inventory_claims", one=True)
+    assert claims['n'] == 0
@@ -0,0 +1,55 @@
+import asyncio
+import contextvars
+
+import metrics
+
+
+def series(histogram, endpoint):
+    # (число наблюдений, сумма) серии endpoint'а
+    counts, total = histogram._series.get((endpoint, 'GET'), ([0], 0.0))
+    return sum(counts), total
+
+
+def test_server_timing_counts_queries(sqlite_db):
+    import app
+    response = app.app.test_client().get(app.url_prefix + '/products?limit=2')
+    assert response.status_code == 200
+    assert 'queries"' in response.headers['Server-Timing']
+    assert 'desc="0 queries"' not in response.headers['Server-Timing']
+    response.close()
+    assert metrics._request.get() is None
+
+
+def test_streamed_db_time_recorded_on_close(sqlite_db):
+    import app
+    before = series(metrics.REQUEST_ROWS, 'api.get_products')
+    response = app.app.test_client().get(app.url_prefix + '/products')
+    assert response.is_streamed
+    # Заголовок уходит до выборки строк: времени БД в нем нет
+    assert response.headers['Server-Timing'].endswith('desc="streamed"')
+    assert len(response.get_json()) == 3
+    response.close()
+    after = series(metrics.REQUEST_ROWS, 'api.get_products')
+    assert after[0] == before[0] + 1
+    assert after[1] - before[1] == 3
+    assert metrics._request.get() is None
+
+
+def test_stats_follow_context_not_thread():
+    first, second = metrics.RequestStats(), metrics.RequestStats()
+
+    def run(stats, rows):
+        metrics._request.set(stats)
+        metrics.record_query(0.001, 0.002, 0.003, rows=rows)
+
+    # Два запроса в одном потоке, каждый в своем контексте
+    contextvars.copy_context().run(run, first, 1)
+    contextvars.copy_context().run(run, second, 5)
+    assert (first.queries, first.rows, second.rows) == (1, 1, 5)
+
+    async def in_thread():
+        metrics._request.set(first)
+        await asyncio.to_thread(metrics.record_query, 0.0, 0.0, 0.0, 2)
+    contextvars.copy_context().run(asyncio.run, in_thread())
+    assert (first.queries, first.rows) == (2, 3)
+    assert metrics._request.get() is None
@@ -0,0 +1,55 @@
+import db
+
+AUTH = {'Authorization': 'Bearer customer1'}
+
+
+def stock():
+    return {row['article']: row['stock'] for row in db.query_db("SELECT article, stock FROM products")}
+
+
+def order_count():
+    return db.query_db("SELECT COUNT(*) AS n FROM orders", one=True)['n']
+
+
+def post_orders(orders):
+    import app
+    return app.app.test_client().post(app.url_prefix + '/orders', json={'orders': orders}, headers=AUTH)
+
+
+def test_mixed_article_types_are_one_product(sqlite_db):
+    # 5 и "5" списываются одним UPDATE как один товар
+    before, orders = stock(), order_count()
+    response = post_orders([
+        {'article': 1001, 'quantity': 2, 'price': 3.5},
+        {'article': '1001', 'quantity': 3, 'price': 3.5},
+        {'article': 1002, 'quantity': 1, 'price': 2},
+    ])
+    assert response.status_code == 201
+    after = stock()
+    assert after[1001] == before[1001] - 5
+    assert after[1002] == before[1002] - 1
+    assert after[1003] == before[1003]
+    assert order_count() == orders + 3
+
+
+def test_insufficient_stock_across_lines(sqlite_db):
+    # Каждой позиции по отдельности хватает, вместе -- нет
+    before, orders = stock(), order_count()
+    half = before[1002] // 2 + 1
+    response = post_orders([
+        {'article': 1001, 'quantity': 1, 'price': 3.5},
+        {'article': 1002, 'quantity': half, 'price': 2},
+        {'article': '1002', 'quantity': half, 'price': 2},
+    ])
+    assert response.status_code == 400
+    assert response.get_json() == {"message": "Insufficient stock for article 1002"}
+    # Ничего не списано и не записано
+    assert stock() == before
+    assert order_count() == orders
+
+
+def test_invalid_article(sqlite_db):
+    before = stock()
+    response = post_orders([{'article': '1001 OR 1=1', 'quantity': 1, 'price': 1}])
+    assert response.status_code == 400
+    assert stock() == before
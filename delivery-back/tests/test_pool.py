@@ -0,0 +1,95 @@
+import threading
+
+import pytest
+
+import db
+
+
+class FakeConnection:
+    # Минимум psycopg2-соединения, который нужен ConnectionPool
+    reset_slot = 0
+
+    def __init__(self):
+        self.closed = False
+        self.reset_epoch = db._reset_epochs[0]
+
+    def get_transaction_status(self):
+        return db.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def pool():
+    pool = db.ConnectionPool(FakeConnection, minconn=0, maxconn=2, timeout=0.2)
+    yield pool
+    pool.closeall()
+
+
+def test_checkout_and_return(pool):
+    conn = pool.getconn()
+    assert pool.getconn() is conn  # тот же поток -- то же соединение
+    pool.putconn(conn)
+    assert pool.stats()['in_use'] == 1
+    pool.putconn(conn)
+    stats = pool.stats()
+    assert (stats['in_use'], stats['idle'], stats['created']) == (0, 1, 1)
+    assert pool.getconn() is conn  # из простаивающих
+
+
+def test_timeout_when_exhausted(pool):
+    taken = []
+
+    def take():
+        taken.append(pool.getconn())
+    for _ in range(2):
+        thread = threading.Thread(target=take)
+        thread.start()
+        thread.join()
+    with pytest.raises(db.PoolTimeout):
+        pool.getconn()
+    assert pool.stats()['timeouts'] == 1
+
+
+def test_close_with_checked_out_connection(pool):
+    busy = pool.getconn()
+    idle = []
+
+    def take_and_return():
+        conn = pool.getconn()
+        idle.append(conn)
+        pool.putconn(conn)
+    thread = threading.Thread(target=take_and_return)
+    thread.start()
+    thread.join()
+
+    pool.closeall()
+    assert idle[0].closed and not busy.closed
+    # Соединение, выданное до закрытия, закрывается при возврате
+    pool.putconn(busy)
+    assert busy.closed
+    with pytest.raises(db.PoolClosed):
+        pool.getconn()
+    assert pool.stats()['size'] == 0
+
+
+def test_close_wakes_waiters(pool):
+    for _ in range(2):
+        thread = threading.Thread(target=pool.getconn)
+        thread.start()
+        thread.join()
+    pool.timeout = 5
+    errors = []
+
+    def wait():
+        try:
+            pool.getconn()
+        except Exception as e:
+            errors.append(e)
+    waiter = threading.Thread(target=wait)
+    waiter.start()
+    pool.closeall()
+    waiter.join(2)
+    assert not waiter.is_alive()
+    assert isinstance(errors[0], db.PoolClosed)
@@ -0,0 +1,106 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import db
+import snapshot
+from inventory import Inventory
+from test_pool import FakeConnection
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def stock(article):
+    return db.query_db(f"SELECT stock FROM products WHERE article = {article}", one=True)['stock']
+
+
+@pytest.fixture
+def lab(sqlite_db, tmp_path):
+    # CLI работает с базой по умолчанию: pharmacy.db в текущем каталоге
+    path = str(tmp_path / 'pharmacy.db')
+    os.replace(sqlite_db, path)
+    db.DATABASE_CONFIG['sqlite']['database'] = path
+    snapshot.save()
+    return tmp_path
+
+
+def test_cli_reset_reaches_running_server(lab):
+    import app
+    initial = stock(1001)
+    inventory = Inventory([1001], block_size=5)
+    inventory.reserve({1001: 2})
+    assert stock(1001) == initial - 5
+
+    client = app.app.test_client()
+    url = app.url_prefix + '/products/1001'
+    tag = client.get(url).headers['ETag']
+    assert client.get(url, headers={'If-None-Match': tag}).status_code == 304
+
+    pool = db.ConnectionPool(FakeConnection, minconn=0, maxconn=1, timeout=0.2)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    epoch = db.reset_epoch()
+
+    env = dict(os.environ, INVENTORY_HOT_ARTICLES='')
+    subprocess.run([sys.executable, os.path.join(BACKEND, 'snapshot.py'), 'reset'],
+                   cwd=lab, env=env, check=True, capture_output=True)
+
+    # Первый же запрос применяет сброс: ETag каталога сменился
+    response = client.get(url, headers={'If-None-Match': tag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != tag
+    assert db.reset_epoch() != epoch
+
+    # Соединение к старой базе пул не выдает
+    assert pool.getconn() is not conn
+    assert conn.closed
+    pool.closeall()
+
+    # Блок остатка отброшен, а не возвращен в восстановленную базу
+    inventory.flush()
+    assert inventory.items[1001].available() == 0
+    assert stock(1001) == initial
+
+
+def test_old_published_resets_are_skipped(lab):
+    # Строки журнала, записанные до запуска сервера, не применяются
+    with open(db.reset_log_path(), 'w') as log:
+        log.write(f"{db._BOOT_TIME - 60:.6f} -\n")
+    epoch = db.reset_epoch()
+    db.apply_published_resets()
+    assert db.reset_epoch() == epoch
+    db.publish_reset()
+    db.apply_published_resets()
+    assert db.reset_epoch() == epoch + 1
+    db.apply_published_resets()
+    assert db.reset_epoch() == epoch + 1
+
+
+def test_reset_restores_snapshot_and_invalidates(lab, monkeypatch):
+    import app
+    initial = stock(1001)
+    inventory = Inventory([1001], block_size=5)
+    monkeypatch.setattr(snapshot, 'INVENTORY', inventory)
+    monkeypatch.setattr(snapshot, 'SNAPSHOT_RESET_TOKEN', 'secret')
+    inventory.reserve({1001: 2})
+    db.execute_db("UPDATE products SET price = 0 WHERE article = 1001")
+
+    client = app.app.test_client()
+    url = app.url_prefix + '/products/1001'
+    response = client.get(url)
+    tag = response.headers['ETag']
+    assert response.get_json()['price'] == 0
+
+    assert client.post(app.url_prefix + '/reset').status_code == 401
+    assert client.post(app.url_prefix + '/reset', headers={'X-Reset-Token': 'secret'}).status_code == 200
+
+    response = client.get(url, headers={'If-None-Match': tag})
+    assert response.status_code == 200
+    assert response.get_json()['price'] != 0
+    # Блок отброшен в самом сбросе, остаток -- из снимка
+    assert inventory.items[1001].available() == 0
+    assert inventory.generation == db.reset_epoch()
+    inventory.flush()
+    assert stock(1001) == initial
@@ -0,0 +1,86 @@
+import threading
+
+import pytest
+
+import db
+
+
+class FakePool:
+    def __init__(self, tenants, name):
+        self.tenants = tenants
+        self.name = name
+        self.closed = False
+        self.lock_free = None
+
+    def closeall(self):
+        # Пул закрывается без блокировки TenantPools: ее берет другой поток
+        thread = threading.Thread(target=self.tenants.stats)
+        thread.start()
+        thread.join(1)
+        self.lock_free = not thread.is_alive()
+        self.closed = True
+
+
+@pytest.fixture
+def pools(monkeypatch):
+    pools = db.TenantPools(idle_timeout=600, max_active=2, wait_timeout=0.2)
+    created = {}
+
+    def create_pool(connect, config):
+        pool = FakePool(pools, len(created))
+        created[pool.name] = pool
+        return pool
+    monkeypatch.setattr(db, 'create_pool', create_pool)
+    pools._reaper = threading.current_thread()  # без фонового потока
+    pools.created = created
+    return pools
+
+
+def hold(pools, tenant):
+    # Поток держит соединение лаборатории до release.set()
+    taken, release = threading.Event(), threading.Event()
+
+    def run():
+        with pools.checkout(tenant):
+            taken.set()
+            release.wait()
+    thread = threading.Thread(target=run)
+    thread.start()
+    taken.wait()
+    return release, thread
+
+
+def test_evicts_idle_pool_when_least_recent_is_busy(pools):
+    release, thread = hold(pools, 'a')
+    b = pools.get('b')
+    pools.get('c')
+    assert b.closed and b.lock_free
+    assert not pools.created[0].closed
+    assert pools.stats()['active'] == 2
+    release.set()
+    thread.join()
+
+
+def test_refuses_when_all_pools_busy(pools):
+    held = [hold(pools, tenant) for tenant in ('a', 'b')]
+    with pytest.raises(db.PoolTimeout):
+        pools.get('c')
+    assert pools.stats() == {'created': 2, 'evicted': 0, 'active': 2}
+    for release, thread in held:
+        release.set()
+        thread.join()
+
+
+def test_waits_for_a_pool_to_be_released(pools):
+    pools.wait_timeout = 5
+    held = [hold(pools, tenant) for tenant in ('a', 'b')]
+    result = []
+    waiter = threading.Thread(target=lambda: result.append(pools.get('c')))
+    waiter.start()
+    held[0][0].set()
+    held[0][1].join()
+    waiter.join(2)
+    assert result and pools.created[0].closed
+    assert pools.stats()['active'] == 2
+    held[1][0].set()
+    held[1][1].join()
@@ -0,0 +1,72 @@
+import os
+import re
+import time
+from functools import wraps
+from multiprocessing import Array
+
+from flask import make_response, request
+
+# Счетчики версий таблиц для ETag каталога. Массив в разделяемой памяти
+# создается при импорте в мастер-процессе gunicorn (preload_app) и
+# наследуется воркерами, поэтому запись в любом воркере видна всем.
+TRACKED_TABLES = ('products', 'reviews', 'product_categories')
+CACHE_MAX_AGE = int(os.getenv('CACHE_MAX_AGE', 5))
+
+# Эпоха загрузки: после перезапуска старые ETag не совпадают
+BOOT_EPOCH = format(int(time.time() * 1000), 'x')
+
+_counters = Array('q', len(TRACKED_TABLES))
+_index = {table: i for i, table in enumerate(TRACKED_TABLES)}
+
+_write_re = re.compile(r"^\s*(?:INSERT\s+INTO|UPDATE|DELETE\s+FROM)\s+(\w+)", re.IGNORECASE)
+
+
+def written_table(query):
+    match = _write_re.match(query)
+    return match.group(1).lower() if match else None
+
+
+def bump(*tables):
+    indexes = [_index[table] for table in tables if table in _index]
+    if not indexes:
+        return
+    with _counters.get_lock():
+        for i in indexes:
+            _counters[i] += 1
+
+
+def bump_for(queries):
+    # Вызывается после commit с выполненными запросами
+    bump(*{written_table(query) for query in queries})
+
+
+def version(*tables):
+    return tuple(_counters[_index[table]] for table in tables)
+
+
+def etag(*tables):
+    return f"{BOOT_EPOCH}-" + "-".join(str(v) for v in version(*tables))
+
+
+def cache_headers(response, tag):
+    response.set_etag(tag)
+    response.headers['Cache-Control'] = f"public, max-age={CACHE_MAX_AGE}"
+    return response
+
+
+def conditional(*tables, extra=None):
+    # ETag считается до запроса к БД: запись, попавшая между ними,
+    # даст клиенту более новые данные со старым ETag, но не наоборот.
+    # extra(request.args) -- таблицы, от которых ответ зависит не всегда
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            tag = etag(*tables, *(extra(request.args) if extra else ()))
+            if request.if_none_match.contains_weak(tag):
+                return cache_headers(make_response('', 304), tag)
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                cache_headers(response, tag)
+            return response
+        return wrapper
+    return decorator
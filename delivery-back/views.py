@@ -0,0 +1,244 @@
+import logging
+import os
+from urllib.parse import urlparse
+
+from db import register_statement
+from pagination import PAGE_LIMIT_MAX
+from queries import PRODUCTS_PAGE, PRODUCTS_QUERY, PRODUCTS_RATED_QUERY, category_filter
+from ratings import HISTOGRAM_COLUMNS
+from rows import RowShape
+from search import SEARCH_LIMIT_DEFAULT, SEARCH_RANK_WINDOW, SEARCH_STATEMENTS, search_terms, search_query
+
+# Общие части роутов app.py (Flask) и async_app.py (Quart): префикс API,
+# именованные запросы, формат строк, разбор и проверка запроса, тела
+# ответов. В самих роутах остаются обращения к БД (синхронные или
+# асинхронные). Ошибка запроса -- InvalidRequest, ответ на нее отдает
+# обработчик Blueprint, как для pagination.InvalidPage
+
+logger = logging.getLogger(__name__)
+
+
+# Функция для извлечения пути из переменной окружения
+def extract_path_from_url(env_var_name, default='/lab/frontend/api'):
+    full_url = os.getenv(env_var_name, default)
+    logger.info(f"Full url {full_url}")
+    if full_url == default:
+        logger.info("No REACT_APP_BACKEND_URL env found, using defaults")
+        return default
+    parsed_url = urlparse(full_url)
+    return parsed_url.path
+
+url_prefix = extract_path_from_url('REACT_APP_BACKEND_URL')
+
+# Запросы с постоянным текстом выполняются по имени (db.register_statement)
+register_statement('categories', "SELECT DISTINCT category FROM product_categories")
+for prefix, query in (('products', PRODUCTS_QUERY), ('products_rated', PRODUCTS_RATED_QUERY)):
+    register_statement(prefix, query)
+    register_statement(f"{prefix}_page", query + PRODUCTS_PAGE.template(after=False))
+    register_statement(f"{prefix}_page_after", query + PRODUCTS_PAGE.template(after=True))
+for name, sql in SEARCH_STATEMENTS.items():
+    register_statement(name, sql)
+
+# Формат строк ответов: {ключ в ответе: колонка запроса}
+PRODUCT_FIELDS = {
+    "article": "article", "name": "name", "store_name": "store_name", "category_name": "category_name",
+    "price": "price", "stock": "stock", "released": "released"
+}
+PRODUCT_DETAIL_FIELDS = {
+    "article": "article", "name": "name", "category": "category", "store_name": "store_name",
+    "price": "price", "stock": "stock", "released": "released"
+}
+RATING_FIELDS = {"review_count": "review_count", "rating_avg": "rating_avg"}
+PRODUCT_ROW = RowShape('ProductRow', PRODUCT_FIELDS)
+PRODUCT_RATED_ROW = RowShape('ProductRatedRow', dict(PRODUCT_FIELDS, **RATING_FIELDS))
+PRODUCT_DETAIL_ROW = RowShape('ProductDetailRow', PRODUCT_DETAIL_FIELDS)
+PRODUCT_DETAIL_RATED_ROW = RowShape('ProductDetailRatedRow', dict(
+    PRODUCT_DETAIL_FIELDS, **RATING_FIELDS, **{column: column for column in HISTOGRAM_COLUMNS}))
+PRODUCT_REVIEW_ROW = RowShape('ProductReviewRow', {
+    "username": "login", "review_text": "review_text", "rating": "rating", "review_date": "review_date"
+}, keys=('review_id',))
+# added_date нужна только для курсора
+FAVORITE_ROW = RowShape('FavoriteRow', {
+    "article": "article", "name": "name", "price": "price", "category": "category"
+}, keys=('added_date',))
+CART_ROW = RowShape('CartRow', {
+    "article": "article", "name": "name", "price": "price", "quantity": "quantity"
+})
+USER_FAVORITE_ROW = RowShape('UserFavoriteRow', {
+    "product_name": "product_name", "article": "article", "added_date": "added_date"
+})
+USER_REVIEW_ROW = RowShape('UserReviewRow', {
+    "review_text": "review_text", "rating": "rating", "review_date": "review_date", "product_name": "product_name"
+}, keys=('review_id',))
+ORDER_ROW = RowShape('OrderRow', {
+    "order_id": "order_id", "order_date": "order_date", "status": "status"
+})
+
+
+class InvalidRequest(Exception):
+    # Ответ {key: сообщение} со статусом status
+    def __init__(self, message, status=400, key='message'):
+        super().__init__(message)
+        self.status = status
+        self.key = key
+
+    def body(self):
+        return {self.key: str(self)}
+
+
+def bearer_user(headers, key='message'):
+    # Логин из заголовка Authorization: Bearer <логин>
+    auth_header = headers.get('Authorization')
+    if not auth_header or not auth_header.startswith("Bearer "):
+        raise InvalidRequest("Unauthorized", 401, key)
+    return auth_header.split(" ")[1]
+
+
+def login_cookie(username):
+    return f"user={username}; Path=/; SameSite=Lax"
+
+
+def with_ratings(args):
+    # ?with_ratings=1 -- сводка оценок в ответах каталога
+    return args.get('with_ratings', '').lower() in ('1', 'true', 'yes')
+
+
+def rating_tables(args):
+    # Ответ со сводкой оценок меняется и при новых отзывах
+    return ('reviews',) if with_ratings(args) else ()
+
+
+def products_request(args):
+    # GET /products: (именованный запрос или None, текст запроса, форма строк, страница).
+    # Каталог без фильтра выбирается именованными запросами реестра
+    page = PRODUCTS_PAGE.parse(args)
+    if with_ratings(args):
+        statement, query, shape = 'products_rated', PRODUCTS_RATED_QUERY, PRODUCT_RATED_ROW
+    else:
+        statement, query, shape = 'products', PRODUCTS_QUERY, PRODUCT_ROW
+    category = args.get('category', '')
+    if category:
+        return None, query + category_filter(category), shape, page
+    return statement, query, shape, page
+
+
+def page_statement(statement, page):
+    return f"{statement}_page_after" if page.after else f"{statement}_page"
+
+
+def paged_query(query, page):
+    return query + page.clause() if page else query
+
+
+def split_page(rows, page):
+    # (строки страницы, курсор следующей страницы или None)
+    return page.split(rows) if page else (rows, None)
+
+
+def search_args(args):
+    # Параметры именованного запроса поиска (search.search_statement)
+    terms = search_terms(args.get('q'))
+    if not terms:
+        raise InvalidRequest("Search query is required")
+    try:
+        limit = int(args.get('limit', SEARCH_LIMIT_DEFAULT))
+    except ValueError:
+        raise InvalidRequest("Invalid limit")
+    if limit <= 0:
+        raise InvalidRequest("Invalid limit")
+    return search_query(terms), min(limit, PAGE_LIMIT_MAX), SEARCH_RANK_WINDOW
+
+
+def review_input(data):
+    review_text = data.get('review')
+    rating = data.get('rating', 5)
+    if not review_text or not rating:
+        raise InvalidRequest("Review text and rating are required", key='error')
+    return review_text, rating
+
+
+def required_fields(data, *fields):
+    # Значения полей тела запроса; пустое поле -- 400
+    values = [data.get(field) for field in fields]
+    if not all(values):
+        raise InvalidRequest("Invalid request data")
+    return values
+
+
+def profile_description(data):
+    if not data or 'description' not in data:
+        raise InvalidRequest("Invalid data")
+    return data['description']
+
+
+# Формат профиля; общий для /profile и /profile/summary
+def user_profile_item(user):
+    return {
+        "username": user['login'],
+        "name": user['name'],
+        "birthDate": user['birth_date'],
+        "address": user['address'],
+        "phone": user['phone_number'],
+        "description": user['description']
+    }
+
+
+def profile_summary(user, favorites, reviews, orders):
+    # Без строки профиля списки все равно отдаются (profile: null),
+    # как раньше отдавали их отдельные роуты
+    return {
+        "profile": user_profile_item(user) if user else None,
+        "favorites": favorites,
+        "reviews": reviews,
+        "orders": orders
+    }
+
+
+def order_lines(data):
+    # Позиции заказа [(артикул, количество, цена)] и {артикул: количество}.
+    # 5 и "5" -- один товар: позиции группируются по числовому артикулу
+    if not data or 'orders' not in data:
+        raise InvalidRequest("Invalid data")
+    orders = data['orders']
+    if not orders or not isinstance(orders, list):
+        raise InvalidRequest("Orders should be a list")
+
+    lines = []
+    totals = {}
+    for order in orders:
+        if not isinstance(order, dict):
+            raise InvalidRequest("Invalid order data")
+        article = order.get('article')
+        quantity = order.get('quantity', 1)
+        price = order.get('price')
+        if not article or not price or not isinstance(quantity, (int, float)) or quantity <= 0:
+            raise InvalidRequest("Invalid order data")
+        try:
+            article = int(article)
+        except (TypeError, ValueError):
+            raise InvalidRequest("Invalid order data")
+        lines.append((article, quantity, price))
+        totals[article] = totals.get(article, 0) + quantity
+    return lines, totals
+
+
+class InsufficientStock(Exception):
+    pass
+
+
+def find_insufficient_article(lines, stock_rows):
+    # Первая позиция заказа, на которую не хватило остатка
+    stock = {str(row['article']): row['stock'] for row in stock_rows}
+    ordered = {}
+    for article, quantity, _ in lines:
+        ordered[article] = ordered.get(article, 0) + quantity
+        available = stock.get(str(article))
+        if available is None or available < ordered[article]:
+            return article
+    return lines[0][0]
+
+
+def insufficient_stock_body(lines, totals, stock_rows):
+    # totals -- позиции, списанные UPDATE (без зарезервированных в памяти)
+    cold_lines = [line for line in lines if line[0] in totals]
+    return {"message": f"Insufficient stock for article {find_insufficient_article(cold_lines, stock_rows)}"}
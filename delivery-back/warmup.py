@@ -0,0 +1,100 @@
+import itertools
+import logging
+import os
+import threading
+import time
+
+import db
+
+# Прогрев воркера: пул соединений заполняется, запросы реестра
+# подготавливаются на каждом соединении, каталог запрашивается через
+# тестовый клиент (кэши БД, ленивые инициализации Flask, конвертеры строк).
+# До окончания прогрева роут /ready отвечает 503; после WARMUP_MAX_ATTEMPTS
+# неудачных попыток воркер все равно объявляется готовым.
+
+WARMUP_ENABLED = os.getenv('WARMUP', '1') == '1'
+WARMUP_RETRY_INTERVAL = float(os.getenv('WARMUP_RETRY_INTERVAL', 2))
+WARMUP_MAX_ATTEMPTS = int(os.getenv('WARMUP_MAX_ATTEMPTS', 5))
+# Пути каталога относительно префикса API
+WARMUP_PATHS = ('/categories', '/products?limit=50')
+# Необязательные пути: зависят от таблиц, которых может не быть
+# (product_rating_stats создает ratings.py); ошибка только пишется в лог
+WARMUP_OPTIONAL_PATHS = ('/products?limit=50&with_ratings=1',)
+
+logger = logging.getLogger(__name__)
+
+_ready = threading.Event()
+_timings = {}
+
+
+def is_ready():
+    return _ready.is_set()
+
+
+def timings():
+    return dict(_timings)
+
+
+def check_response(path, status_code):
+    # Ошибка обязательного пути -- прогрев повторяется
+    if status_code < 500:
+        return
+    if path in WARMUP_OPTIONAL_PATHS:
+        logger.warning(f"Warm-up skipped {path}: returned {status_code}")
+        return
+    raise RuntimeError(f"{path} returned {status_code}")
+
+
+def give_up(attempt, error):
+    # True -- попытки кончились, воркер объявляется готовым без прогрева
+    if attempt < WARMUP_MAX_ATTEMPTS:
+        logger.error(f"Warm-up failed, retrying in {WARMUP_RETRY_INTERVAL}s: {error}")
+        return False
+    logger.error(f"Warm-up failed {attempt} times, marking worker ready: {error}")
+    _timings['warmup_failed'] = True
+    _ready.set()
+    return True
+
+
+def mark_ready(steps, started, boot=None):
+    # steps -- {шаг: секунды}; boot -- время старта сервера (time.time())
+    _timings.update({f"{name}_ms": round(seconds * 1000, 1) for name, seconds in steps.items()})
+    _timings['warmup_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    if boot is not None:
+        _timings['since_boot_ms'] = round((time.time() - boot) * 1000, 1)
+    _ready.set()
+    logger.info("Warm-up done: " + ", ".join(f"{name}={value}" for name, value in _timings.items()))
+
+
+def warm_up(app, prefix, boot=None):
+    started = time.perf_counter()
+    steps = {}
+    step = time.perf_counter()
+    db.get_pool().warm(db.prepare_statements)
+    steps['pool'] = time.perf_counter() - step
+
+    step = time.perf_counter()
+    client = app.test_client()
+    for path in WARMUP_PATHS + WARMUP_OPTIONAL_PATHS:
+        check_response(path, client.get(prefix + path).status_code)
+    steps['catalog'] = time.perf_counter() - step
+    mark_ready(steps, started, boot)
+
+
+def start(app, prefix, boot=None):
+    # Прогрев в фоне; при недоступной БД повторяется до WARMUP_MAX_ATTEMPTS раз
+    if not WARMUP_ENABLED:
+        _ready.set()
+        return
+
+    def run():
+        for attempt in itertools.count(1):
+            try:
+                warm_up(app, prefix, boot)
+                return
+            except Exception as e:
+                if give_up(attempt, e):
+                    return
+                time.sleep(WARMUP_RETRY_INTERVAL)
+
+    threading.Thread(target=run, name='warm-up', daemon=True).start()